@@ -1,10 +1,10 @@
 from airflow import DAG
-from airflow.operators.python import PythonOperator
+from airflow.decorators import task, task_group
 from datetime import datetime, timedelta
-import data_validator
-import data_transformer
-import stats_calculator
-import quality_reporter
+from stages import run_stage
+
+# Only the stage names are imported here: each task imports its stage module (pandas, pyarrow, pydantic)
+# when it runs, so parsing this file stays cheap for the scheduler
 
 # Define default arguments for the DAG
 default_args = {
@@ -25,29 +25,42 @@ with DAG(
     start_date=datetime(2025, 7, 1),
     catchup=False,
 ) as dag:
+    # Fan out: one shard per hospital found in the inputs
+    @task
+    def discover_partitions():
+        return run_stage("discover_partitions")
+
     # Task to validate data
-    validate_data = PythonOperator(
-        task_id="validate_data",
-        python_callable=data_validator.validate_data,
-    )
+    @task
+    def validate_data(partition):
+        return run_stage("validate_data", partition=partition)
 
     # Task to transform data
-    transform_data = PythonOperator(
-        task_id="transform_data",
-        python_callable=data_transformer.transform_data,
-    )
+    @task
+    def transform_data(partition):
+        return run_stage("transform_data", partition=partition)
 
     # Task to calculate statistics
-    calculate_statistics = PythonOperator(
-        task_id="calculate_statistics",
-        python_callable=stats_calculator.calculate_statistics,
-    )
+    @task
+    def calculate_statistics(partition):
+        return run_stage("calculate_statistics", partition=partition)
+
+    # Task to calculate per-patient time-series features
+    @task
+    def calculate_features(partition):
+        return run_stage("calculate_features", partition=partition)
+
+    # Reduce: final stats, features, hospital summary and quality report from the shards' outputs
+    @task
+    def merge_partitions(partitions):
+        return run_stage("merge_partitions", partitions=list(partitions))
 
-    # Task to generate quality report
-    generate_quality_report = PythonOperator(
-        task_id="generate_quality_report",
-        python_callable=quality_reporter.generate_quality_report,
-    )
+    # One mapped instance of the group per hospital; a shard moves on as soon as its own previous task is done
+    @task_group
+    def hospital_shard(partition):
+        transformed = validate_data(partition) >> transform_data(partition)
+        transformed >> [calculate_statistics(partition), calculate_features(partition)]
 
     # Set task dependencies
-    validate_data >> transform_data >> [calculate_statistics, generate_quality_report]
\ No newline at end of file
+    partitions = discover_partitions()
+    hospital_shard.expand(partition=partitions) >> merge_partitions(partitions)
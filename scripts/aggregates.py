@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+
+# Fixed seed so that the same updates in the same order always give the same sketch
+SKETCH_SEED = 0
+
+
+def sketch_capacity(error):
+    # Each compaction shifts ranks by at most its item weight; with random offsets the total
+    # rank error has a standard deviation of about 1.4 / k, so k = 4 / error keeps it under
+    # the requested relative error with roughly three standard deviations of margin
+    return int(np.ceil(4 / error))
+
+
+class QuantileSketch:
+    # KLL-style mergeable quantile sketch: level h holds at most k items of weight 2**h
+
+    def __init__(self, k, levels=None):
+        self.k = k
+        self.levels = levels if levels is not None else [np.empty(0)]
+        self.rng = np.random.default_rng(SKETCH_SEED)
+
+    def update(self, values):
+        values = np.asarray(values, dtype="float64")
+        self.levels[0] = np.concatenate([self.levels[0], values[~np.isnan(values)]])
+        self.compress()
+
+    def merge(self, other):
+        for height, items in enumerate(other.levels):
+            if height == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[height] = np.concatenate([self.levels[height], items])
+        self.compress()
+
+    def compress(self):
+        # Full levels keep every other sorted item (random offset) at twice the weight one level up
+        height = 0
+        while height < len(self.levels):
+            items = self.levels[height]
+            if len(items) > self.k:
+                items = np.sort(items)
+                leftover = items[len(items) - len(items) % 2:]
+                promoted = items[self.rng.integers(2):len(items) - len(leftover):2]
+                self.levels[height] = leftover
+                if height + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[height + 1] = np.concatenate([self.levels[height + 1], promoted])
+            height += 1
+
+    def quantile(self, q):
+        # Nothing compacted yet: the sketch still holds every value, so the answer is exact
+        if all(len(items) == 0 for items in self.levels[1:]):
+            return float(np.quantile(self.levels[0], q)) if len(self.levels[0]) else np.nan
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2.0 ** height) for height, level in enumerate(self.levels)])
+        order = np.argsort(items, kind="stable")
+        cumulative = np.cumsum(weights[order])
+        return float(items[order][np.searchsorted(cumulative, q * cumulative[-1])])
+
+
+class AggregationState:
+    # Mergeable per-group state: exact sum/count/min/max plus an approximate quantile sketch
+
+    def __init__(self, k, total=0.0, count=0, minimum=np.nan, maximum=np.nan, sketch=None):
+        self.total = total
+        self.count = count
+        self.minimum = minimum
+        self.maximum = maximum
+        self.sketch = sketch if sketch is not None else QuantileSketch(k)
+
+    def update(self, values):
+        values = np.asarray(values, dtype="float64")
+        values = values[~np.isnan(values)]
+        if len(values):
+            self.total += float(values.sum())
+            self.count += len(values)
+            self.minimum = np.fmin(self.minimum, values.min())
+            self.maximum = np.fmax(self.maximum, values.max())
+            self.sketch.update(values)
+
+    def merge(self, other):
+        self.total += other.total
+        self.count += other.count
+        self.minimum = np.fmin(self.minimum, other.minimum)
+        self.maximum = np.fmax(self.maximum, other.maximum)
+        self.sketch.merge(other.sketch)
+
+    def mean(self):
+        return self.total / self.count if self.count else np.nan
+
+    def median(self):
+        return self.sketch.quantile(0.5)
+
+
+class GroupedAggregates:
+    # Aggregation states per (hospital_id, type, month), updated chunk by chunk and merged across runs
+
+    def __init__(self, keys, error):
+        self.keys = keys
+        self.error = error
+        self.k = sketch_capacity(error)
+        self.states = {}
+
+    def update(self, frame, value_col):
+        # Same groups as groupby with a month-end Grouper: rows without a key or date are dropped
+        date_col = self.keys[-1]
+        frame = frame.assign(**{date_col: frame[date_col].dt.normalize() + pd.offsets.MonthEnd(0)})
+        values = frame[value_col].to_numpy(dtype="float64", na_value=np.nan)
+        for key, positions in frame.groupby(self.keys, observed=True, sort=False).indices.items():
+            key = tuple(str(part) if i < len(self.keys) - 1 else part for i, part in enumerate(key))
+            state = self.states.get(key)
+            if state is None:
+                state = self.states[key] = AggregationState(self.k)
+            state.update(values[positions])
+        return self
+
+    def merge(self, other):
+        for key, state in other.states.items():
+            if key in self.states:
+                self.states[key].merge(state)
+            else:
+                self.states[key] = state
+        return self
+
+    def drop(self, predicate):
+        # Forget the groups a predicate selects, e.g. partitions that are about to be recomputed
+        self.states = {key: state for key, state in self.states.items() if not predicate(key)}
+        return self
+
+    def to_stats(self):
+        # Groups come out in key order, however the states were built up or merged
+        rows = [
+            (*key, state.mean(), state.median(), state.minimum, state.maximum, state.count)
+            for key, state in sorted(self.states.items())
+        ]
+        stats = pd.DataFrame(rows, columns=self.keys + ["mean", "median", "min", "max", "count"])
+        return stats.astype({self.keys[-1]: "datetime64[ns]", "count": "int64"})
+
+    def to_frame(self):
+        # Flat representation for Parquet: one row per group, the sketch levels as list columns
+        rows = [
+            (*key, state.total, state.count, state.minimum, state.maximum, self.k,
+             [len(items) for items in state.sketch.levels], np.concatenate(state.sketch.levels))
+            for key, state in sorted(self.states.items())
+        ]
+        columns = self.keys + ["sum", "count", "min", "max", "sketch_k", "sketch_levels", "sketch_items"]
+        frame = pd.DataFrame(rows, columns=columns)
+        return frame.astype({self.keys[-1]: "datetime64[ns]", "count": "int64"})
+
+    @classmethod
+    def from_frame(cls, frame, keys, error):
+        aggregates = cls(keys, error)
+        for row in frame.to_dict("records"):
+            sizes = np.asarray(row["sketch_levels"], dtype="int64")
+            levels = np.split(np.asarray(row["sketch_items"], dtype="float64"), np.cumsum(sizes)[:-1])
+            sketch = QuantileSketch(int(row["sketch_k"]), levels)
+            key = tuple(str(row[col]) for col in keys[:-1]) + (pd.Timestamp(row[keys[-1]]),)
+            aggregates.states[key] = AggregationState(int(row["sketch_k"]), row["sum"], row["count"],
+                                                      row["min"], row["max"], sketch)
+        return aggregates
@@ -0,0 +1,162 @@
+import argparse
+import json
+import logging
+import math
+import os
+import subprocess
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from config_model import load_config, resolve_config_path
+from data_generator import generate_data
+from stages import STAGES
+
+logger = logging.getLogger(__name__)
+
+# Config fields that change performance; results are only compared when they match
+SETTINGS = ["streaming_enabled", "chunk_size", "workers", "median_mode", "parquet_compression"]
+
+BENCHMARK_CONFIG = "benchmark_config.json"
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                                    text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, dirty
+
+
+def run_stage(stage, config_file):
+    # A fresh interpreter per stage, so the peak RSS belongs to that stage alone
+    scripts_dir = str(Path(__file__).resolve().parent)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [scripts_dir, os.environ.get("PYTHONPATH")])))
+    code = f"import stages; stages.run_stage({stage!r}, {config_file!r})"
+    subprocess.run([sys.executable, "-c", code], env=env, check=True)
+
+
+def run_benchmark(config, rows, work_dir, hospitals=10, patients=10000, months=12, dirty_rate=0.02,
+                  invalid_date_rate=0.02, seed=0):
+    # Generate `rows` rows per input file, run every stage and read back the metrics each stage wrote
+    run_dir = Path(work_dir) / f"rows_{rows}"
+    config = dict(config, input_dir=str(run_dir / "input"), output_dir=str(run_dir / "output"), incremental=False,
+                  stage_cache=False)
+    generate_data(config, rows, hospitals, patients, months, dirty_rate, invalid_date_rate, seed)
+
+    config_path = resolve_config_path(BENCHMARK_CONFIG)
+    with open(config_path, "w") as f:
+        json.dump(config, f, indent=2)
+    try:
+        commit, dirty = git_commit()
+        results = []
+        # Stages run in pipeline order
+        for stage in STAGES:
+            run_stage(stage, BENCHMARK_CONFIG)
+            with open(Path(config["output_dir"]) / config["reports_subdir"] / f"{stage}_metrics.json", "r") as f:
+                metrics = json.load(f)
+            results.append({
+                "commit": commit,
+                "dirty": dirty,
+                "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "stage": stage,
+                "rows": rows,
+                **{setting: config[setting] for setting in SETTINGS},
+                "wall_seconds": metrics["wall_seconds"],
+                "cpu_seconds": metrics["cpu_seconds"],
+                "peak_rss_mb": metrics["peak_rss_mb"],
+                "rows_per_second": round(2 * rows / metrics["wall_seconds"], 1) if metrics["wall_seconds"] else None,
+            })
+        return results
+    finally:
+        os.remove(config_path)
+
+
+def load_results(path):
+    if not Path(path).exists():
+        return []
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_results(results, path):
+    # One JSON object per line; the file is kept between commits so runs can be compared
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as f:
+        for result in results:
+            f.write(json.dumps(result) + "\n")
+
+
+def find_regressions(results, history, threshold=0.1):
+    # Compare each result with the latest one of another commit for the same stage, size and settings
+    regressions = []
+    for result in results:
+        key = [result["stage"], result["rows"]] + [result[setting] for setting in SETTINGS]
+        previous = [
+            old for old in history
+            if old["commit"] != result["commit"]
+            and [old["stage"], old["rows"]] + [old.get(setting) for setting in SETTINGS] == key
+        ]
+        if not previous or not previous[-1]["rows_per_second"] or not result["rows_per_second"]:
+            continue
+        baseline = previous[-1]
+        change = result["rows_per_second"] / baseline["rows_per_second"] - 1
+        if change < -threshold:
+            regressions.append({"stage": result["stage"], "rows": result["rows"], "baseline_commit": baseline["commit"],
+                                "baseline_rows_per_second": baseline["rows_per_second"],
+                                "rows_per_second": result["rows_per_second"], "change": round(change, 3)})
+    return regressions
+
+
+def scaling_exponents(results):
+    # Per stage, the least-squares slope of log(wall seconds) against log(rows) over this run's sizes:
+    # about 1 for a stage that scales linearly, clearly above 1 for a superlinear one
+    points = {}
+    for result in results:
+        if result["wall_seconds"]:
+            points.setdefault(result["stage"], []).append((math.log(result["rows"]), math.log(result["wall_seconds"])))
+    exponents = {}
+    for stage, xy in points.items():
+        if len({x for x, _ in xy}) < 2:
+            continue
+        mean_x = sum(x for x, _ in xy) / len(xy)
+        mean_y = sum(y for _, y in xy) / len(xy)
+        slope = sum((x - mean_x) * (y - mean_y) for x, y in xy) / sum((x - mean_x) ** 2 for x, _ in xy)
+        exponents[stage] = round(slope, 2)
+    return exponents
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic data")
+    parser.add_argument("--config", default="pipeline_config.json", help="Base config file name in the config directory")
+    parser.add_argument("--rows", type=float, nargs="+", default=[1e4, 1e5, 1e6], help="Rows per input file, e.g. 1e4 1e6 1e8")
+    parser.add_argument("--work-dir", default="./data/benchmark", help="Directory for the generated inputs and outputs")
+    parser.add_argument("--results", default="./docs/benchmarks/results.jsonl", help="Results file, appended to")
+    parser.add_argument("--hospitals", type=int, default=10)
+    parser.add_argument("--patients", type=int, default=10000)
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--dirty-rate", type=float, default=0.02)
+    parser.add_argument("--invalid-date-rate", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threshold", type=float, default=0.1, help="Throughput drop reported as a regression")
+    args = parser.parse_args()
+
+    base_config = load_config(args.config).model_dump(mode="json")
+    history = load_results(args.results)
+    results = []
+    for rows in args.rows:
+        results += run_benchmark(base_config, int(rows), args.work_dir, args.hospitals, args.patients, args.months,
+                                 args.dirty_rate, args.invalid_date_rate, args.seed)
+    append_results(results, args.results)
+
+    for result in results:
+        logger.info(f"{result['stage']} {result['rows']} rows: {result['wall_seconds']} s, "
+                    f"{result['rows_per_second']} rows/s, peak {result['peak_rss_mb']} MB")
+    for stage, exponent in scaling_exponents(results).items():
+        logger.info(f"{stage} scales as rows^{exponent}")
+    regressions = find_regressions(results, history, args.threshold)
+    for regression in regressions:
+        logger.warning(f"Regression: {json.dumps(regression)}")
+    sys.exit(1 if regressions else 0)
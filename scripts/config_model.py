@@ -1,9 +1,28 @@
-from pydantic import BaseModel
-from typing import List, Dict
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr
+from typing import List, Dict, Literal
+import json
+import os
+from range_checker import range_table
+from issue_collector import rule_mask
+from unit_converter import conversion_table
+
+
+class UnitConversion(BaseModel):
+    # value_in_unit = value * factor + offset
+    model_config = ConfigDict(frozen=True)
+
+    unit: str
+    factor: float = Field(1.0, gt=0)
+    offset: float = 0.0
+
 
 class PipelineConfig(BaseModel):
+    # Shared by every caller in the process, so it cannot be changed after loading
+    model_config = ConfigDict(frozen=True)
+
     input_dir: str
     output_dir: str
+    # Input file name, glob pattern (e.g. "vitals/*_2025-*.csv") or directory of CSV files, under input_dir
     vitals_file: str
     labs_file: str
     vitals_sep: str
@@ -13,8 +32,139 @@ class PipelineConfig(BaseModel):
     stats_subdir: str
     reports_subdir: str
     issues_file: str
+    # Validation issues as JSON records: per-rule counts with a sample of the offending row ids
+    issues_records_file: str = "validation_issues.json"
+    issue_sample_size: int = Field(20, ge=0)
+    # Sample size overrides by rule, e.g. {"missing_value": 5}
+    issue_sample_sizes: Dict[str, int] = {}
+    # Warnings logged per rule while validating; the rest are counted and reported once
+    issue_log_limit: int = Field(10, ge=0)
+    # Rows failing any of these rules go to the quarantine dataset instead of the validated one.
+    # Out-of-range labs stay: they are the abnormal results the later stages report on
+    quarantine_subdir: str = "quarantine"
+    quarantine_rules: Dict[Literal["vitals", "labs"], List[Literal[
+        "non_numeric", "invalid_numeric", "invalid_date", "unparseable_reference_range", "out_of_range", "missing_value"
+    ]]] = {"vitals": ["invalid_numeric", "invalid_date", "out_of_range"], "labs": ["invalid_numeric", "invalid_date"]}
     date_format: str
+    # Tried in order for dates that do not match date_format, before parsing them one by one;
+    # month before day, as the per-element parser reads ambiguous dates
+    date_fallback_formats: List[str] = ["%Y/%m/%d", "%m/%d/%Y", "%m-%d-%Y"]
     vitals_columns: List[str]
     labs_columns: List[str]
     vital_ranges: Dict[str, Dict[str, float]]
-    lab_ranges: Dict[str, Dict[str, float]]
\ No newline at end of file
+    lab_ranges: Dict[str, Dict[str, float]]
+    # Type -> source unit -> conversion into the unit the ranges and statistics are in; other units are kept
+    unit_conversions: Dict[str, Dict[str, UnitConversion]] = Field({
+        "temperature": {"F": {"unit": "C", "factor": 5 / 9, "offset": -160 / 9}},
+        "glucose": {"mmol/L": {"unit": "mg/dL", "factor": 18.0}},
+        "hemoglobin": {"g/L": {"unit": "g/dL", "factor": 0.1}},
+        "cholesterol": {"mmol/L": {"unit": "mg/dL", "factor": 38.67}},
+    }, validate_default=True)
+    # Streaming mode: process the validate/transform stages chunk by chunk
+    streaming_enabled: bool = False
+    chunk_size: int = Field(100000, gt=0)
+    # Intermediate stage outputs are Parquet; CSV copies are an optional export
+    parquet_compression: str = "zstd"
+    export_csv: bool = False
+    # Also keep the transformed data as uncompressed Arrow IPC, memory-mapped by the statistics and quality stages
+    transformed_ipc: bool = False
+    # Also write the transformed data and stats as datasets partitioned by hospital_id/year/month, read by load_stats
+    partitioned_datasets: bool = False
+    # Incremental mode: only new or changed (hospital_id, month) partitions are processed
+    incremental: bool = False
+    manifest_file: str = "manifest.json"
+    # The DAG maps validate/transform/stats over hospital shards, each writing under output_dir/shards_subdir
+    shards_subdir: str = "shards"
+    # Per-patient time-series features: means over the last readings and over the last days, current one included
+    features_subdir: str = "features"
+    feature_window_readings: int = Field(3, ge=1)
+    feature_window_days: int = Field(30, ge=1)
+    # Median of the monthly stats: exact, or from a mergeable quantile sketch with this relative rank error
+    median_mode: Literal["exact", "sketch"] = "exact"
+    median_error: float = Field(0.01, gt=0, lt=1)
+    # Process pool size; work is sharded by hospital, or by hashed patient_id for the row-wise stages
+    workers: int = Field(1, ge=1)
+    shard_by: Literal["hospital_id", "patient_id"] = "hospital_id"
+    # Read, process and write the vitals and labs datasets side by side in threads
+    concurrent_io: bool = True
+    # Input files read ahead side by side per dataset, when a dataset has several
+    read_threads: int = Field(4, ge=1)
+    # Reuse a stage's earlier outputs when its inputs, config fields and code are unchanged (not in incremental mode);
+    # least recently used entries are evicted beyond cache_max_bytes
+    stage_cache: bool = False
+    cache_dir: str = "./data/cache"
+    cache_max_bytes: int = Field(10 * 1024 ** 3, gt=0)
+
+    # Derived once per load instead of once per chunk
+    _vital_range_table = PrivateAttr()
+    _lab_range_table = PrivateAttr()
+    _column_sets = PrivateAttr()
+    _date_formats = PrivateAttr()
+    _quarantine_masks = PrivateAttr()
+    _unit_table = PrivateAttr()
+
+    def model_post_init(self, __context):
+        self._vital_range_table = range_table(self.vital_ranges)
+        self._lab_range_table = range_table(self.lab_ranges)
+        self._column_sets = {"vitals": frozenset(self.vitals_columns), "labs": frozenset(self.labs_columns)}
+        self._date_formats = (self.date_format, *self.date_fallback_formats)
+        self._quarantine_masks = {dataset: rule_mask(self.quarantine_rules.get(dataset, [])) for dataset in ("vitals", "labs")}
+        self._unit_table = conversion_table({
+            type_name: {unit: conversion.model_dump() for unit, conversion in units.items()}
+            for type_name, units in self.unit_conversions.items()
+        })
+
+    def __getitem__(self, key):
+        # Stages read settings as config["key"], as they did from the plain dict
+        return getattr(self, key)
+
+    @property
+    def vital_range_table(self):
+        return self._vital_range_table
+
+    @property
+    def lab_range_table(self):
+        return self._lab_range_table
+
+    @property
+    def column_sets(self):
+        return self._column_sets
+
+    @property
+    def date_formats(self):
+        return self._date_formats
+
+    @property
+    def quarantine_masks(self):
+        return self._quarantine_masks
+
+    @property
+    def unit_table(self):
+        return self._unit_table
+
+
+def resolve_config_path(config_file="pipeline_config.json"):
+    # Determine config path based on environment
+    config_dir = "/opt/airflow/config" if os.environ.get("DOCKER_ENV", "false").lower() == "true" else "./config"
+    config_path = os.path.join(config_dir, config_file)
+    if config_file == "test_pipeline_config.json" and os.environ.get("TEST_MODE", "false").lower() != "true":
+        config_path = os.path.join(config_dir, "pipeline_config.json")
+    return config_path
+
+
+# Config path -> (mtime, size, PipelineConfig) of the last load in this process
+_config_cache = {}
+
+
+def load_config(config_file="pipeline_config.json"):
+    # Load and validate each config file once per process; an edited file is reloaded on the next call
+    config_path = resolve_config_path(config_file)
+    stat = os.stat(config_path)
+    cached = _config_cache.get(config_path)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    with open(config_path, "r") as f:
+        config_data = json.load(f)
+    config = PipelineConfig(**config_data)
+    _config_cache[config_path] = (stat.st_mtime_ns, stat.st_size, config)
+    return config
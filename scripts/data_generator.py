@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+import argparse
+import logging
+from pathlib import Path
+from config_model import load_config
+
+logger = logging.getLogger(__name__)
+
+# Type -> (unit, mean, standard deviation) of the generated values
+VITAL_TYPES = {
+    "blood_pressure_systolic": ("mmHg", 120.0, 20.0),
+    "blood_pressure_diastolic": ("mmHg", 80.0, 12.0),
+    "heart_rate": ("bpm", 75.0, 15.0),
+    "temperature": ("C", 37.0, 0.6),
+}
+
+# Type -> (unit, reference range, mean, standard deviation)
+LAB_TYPES = {
+    "hemoglobin": ("g/dL", "12-17", 14.5, 2.0),
+    "glucose": ("mg/dL", "70-100", 95.0, 20.0),
+    "cholesterol": ("mg/dL", "125-200", 180.0, 35.0),
+}
+
+# Invalid raw values, like the ones found in the hospital extracts
+DIRTY_VALUES = ["abc", "n/a", "12,5"]
+INVALID_DATES = ["invalid_date", "13-25-1980", "2024-02-30"]
+
+CHUNK_ROWS = 1_000_000
+
+
+def patient_table(patients, hospitals, seed=0):
+    # Each patient belongs to one hospital and has one date of birth
+    rng = np.random.default_rng([seed, 0])
+    width = max(5, len(str(patients - 1)))
+    birth_days = rng.integers(0, 365 * 80, size=patients)
+    return pd.DataFrame({
+        "patient_id": [f"P{i:0{width}d}" for i in range(patients)],
+        "hospital_id": [f"H{i % hospitals + 1:03d}" for i in range(patients)],
+        "date_of_birth": (pd.Timestamp("1930-01-01") + pd.to_timedelta(birth_days, unit="D")).strftime("%Y-%m-%d"),
+    })
+
+
+def corrupt(column, rate, bad_values, rng):
+    # Replace a share of the values: half with missing values, half with unparseable strings
+    hit = rng.random(len(column)) < rate
+    if not hit.any():
+        return column
+    column = column.astype(object)
+    missing = hit & (rng.random(len(column)) < 0.5)
+    column[hit] = rng.choice(bad_values, size=hit.sum())
+    column[missing] = None
+    return column
+
+
+def generate_chunk(kind, rows, patients, months, dirty_rate=0.02, invalid_date_rate=0.02, seed=0, chunk=0,
+                   start="2024-01-01"):
+    # One chunk of vitals or lab rows; every chunk has its own random stream, so files are reproducible
+    rng = np.random.default_rng([seed, 1 if kind == "vitals" else 2, chunk])
+    types = VITAL_TYPES if kind == "vitals" else LAB_TYPES
+    type_names = np.array(list(types))
+    type_index = rng.integers(0, len(types), size=rows)
+    means = np.array([spec[-2] for spec in types.values()])[type_index]
+    stds = np.array([spec[-1] for spec in types.values()])[type_index]
+
+    end = pd.Timestamp(start) + pd.DateOffset(months=months) - pd.Timedelta(days=1)
+    dates = pd.date_range(start, end, freq="D").strftime("%Y-%m-%d").to_numpy()
+
+    patient_index = rng.integers(0, len(patients), size=rows)
+    values = np.round(rng.normal(means, stds), 1)
+    date_col, type_col, value_col = (("measurement_date", "vital_type", "value") if kind == "vitals"
+                                     else ("test_date", "test_type", "result_value"))
+    frame = pd.DataFrame({
+        "hospital_id": patients["hospital_id"].to_numpy()[patient_index],
+        date_col: dates[rng.integers(0, len(dates), size=rows)],
+        "patient_id": patients["patient_id"].to_numpy()[patient_index],
+        type_col: type_names[type_index],
+        value_col: corrupt(values, dirty_rate, DIRTY_VALUES, rng),
+    })
+    if kind == "labs":
+        frame["reference_range"] = np.array([spec[1] for spec in types.values()])[type_index]
+    frame["unit"] = np.array([spec[0] for spec in types.values()])[type_index]
+    frame["date_of_birth"] = corrupt(patients["date_of_birth"].to_numpy()[patient_index], invalid_date_rate,
+                                     INVALID_DATES, rng)
+    return frame
+
+
+def write_dataset(kind, path, sep, columns, rows, patients, months, dirty_rate, invalid_date_rate, seed, chunk_rows):
+    # Written chunk by chunk, so files far larger than memory can be generated
+    path.parent.mkdir(parents=True, exist_ok=True)
+    for chunk, offset in enumerate(range(0, rows, chunk_rows)):
+        frame = generate_chunk(kind, min(chunk_rows, rows - offset), patients, months, dirty_rate,
+                               invalid_date_rate, seed, chunk)
+        frame.reindex(columns=columns).to_csv(path, sep=sep, index=False, mode="w" if chunk == 0 else "a",
+                                              header=chunk == 0)
+    if rows == 0:
+        pd.DataFrame(columns=columns).to_csv(path, sep=sep, index=False)
+
+
+def generate_data(config, rows, hospitals=10, patients=10000, months=12, dirty_rate=0.02, invalid_date_rate=0.02,
+                  seed=0, input_dir=None, chunk_rows=CHUNK_ROWS):
+    # Vitals and lab files with the configured names, separators and columns, `rows` rows each
+    input_path = Path(input_dir if input_dir is not None else config["input_dir"])
+    patient_rows = patient_table(patients, hospitals, seed)
+    write_dataset("vitals", input_path / config["vitals_file"], config["vitals_sep"], config["vitals_columns"], rows,
+                  patient_rows, months, dirty_rate, invalid_date_rate, seed, chunk_rows)
+    write_dataset("labs", input_path / config["labs_file"], config["labs_sep"], config["labs_columns"], rows,
+                  patient_rows, months, dirty_rate, invalid_date_rate, seed, chunk_rows)
+    logger.info(f"Generated {rows} vitals and {rows} lab rows in {input_path}")
+    return input_path
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Generate synthetic multi-hospital vitals and lab files")
+    parser.add_argument("--config", default="pipeline_config.json", help="Config file name in the config directory")
+    parser.add_argument("--rows", type=int, default=10000, help="Rows per file")
+    parser.add_argument("--hospitals", type=int, default=10)
+    parser.add_argument("--patients", type=int, default=10000)
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--dirty-rate", type=float, default=0.02, help="Share of missing or non-numeric values")
+    parser.add_argument("--invalid-date-rate", type=float, default=0.02, help="Share of missing or invalid dates of birth")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--input-dir", help="Output directory, defaults to the configured input_dir")
+    args = parser.parse_args()
+    generate_data(load_config(args.config), args.rows, args.hospitals, args.patients, args.months, args.dirty_rate,
+                  args.invalid_date_rate, args.seed, args.input_dir)
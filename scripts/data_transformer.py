@@ -1,48 +1,124 @@
-import pandas as pd
 import logging
+from functools import partial
 from pathlib import Path
-import json
-import os
-from config_model import PipelineConfig
-
-def transform_data(config_file="pipeline_config.json"):
-    logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(__name__)
-
-    config_dir = "/opt/airflow/config" if os.environ.get("DOCKER_ENV", "false").lower() == "true" else "./config"
-    config_path = os.path.join(config_dir, config_file if config_file != "test_pipeline_config.json" else config_file)
-    if config_file == "test_pipeline_config.json" and os.environ.get("TEST_MODE", "false").lower() != "true":
-        config_path = os.path.join(config_dir, "pipeline_config.json")
-
-    try:
-        with open(config_path, "r") as f:
-            config_data = json.load(f)
-        config = PipelineConfig(**config_data).model_dump()
-
-        input_dir = config["output_dir"]  # Using validated output as input
-        output_dir = config["output_dir"]
-        vitals_file = config["vitals_file"]
-        labs_file = config["labs_file"]
-        vitals_sep = config["vitals_sep"]
-        labs_sep = config["labs_sep"]
-        transformed_subdir = config["transformed_subdir"]
-
-        input_path = Path(input_dir) / "validated"
-        output_path = Path(output_dir) / transformed_subdir
-
-        vitals = pd.read_csv(input_path / vitals_file, sep=vitals_sep)
-        labs = pd.read_csv(input_path / labs_file, sep=labs_sep)
-
-        # Example transformation: Add a transformed column
-        vitals["transformed_value"] = vitals["value"] * 2
-        labs["transformed_result"] = labs["result_value"] * 1.5
-
-        output_path.mkdir(parents=True, exist_ok=True)
-        vitals.to_csv(output_path / vitals_file, sep=vitals_sep, index=False)
-        labs.to_csv(output_path / labs_file, sep=labs_sep, index=False)
-
-        logger.info("Data transformation completed")
-
-    except Exception as e:
-        logger.error(f"Transformation failed: {e}")
-        raise
\ No newline at end of file
+from config_model import load_config
+from dataset_io import (read_parquet_frames, DatasetWriter, dataset_path, export_ipc, export_name, export_partitioned,
+                        read_partitioned, drop_partitioned)
+from range_checker import resolve_bounds, count_out_of_range
+from date_parser import parse_dates, age_in_years
+from unit_converter import resolve_conversions, convert_values
+from schemas import CLEAN_VITALS_SCHEMA, CLEAN_LABS_SCHEMA, PATIENT_INDEX_SCHEMA
+from patient_index import INDEX_FILE, DATE_COLUMNS, partial_index, combine_index
+from parallel import worker_pool, split_shards, map_shards, combine_shards, run_concurrently
+from instrumentation import step, record_memory
+from stage_cache import run_stage_task
+
+logger = logging.getLogger(__name__)
+
+
+def derive_columns(frame, config, value_col, type_col, date_col, ranges, reference_col=None):
+    # Whole-column operations only: each distinct date, (type, unit) pair and reference range is resolved once
+    date_format, *fallback_formats = config.date_formats
+    for col in (date_col, "date_of_birth"):
+        if col in frame.columns:
+            frame[col] = parse_dates(frame[col], date_format, fallback_formats)
+    if "date_of_birth" in frame.columns:
+        frame["age"] = age_in_years(frame["date_of_birth"], frame[date_col])
+
+    # Values in the units the ranges and statistics are in
+    conversions = None
+    if "unit" in frame.columns:
+        conversions = resolve_conversions(frame[type_col], frame["unit"], config.unit_table)
+        frame[value_col] = convert_values(frame[value_col], conversions)
+        frame["unit"] = conversions["unit"]
+
+    # Flag values outside the configured range (or the row's reference_range, converted alike)
+    bounds = resolve_bounds(frame, type_col, ranges, reference_col=reference_col, conversions=conversions)
+    frame["is_abnormal"], _ = count_out_of_range(frame[type_col], frame[value_col], bounds)
+    return frame
+
+
+def transform_vitals(vitals, config):
+    return derive_columns(vitals, config, "value", "vital_type", "measurement_date", config.vital_range_table)
+
+
+def transform_labs(labs, config):
+    return derive_columns(labs, config, "result_value", "test_type", "test_date", config.lab_range_table,
+                          reference_col="reference_range")
+
+
+TRANSFORMS = {"vitals": transform_vitals, "labs": transform_labs}
+SCHEMAS = {"vitals": CLEAN_VITALS_SCHEMA, "labs": CLEAN_LABS_SCHEMA}
+
+
+def transform_chunk(frame, dataset, config, pool=None):
+    # Serial, or sharded across the process pool and put back in row order
+    with step("transform") as record:
+        record["rows"] += len(frame)
+        if pool is None or frame.empty:
+            return TRANSFORMS[dataset](frame, config)
+        shards = split_shards(frame, config["shard_by"], config["workers"])
+        return combine_shards(map_shards(pool, TRANSFORMS[dataset], shards, config))
+
+
+def transform_file(dataset, config, pool=None):
+    # Transform one validated dataset, one chunk at a time in streaming mode; returns its part of the patient index
+    input_path = Path(config["output_dir"]) / config["validated_subdir"]
+    output_path = Path(config["output_dir"]) / config["transformed_subdir"]
+    chunk_size = config["chunk_size"] if config["streaming_enabled"] else None
+    csv_path = output_path / export_name(config[f"{dataset}_file"], dataset) if config["export_csv"] else None
+
+    parts = []
+    with DatasetWriter(dataset_path(output_path, f"clean_{dataset}"), SCHEMAS[dataset], config["parquet_compression"],
+                       csv_path, config[f"{dataset}_sep"], config["date_format"]) as writer:
+        for frame in read_parquet_frames(input_path / f"{dataset}.parquet", chunk_size=chunk_size):
+            record_memory(dataset, frame)
+            frame = transform_chunk(frame, dataset, config, pool)
+            writer.write(frame)
+            with step("patient_index"):
+                parts.append(partial_index(frame, dataset))
+
+    # The statistics and quality stages map this instead of each decoding the Parquet file
+    if config["transformed_ipc"]:
+        with step("export_ipc"):
+            export_ipc(dataset_path(output_path, f"clean_{dataset}"), dataset_path(output_path, f"clean_{dataset}", ipc=True))
+    # Partitioned by hospital and month for readers that need a few of them; an incremental run only
+    # replaces the partitions it reprocessed
+    if config["partitioned_datasets"]:
+        with step("export_partitioned"):
+            export_partitioned(dataset_path(output_path, f"clean_{dataset}"), output_path / f"clean_{dataset}",
+                               DATE_COLUMNS[dataset], config["parquet_compression"], replace=not config["incremental"])
+    else:
+        drop_partitioned(output_path / f"clean_{dataset}")
+    with step("patient_index"):
+        return combine_index(parts)
+
+
+def load_transformed(kind, hospitals=None, start=None, end=None, columns=None, config_file="pipeline_config.json"):
+    # Transformed rows ("vitals" or "labs") of some hospitals and dates, from the partitioned dataset
+    config = load_config(config_file)
+    return read_partitioned(Path(config["output_dir"]) / config["transformed_subdir"] / f"clean_{kind}", DATE_COLUMNS[kind],
+                            hospitals, start, end, columns)
+
+
+def run_transformation(config, shard):
+    output_path = Path(config["output_dir"]) / config["transformed_subdir"]
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    # Vitals and labs side by side, sharing the process pool
+    with worker_pool(config["workers"]) as pool:
+        parts = run_concurrently([partial(transform_file, dataset, config, pool) for dataset in ("vitals", "labs")],
+                                 config["concurrent_io"])
+
+    # Per-patient counts for the quality report and the hospital rollup, so they need not rescan the rows
+    with step("patient_index"):
+        index = combine_index(parts)
+    with DatasetWriter(output_path / INDEX_FILE, PATIENT_INDEX_SCHEMA, config["parquet_compression"]) as writer:
+        writer.write(index)
+    record_memory("patient_index", index)
+
+    logger.info("Data transformation completed")
+
+
+def transform_data(config_file="pipeline_config.json", partition=None):
+    return run_stage_task("transform_data", config_file, partition, run_transformation, "Transformation failed")
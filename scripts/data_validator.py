@@ -1,160 +1,285 @@
+import numpy as np
 import pandas as pd
 import logging
 from pathlib import Path
 import json
-import os
-from config_model import PipelineConfig
-
-def validate_data(config_file="pipeline_config.json"):
-    # Configure logging
-    logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(__name__)
-
-    # Determine config path based on environment
-    config_dir = "/opt/airflow/config" if os.environ.get("DOCKER_ENV", "false").lower() == "true" else "./config"
-    config_path = os.path.join(config_dir, config_file if config_file != "test_pipeline_config.json" else config_file)
-    if config_file == "test_pipeline_config.json" and os.environ.get("TEST_MODE", "false").lower() != "true":
-        config_path = os.path.join(config_dir, "pipeline_config.json")
-
-    try:
-        # Load and validate configuration
-        with open(config_path, "r") as f:
-            config_data = json.load(f)
-        config = PipelineConfig(**config_data).model_dump()  # Updated from .dict()
-
-        # Extract config values
-        input_dir = config["input_dir"]
-        output_dir = config["output_dir"]
-        vitals_file = config["vitals_file"]
-        labs_file = config["labs_file"]
-        vitals_sep = config["vitals_sep"]
-        labs_sep = config["labs_sep"]
-        validated_subdir = config["validated_subdir"]
-        issues_file = config["issues_file"]
-        date_format = config["date_format"]
-        vitals_columns = config["vitals_columns"]
-        labs_columns = config["labs_columns"]
-        vital_ranges = config["vital_ranges"]
-        lab_ranges = config["lab_ranges"]
-
-        # Define output path
-        output_path = Path(output_dir) / validated_subdir
-
-        # Read input files
-        vitals = pd.read_csv(Path(input_dir) / vitals_file, sep=vitals_sep)
-        labs = pd.read_csv(Path(input_dir) / labs_file, sep=labs_sep)
-
-        issues = []
-
-        # Validate column presence
-        missing_vitals_cols = [col for col in vitals_columns if col not in vitals.columns]
-        if missing_vitals_cols:
-            issues.append(f"Missing columns in {vitals_file}: {missing_vitals_cols}")
-            logger.warning(f"Missing columns in {vitals_file}: {missing_vitals_cols}")
-
-        missing_labs_cols = [col for col in labs_columns if col not in labs.columns]
-        if missing_labs_cols:
-            issues.append(f"Missing columns in {labs_file}: {missing_labs_cols}")
-            logger.warning(f"Missing columns in {labs_file}: {missing_labs_cols}")
-
-        # Convert vitals['value'] to numeric, handle non-numeric values
-        non_numeric_vitals = vitals[~vitals["value"].apply(lambda x: isinstance(x, (int, float)) or (isinstance(x, str) and x.replace(".", "").replace("-", "").isdigit()))]
-        if not non_numeric_vitals.empty:
-            logger.warning(f"Non-numeric values in vitals['value']: {non_numeric_vitals['value'].tolist()}")
-            issues.append(f"Non-numeric values in vitals['value']: {len(non_numeric_vitals)} records")
-
-        vitals["value"] = pd.to_numeric(vitals["value"], errors="coerce")
-        if vitals["value"].isna().any():
-            logger.warning(f"Found {vitals['value'].isna().sum()} invalid numeric values in vitals['value']")
-            issues.append(f"Invalid numeric values in vitals['value']: {vitals['value'].isna().sum()} records")
-
-        # Convert labs['result_value'] to numeric, handle non-numeric values
-        non_numeric_labs = labs[~labs["result_value"].apply(lambda x: isinstance(x, (int, float)) or (isinstance(x, str) and x.replace(".", "").replace("-", "").isdigit()))]
-        if not non_numeric_labs.empty:
-            logger.warning(f"Non-numeric values in labs['result_value']: {non_numeric_labs['result_value'].tolist()}")
-            issues.append(f"Non-numeric values in labs['result_value']: {len(non_numeric_labs)} records")
-
-        labs["result_value"] = pd.to_numeric(labs["result_value"], errors="coerce")
-        if labs["result_value"].isna().any():
-            logger.warning(f"Found {labs['result_value'].isna().sum()} invalid numeric values in labs['result_value']")
-            issues.append(f"Invalid numeric values in labs['result_value']: {labs['result_value'].isna().sum()} records")
-
-        # Validate and standardize date formats
-        for col in ["measurement_date", "date_of_birth"]:
-            try:
-                vitals[col] = pd.to_datetime(vitals[col], format="mixed", errors="coerce")
-                invalid_dates = vitals[vitals[col].isna()][col].index
-                if not invalid_dates.empty:
-                    logger.warning(f"Invalid {col} in vitals: {vitals.loc[invalid_dates, col].tolist()}")
-                    issues.append(f"Invalid {col} in vitals: {len(invalid_dates)} records")
-                vitals[col] = vitals[col].dt.strftime(date_format)
-            except Exception as e:
-                logger.error(f"Failed to parse {col} in vitals: {e}")
-                issues.append(f"Failed to parse {col} in vitals: {e}")
-
-        for col in ["test_date", "date_of_birth"]:
-            try:
-                labs[col] = pd.to_datetime(labs[col], format="mixed", errors="coerce")
-                invalid_dates = labs[labs[col].isna()][col].index
-                if not invalid_dates.empty:
-                    logger.warning(f"Invalid {col} in labs: {labs.loc[invalid_dates, col].tolist()}")
-                    issues.append(f"Invalid {col} in labs: {len(invalid_dates)} records")
-                labs[col] = labs[col].dt.strftime(date_format)
-            except Exception as e:
-                logger.error(f"Failed to parse {col} in labs: {e}")
-                issues.append(f"Failed to parse {col} in labs: {e}")
-
-        # Validate vitals ranges
-        for vital_type, ranges in vital_ranges.items():
-            mask = (vitals["vital_type"] == vital_type) & (
-                (vitals["value"] < ranges["min"]) | (vitals["value"] > ranges["max"])
-            )
-            if mask.any():
-                issues.append(f"Out of range {vital_type}: {len(vitals[mask])} records")
-                logger.warning(f"Out of range {vital_type}: {len(vitals[mask])} records")
-
-        # Validate labs ranges
-        for _, row in labs.iterrows():
-            if pd.notna(row["result_value"]):
-                test_type = row["test_type"]
-                if test_type in lab_ranges:
-                    ref_min, ref_max = lab_ranges[test_type]["min"], lab_ranges[test_type]["max"]
+from functools import partial
+from range_checker import resolve_bounds, count_out_of_range
+from date_parser import parse_dates
+from numeric_checker import coerce_numeric
+from unit_converter import resolve_conversions, convert_values
+from dataset_io import DatasetWriter, atomic_write, read_inputs, export_name
+from schemas import VITALS_SCHEMA, LABS_SCHEMA, QUARANTINE_VITALS_SCHEMA, QUARANTINE_LABS_SCHEMA, CATEGORICAL_COLUMNS, compact
+from partition_manifest import PENDING_FILE, fingerprint_frames, changed_partitions, select_partitions, load_manifest
+from parallel import worker_pool, split_shards, map_shards, combine_shards, run_concurrently
+from instrumentation import step, worker_steps, merge_worker_steps, record_memory
+from stage_cache import run_stage_task
+from hospital_shards import shard_inputs
+from issue_collector import IssueCollector, RULE_BITS, mask_rules
+
+logger = logging.getLogger(__name__)
+
+
+# Issues are listed per dataset in the order of the checks below, whatever the chunking or sharding
+DATASET_ORDER = {"vitals": 0, "labs": 1}
+COLUMNS, NON_NUMERIC, INVALID_NUMERIC, DATES, REFERENCE_RANGE, OUT_OF_RANGE, MISSING = range(7)
+
+# Per dataset: the date its partitions are keyed by, and the validated and quarantine schemas
+DATE_COLUMNS = {"vitals": "measurement_date", "labs": "test_date"}
+SCHEMAS = {"vitals": (VITALS_SCHEMA, QUARANTINE_VITALS_SCHEMA), "labs": (LABS_SCHEMA, QUARANTINE_LABS_SCHEMA)}
+
+
+def validate_frame(frame, name, value_col, type_col, date_cols, ranges, issues, reference_col=None, date_formats=None,
+                   unit_table=None):
+    dataset = DATASET_ORDER[name]
+    rows = frame.index
+    # Every rule a row fails sets its bit, so the rows are split and counted later without re-checking
+    issue_mask = np.zeros(len(frame), dtype=np.uint16)
+
+    # Convert the value column to numeric, handle non-numeric values
+    with step("coerce_numeric") as record:
+        values, non_numeric, sample = coerce_numeric(frame[value_col])
+        record["rows"] += len(frame)
+    non_numeric_rows = rows[non_numeric.to_numpy()]
+    issue_mask[non_numeric.to_numpy()] |= RULE_BITS["non_numeric"]
+    issues.add((dataset, NON_NUMERIC, 0, ""), "non_numeric", name, value_col,
+               f"Non-numeric values in {name}['{value_col}']", non_numeric_rows)
+    if len(non_numeric_rows):
+        issues.warn("non_numeric", f"Non-numeric values in {name}['{value_col}']: {len(non_numeric_rows)} records, e.g. {sample}")
+
+    frame[value_col] = values
+    invalid_numeric = values.isna().to_numpy()
+    issue_mask[invalid_numeric] |= RULE_BITS["invalid_numeric"]
+    issues.add((dataset, INVALID_NUMERIC, 0, ""), "invalid_numeric", name, value_col,
+               f"Invalid numeric values in {name}['{value_col}']", rows[invalid_numeric])
+
+    # Validate dates, keeping them as datetimes for the next stage
+    for i, col in enumerate(date_cols):
+        try:
+            with step("parse_dates") as record:
+                if date_formats is None:
+                    frame[col] = pd.to_datetime(frame[col], format="mixed", errors="coerce")
                 else:
-                    ref_min, ref_max = map(float, row["reference_range"].split("-"))
-                if not (ref_min <= row["result_value"] <= ref_max):
-                    issues.append(f"Out of range {row['test_type']} for patient {row['patient_id']}")
-                    logger.warning(f"Out of range {row['test_type']} for patient {row['patient_id']}")
-
-        # Validate missing values
-        missing_vitals = vitals.isnull().sum()
-        for col, count in missing_vitals.items():
-            if count > 0:
-                issues.append(f"Missing {col} in vitals: {count} records")
-                logger.warning(f"Missing {col} in vitals: {count} records")
-
-        missing_labs = labs.isnull().sum()
-        for col, count in missing_labs.items():
-            if count > 0:
-                issues.append(f"Missing {col} in labs: {count} records")
-                logger.warning(f"Missing {col} in labs: {count} records")
-
-        # Log issues and always create validation_issues.txt
-        output_path.mkdir(parents=True, exist_ok=True)
-        with open(output_path / issues_file, "w") as f:
-            if issues:
-                logger.warning(f"Validation issues: {issues}")
-                f.write("\n".join(issues))
-            else:
-                logger.info("No validation issues found")
-                f.write("No issues detected")
-
-        # Save validated data
-        output_path.mkdir(parents=True, exist_ok=True)
-        vitals.to_csv(output_path / vitals_file, sep=vitals_sep, index=False)
-        labs.to_csv(output_path / labs_file, sep=labs_sep, index=False)
-
-        logger.info("Validation completed")
-
-    except Exception as e:
-        logger.error(f"Validation failed: {e}")
-        raise
\ No newline at end of file
+                    frame[col] = parse_dates(frame[col], date_formats[0], date_formats[1:])
+                record["rows"] += len(frame)
+            invalid_dates = frame[col].isna().to_numpy()
+            issue_mask[invalid_dates] |= RULE_BITS["invalid_date"]
+            issues.add((dataset, DATES, i, ""), "invalid_date", name, col, f"Invalid {col} in {name}", rows[invalid_dates])
+        except Exception as e:
+            logger.error(f"Failed to parse {col} in {name}: {e}")
+            # Not one date of the column is known to be valid
+            issue_mask |= RULE_BITS["invalid_date"]
+            issues.add((dataset, DATES, i, ""), "date_parse_failure", name, col, f"Failed to parse {col} in {name}: {e}")
+
+    with step("range_check") as record:
+        # Validate ranges (config ranges take precedence over a reference_range column), in the converted units;
+        # the values themselves are converted by the transform stage
+        conversions = None
+        values = frame[value_col]
+        if unit_table and "unit" in frame.columns:
+            conversions = resolve_conversions(frame[type_col], frame["unit"], unit_table)
+            values = convert_values(values, conversions)
+        bounds = resolve_bounds(frame, type_col, ranges, reference_col=reference_col, conversions=conversions)
+        if reference_col is not None:
+            unparsed_ranges = frame[value_col].notna() & bounds["min"].isna()
+            issue_mask[unparsed_ranges.to_numpy()] |= RULE_BITS["unparseable_reference_range"]
+            issues.add((dataset, REFERENCE_RANGE, 0, ""), "unparseable_reference_range", name, reference_col,
+                       f"Unparseable {reference_col} in {name}", rows[unparsed_ranges.to_numpy()])
+
+        # Configured types first, in config order, then the others by name
+        range_order = {type_name: i for i, type_name in enumerate(ranges.index)}
+        out_of_range, counts = count_out_of_range(frame[type_col], values, bounds)
+        issue_mask[out_of_range.to_numpy()] |= RULE_BITS["out_of_range"]
+        flagged = frame[type_col][out_of_range.to_numpy()]
+        flagged_rows = flagged.groupby(flagged, observed=True, sort=False).indices
+        for type_name in counts.index:
+            rank = (range_order[type_name], "") if type_name in range_order else (len(range_order), str(type_name))
+            issues.add((dataset, OUT_OF_RANGE) + rank, "out_of_range", name, value_col, f"Out of range {type_name}",
+                       flagged.index[flagged_rows[type_name]], detail=str(type_name))
+        record["rows"] += len(frame)
+
+    # Validate missing values
+    with step("missing_values") as record:
+        missing = frame.isnull()
+        for i, col in enumerate(missing.columns):
+            issues.add((dataset, MISSING, i, ""), "missing_value", name, col, f"Missing {col} in {name}",
+                       rows[missing[col].to_numpy()])
+        missing_count = missing.sum(axis=1).to_numpy()
+        issue_mask[missing_count > 0] |= RULE_BITS["missing_value"]
+        record["rows"] += len(frame)
+
+    frame["issue_mask"] = issue_mask
+    frame["missing_count"] = missing_count.astype(np.uint8)
+    return frame
+
+
+def source_name(frame, default):
+    # The input file a frame was read from (each frame comes from one file)
+    return frame["source_file"].cat.categories[0] if "source_file" in frame.columns else default
+
+
+def check_columns(frame, expected_columns, file_name, name, issues):
+    # Validate column presence, per input file
+    missing_cols = [col for col in expected_columns if col not in frame.columns]
+    if missing_cols:
+        issues.add((DATASET_ORDER[name], COLUMNS, 0, file_name), "missing_columns", name, None,
+                   f"Missing columns in {file_name}: {missing_cols}", detail=missing_cols)
+
+
+def with_columns(frame, expected_columns):
+    # Columns a file lacks (reported by check_columns) are null, so its rows are still checked and counted
+    missing_cols = [col for col in expected_columns if col not in frame.columns]
+    return frame.assign(**dict.fromkeys(missing_cols, np.nan)) if missing_cols else frame
+
+
+def validate_vitals(vitals, config, issues, first=True):
+    if first:
+        check_columns(vitals, config["vitals_columns"], source_name(vitals, config["vitals_file"]), "vitals", issues)
+    vitals = with_columns(vitals, config["vitals_columns"])
+    return validate_frame(vitals, "vitals", "value", "vital_type", ["measurement_date", "date_of_birth"],
+                          config.vital_range_table, issues, date_formats=config.date_formats,
+                          unit_table=config.unit_table)
+
+
+def validate_labs(labs, config, issues, first=True):
+    if first:
+        check_columns(labs, config["labs_columns"], source_name(labs, config["labs_file"]), "labs", issues)
+    labs = with_columns(labs, config["labs_columns"])
+    return validate_frame(labs, "labs", "result_value", "test_type", ["test_date", "date_of_birth"],
+                          config.lab_range_table, issues, reference_col="reference_range",
+                          date_formats=config.date_formats, unit_table=config.unit_table)
+
+
+VALIDATORS = {"vitals": validate_vitals, "labs": validate_labs}
+
+
+def validate_shard(frame, dataset, config, issues):
+    # Worker side: validate one shard into its own issue collector, with its own step metrics
+    with worker_steps() as steps:
+        frame = VALIDATORS[dataset](frame, config, issues, first=False)
+    return frame, issues, steps
+
+
+def validate_chunk(frame, dataset, config, issues, first=True, pool=None):
+    # Serial, or sharded across the process pool and put back in row order
+    if pool is None or frame.empty:
+        return VALIDATORS[dataset](frame, config, issues, first)
+    if first:
+        check_columns(frame, config[f"{dataset}_columns"], source_name(frame, config[f"{dataset}_file"]), dataset, issues)
+    shards = split_shards(frame, config["shard_by"], config["workers"])
+    results = map_shards(pool, validate_shard, shards, dataset, config, issues.spawn())
+    for _, shard_issues, shard_steps in results:
+        issues.merge(shard_issues)
+        merge_worker_steps(shard_steps)
+    return combine_shards([shard for shard, _, _ in results])
+
+
+def split_quarantine(frame, dataset, config):
+    # Rows failing any of the dataset's quarantine rules, with their source row and the rules they failed
+    flagged = (frame["issue_mask"].to_numpy() & config.quarantine_masks[dataset]) != 0
+    quarantined = frame[flagged]
+    quarantined = quarantined.assign(row_id=quarantined.index, failed_rules=mask_rules(quarantined["issue_mask"].to_numpy()))
+    return frame[~flagged], quarantined
+
+
+def write_issues(issues, output_path, config):
+    # Human summary plus the machine-readable records, next to the validated data
+    issues.write(output_path / config["issues_file"], output_path / config["issues_records_file"])
+
+
+def validate_file(dataset, config, issues, pool=None, pending=None, shard=None):
+    # Validate a dataset's input files chunk by chunk, writing each chunk out before the next one is read:
+    # clean rows to validated/, flagged rows to quarantine/. A hospital shard reads its own splits of the input
+    # files, with the row ids and provenance of the rows in the input files
+    file_name = export_name(config[f"{dataset}_file"], dataset)
+    sep = config[f"{dataset}_sep"]
+    output_path = Path(config["output_dir"]) / config["validated_subdir"]
+    quarantine_path = Path(config["output_dir"]) / config["quarantine_subdir"]
+    chunk_size = config["chunk_size"] if config["streaming_enabled"] else None
+    schema, quarantine_schema = SCHEMAS[dataset]
+
+    # Raw strings hash the same way whatever the rest of the file contains; otherwise
+    # repeated labels and ids are read straight into categoricals
+    dtype = str if pending is not None else dict.fromkeys(CATEGORICAL_COLUMNS, "category")
+
+    csv_path = output_path / file_name if config["export_csv"] else None
+    quarantine_csv_path = quarantine_path / file_name if config["export_csv"] else None
+    with DatasetWriter(output_path / f"{dataset}.parquet", schema, config["parquet_compression"], csv_path, sep,
+                       config["date_format"]) as writer, \
+            DatasetWriter(quarantine_path / f"{dataset}.parquet", quarantine_schema, config["parquet_compression"],
+                          quarantine_csv_path, sep, config["date_format"]) as quarantine:
+        paths, root, first_rows, source_rows = shard_inputs(config, dataset, shard)
+        frames = read_inputs(paths, sep, config[f"{dataset}_columns"], chunk_size, dtype, config["read_threads"],
+                             root=root, first_rows=first_rows, source_rows=source_rows)
+        source = None
+        for frame in frames:
+            # Columns are checked on the first chunk of each file
+            first = source_name(frame, None) != source
+            source = source_name(frame, None)
+            issues.add_source(dataset, source, frame.index)
+            if pending is not None:
+                frame = select_partitions(frame, DATE_COLUMNS[dataset], pending, config["date_format"],
+                                          config["date_fallback_formats"])
+            frame = compact(frame)
+            record_memory(dataset, frame)
+            clean, quarantined = split_quarantine(validate_chunk(frame, dataset, config, issues, first=first, pool=pool),
+                                                  dataset, config)
+            writer.write(clean)
+            quarantine.write(quarantined)
+    return issues
+
+
+def fingerprint_inputs(dataset, config, shard=None):
+    # Partition fingerprints of all of a dataset's input files (or a shard's rows), as raw strings in the
+    # configured column order
+    chunk_size = config["chunk_size"] if config["streaming_enabled"] else None
+    paths, root, first_rows, source_rows = shard_inputs(config, dataset, shard)
+    frames = read_inputs(paths, config[f"{dataset}_sep"], config[f"{dataset}_columns"], chunk_size, str,
+                         config["read_threads"], root=root, step_name="fingerprint", provenance=False,
+                         first_rows=first_rows, source_rows=source_rows)
+    return fingerprint_frames(frames, DATE_COLUMNS[dataset], config["date_format"], config["date_fallback_formats"])
+
+
+def run_validation(config, shard):
+    # Extract config values
+    output_dir = config["output_dir"]
+    concurrent_io = config["concurrent_io"]
+
+    # Define output paths
+    output_path = Path(output_dir) / config["validated_subdir"]
+    output_path.mkdir(parents=True, exist_ok=True)
+    (Path(output_dir) / config["quarantine_subdir"]).mkdir(parents=True, exist_ok=True)
+
+    # Incremental mode only validates partitions that are new or changed since the last run
+    pending = {"vitals": None, "labs": None}
+    if config["incremental"]:
+        manifest = load_manifest(Path(output_dir) / config["manifest_file"])
+        fingerprints = run_concurrently([
+            partial(fingerprint_inputs, dataset, config, shard) for dataset in ("vitals", "labs")
+        ], concurrent_io)
+        pending = {
+            "vitals": changed_partitions(fingerprints[0], manifest["vitals"]),
+            "labs": changed_partitions(fingerprints[1], manifest["labs"]),
+        }
+        logger.info(f"Changed partitions: {len(pending['vitals'])} vitals, {len(pending['labs'])} labs")
+        with atomic_write(output_path / PENDING_FILE) as tmp_path, open(tmp_path, "w") as f:
+            json.dump(pending, f, indent=2, sort_keys=True)
+
+    # Vitals and labs are independent until the quality report: validate them side by side,
+    # each into issues of its own, merged in dataset order
+    with worker_pool(config["workers"]) as pool:
+        dataset_issues = run_concurrently([
+            partial(validate_file, dataset, config, IssueCollector.from_config(config), pool, pending[dataset], shard)
+            for dataset in ("vitals", "labs")
+        ], concurrent_io)
+    issues = IssueCollector.from_config(config)
+    for other in dataset_issues:
+        issues.merge(other)
+
+    write_issues(issues, output_path, config)
+
+    logger.info("Validation completed")
+
+
+def validate_data(config_file="pipeline_config.json", partition=None):
+    return run_stage_task("validate_data", config_file, partition, run_validation, "Validation failed")
@@ -0,0 +1,413 @@
+import os
+import shutil
+from functools import reduce
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from contextlib import contextmanager
+from pathlib import Path
+from schemas import to_table
+from instrumentation import step, timed_frames, add_file_bytes
+from parallel import read_ahead
+
+# Uncompressed Arrow IPC (Feather v2) copies of datasets, read through a memory map
+IPC_SUFFIX = ".arrow"
+
+# Tried when the configured separator does not split a file's header into the expected columns
+SEPARATORS = [",", ";", "\t", "|"]
+
+# The file each input row comes from, and its 0-based data row there
+PROVENANCE_COLUMNS = ["source_file", "source_row"]
+
+# Directory keys of the partitioned datasets: hospital, then the year and month of the dataset's date.
+# Rows without a hospital go to hospital_id=__HIVE_DEFAULT_PARTITION__
+PARTITIONING = ds.partitioning(pa.schema([("hospital_id", pa.string()), ("year", pa.int16()), ("month", pa.int8())]),
+                               flavor="hive")
+PARTITION_KEYS = ["hospital_id", "year", "month"]
+# Row groups of a partition file: small enough for date predicates to skip some, large enough to stay cheap
+PARTITION_ROW_GROUP_ROWS = 1 << 17
+
+
+def temporary_path(path):
+    # Next to the final file, so renaming it over that file is atomic; the pid keeps tasks apart
+    return Path(f"{path}.{os.getpid()}.tmp")
+
+
+@contextmanager
+def atomic_write(path):
+    # Yield a temporary path to write to; it replaces path only once fully written, so concurrent
+    # readers see the old file or the new one, never a partial one
+    tmp_path = temporary_path(path)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def read_frames(path, sep, chunk_size=None, dtype=None, step_name="read"):
+    # Yield the whole file at once, or chunk by chunk in streaming mode
+    add_file_bytes(step_name, path)
+    if chunk_size:
+        yield from timed_frames(pd.read_csv(path, sep=sep, chunksize=chunk_size, dtype=dtype), step_name)
+    else:
+        with step(step_name) as record:
+            frame = pd.read_csv(path, sep=sep, dtype=dtype)
+            record["rows"] += len(frame)
+        yield frame
+
+
+def input_paths(input_dir, pattern):
+    # A file name, a glob pattern or a directory (its *.csv files) under input_dir, in sorted order
+    path = Path(input_dir) / pattern
+    if path.is_dir():
+        paths = sorted(path.glob("*.csv"))
+    elif any(char in pattern for char in "*?["):
+        paths = sorted(p for p in Path(input_dir).glob(pattern) if p.is_file())
+    else:
+        return [path]
+    if not paths:
+        raise FileNotFoundError(f"No input files match {path}")
+    return paths
+
+
+def export_name(pattern, dataset):
+    # CSV export name: the input file's name, or the dataset's for several input files
+    if Path(pattern).suffix and not any(char in pattern for char in "*?["):
+        return Path(pattern).name
+    return f"{dataset}.csv"
+
+
+def detect_separator(path, sep, columns):
+    # The configured separator, unless another one splits the header into more of the expected columns
+    with open(path, "r", newline="") as f:
+        header = f.readline().rstrip("\r\n")
+    expected = set(columns)
+    return max([sep] + [other for other in SEPARATORS if other != sep], key=lambda other: len(expected & set(header.split(other))))
+
+
+def file_frames(path, name, sep, columns, chunk_size=None, dtype=None, step_name="read", provenance=True,
+                source_rows=None):
+    # One input file's frames with the configured columns first, in configured order, and its provenance.
+    # source_rows: for a hospital shard's split of an input file, the row each of its rows has in that file
+    sep = detect_separator(path, sep, columns)
+    for frame in read_frames(path, sep, chunk_size, dtype, step_name):
+        if source_rows is not None:
+            frame.index = pd.Index(source_rows[frame.index.to_numpy()].astype(np.int64))
+        ordered = [col for col in columns if col in frame.columns] + [col for col in frame.columns if col not in columns]
+        if ordered != list(frame.columns):
+            frame = frame[ordered]
+        if provenance:
+            frame = frame.assign(
+                source_file=pd.Categorical.from_codes(np.zeros(len(frame), dtype=np.int8), categories=[name]),
+                source_row=frame.index.to_numpy(dtype=np.uint32),
+            )
+        yield frame
+
+
+def read_inputs(paths, sep, columns, chunk_size=None, dtype=None, threads=1, root=None, step_name="read",
+                provenance=True, first_rows=None, source_rows=None):
+    # Frames of several input files in file order, whole or chunk by chunk, with up to `threads` files read ahead.
+    # Rows are indexed by their position across all files, so row ids stay unique. A hospital shard reads its
+    # splits of the input files instead: first_rows gives the first row id of each input file, and source_rows
+    # the row in it of each split row
+    def reader(path, first_row, file_rows):
+        name = str(path.relative_to(root)) if root is not None else path.name
+        for frame in file_frames(path, name, sep, columns, chunk_size, dtype, step_name, provenance, file_rows):
+            yield name, first_row, frame
+
+    paths = list(paths)
+    first_rows = [None] * len(paths) if first_rows is None else first_rows
+    source_rows = [None] * len(paths) if source_rows is None else source_rows
+    offset, rows, current = 0, 0, None
+    for name, first_row, frame in read_ahead((reader(Path(path), first_row, file_rows)
+                                              for path, first_row, file_rows in zip(paths, first_rows, source_rows)),
+                                             threads):
+        if name != current:
+            offset, rows, current = offset + rows if first_row is None else first_row, 0, name
+        frame.index = frame.index + offset
+        rows += len(frame)
+        yield frame
+
+
+def read_parquet_frames(path, columns=None, chunk_size=None):
+    # Parquet counterpart of read_frames, reading only the requested columns
+    add_file_bytes("read", path)
+    if chunk_size:
+        batches = pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=columns)
+        yield from timed_frames((batch.to_pandas() for batch in batches), "read")
+    else:
+        yield read_parquet(path, columns=columns)
+
+
+def read_parquet(path, columns=None):
+    # Whole-file read, timed as a read step
+    with step("read") as record:
+        frame = pd.read_parquet(path, columns=columns)
+        record["rows"] += len(frame)
+    return frame
+
+
+def dataset_path(directory, name, ipc=False):
+    # The Arrow IPC copy of a dataset when it is enabled, otherwise its Parquet file
+    return Path(directory) / f"{name}{IPC_SUFFIX if ipc else '.parquet'}"
+
+
+def open_ipc(path):
+    # Memory-mapped: column buffers point into the page cache, which every process mapping the file shares
+    return pa.ipc.open_file(pa.memory_map(str(path), "r"))
+
+
+def ipc_to_pandas(data):
+    # Unconsolidated blocks let numeric and timestamp columns without nulls stay read-only views of the mapped
+    # pages; dictionary columns (codes and categories) and columns with nulls are still converted onto the heap
+    return data.to_pandas(split_blocks=True)
+
+
+def read_dataset_frames(path, columns=None, chunk_size=None):
+    # read_parquet_frames for either format; an IPC file is read batch by batch as it was written
+    if Path(path).suffix != IPC_SUFFIX:
+        yield from read_parquet_frames(path, columns, chunk_size)
+        return
+    add_file_bytes("read", path)
+    reader = open_ipc(path)
+    if chunk_size:
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+        yield from timed_frames((ipc_to_pandas(batch.select(columns) if columns else batch) for batch in batches), "read")
+    else:
+        yield read_dataset(path, columns)
+
+
+def read_dataset(path, columns=None):
+    # Whole-file read of either format; from IPC only the projected columns are converted, and those that
+    # can stay in the mapped pages do
+    if Path(path).suffix != IPC_SUFFIX:
+        return read_parquet(path, columns)
+    with step("read") as record:
+        table = open_ipc(path).read_all()
+        frame = ipc_to_pandas(table.select(columns) if columns else table)
+        record["rows"] += len(frame)
+    return frame
+
+
+def recode(chunk, dictionary):
+    # Re-express a dictionary array against a larger dictionary
+    mapping = pc.index_in(chunk.dictionary, value_set=dictionary)
+    return pa.DictionaryArray.from_arrays(pc.take(mapping, chunk.indices).cast(pa.int32()), dictionary)
+
+
+def export_ipc(parquet_path, ipc_path):
+    # Uncompressed Arrow IPC copy of a Parquet file, for readers that memory-map instead of decoding.
+    # The IPC file format allows one dictionary per column, so a first pass collects the union of the
+    # row group dictionaries and a second pass re-encodes every row group against it
+    parquet_file = pq.ParquetFile(parquet_path)
+    schema = parquet_file.schema_arrow
+    dictionary_columns = [field.name for field in schema if pa.types.is_dictionary(field.type)]
+    values = {name: set() for name in dictionary_columns}
+    for i in range(parquet_file.num_row_groups):
+        for name, column in zip(dictionary_columns, parquet_file.read_row_group(i, columns=dictionary_columns).columns):
+            for chunk in column.chunks:
+                values[name].update(chunk.dictionary.to_pylist())
+    dictionaries = {name: pa.array(sorted(values[name]), type=schema.field(name).type.value_type) for name in dictionary_columns}
+
+    with atomic_write(ipc_path) as tmp_path, pa.OSFile(str(tmp_path), "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        for i in range(parquet_file.num_row_groups):
+            table = parquet_file.read_row_group(i)
+            for name in dictionary_columns:
+                index = table.schema.get_field_index(name)
+                column = pa.chunked_array([recode(chunk, dictionaries[name]) for chunk in table.column(index).chunks],
+                                          type=schema.field(name).type)
+                table = table.set_column(index, schema.field(name), column)
+            writer.write_table(table)
+    add_file_bytes("write", ipc_path)
+
+
+def with_partition_keys(batch, date_col):
+    # Plain string hospital ids, plus the year and month of date_col, as the partitioning expects them
+    index = batch.schema.get_field_index("hospital_id")
+    batch = batch.set_column(index, "hospital_id", batch.column(index).cast(pa.string()))
+    dates = batch.column(date_col)
+    batch = batch.append_column("year", pc.year(dates).cast(pa.int16()))
+    return batch.append_column("month", pc.month(dates).cast(pa.int8()))
+
+
+def partitioned_schema(schema):
+    keys = PARTITIONING.schema
+    return pa.schema([keys.field("hospital_id") if field.name == "hospital_id" else field for field in schema]
+                     + [keys.field("year"), keys.field("month")])
+
+
+def write_partitioned(batches, schema, path, date_col, compression="zstd", replace=True):
+    # Hive-partitioned copy (hospital_id=/year=/month=) of a dataset from its record batches, with row group
+    # statistics in every file. replace=True swaps in a complete new dataset; replace=False rewrites only the
+    # partitions the batches hold and keeps every other one (an incremental run)
+    path = Path(path)
+    target = temporary_path(path) if replace else path
+    if replace:
+        shutil.rmtree(target, ignore_errors=True)
+    target.mkdir(parents=True, exist_ok=True)
+    with step("write") as record:
+        def keyed():
+            for batch in batches:
+                record["rows"] += batch.num_rows
+                yield with_partition_keys(batch, date_col)
+
+        ds.write_dataset(
+            keyed(), target, schema=partitioned_schema(schema), format="parquet", partitioning=PARTITIONING,
+            basename_template="part-{i}.parquet", existing_data_behavior="delete_matching",
+            file_options=ds.ParquetFileFormat().make_write_options(compression=compression, write_statistics=True),
+            min_rows_per_group=PARTITION_ROW_GROUP_ROWS // 8, max_rows_per_group=PARTITION_ROW_GROUP_ROWS,
+        )
+    if replace:
+        replace_dir(target, path)
+    add_file_bytes("write", *path.rglob("*.parquet"))
+
+
+def drop_partitioned(path):
+    # A partitioned copy an earlier run left behind would be read as current by read_partitioned
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def replace_dir(source, path):
+    # Directories cannot be renamed over a non-empty one: move the old one aside first
+    old = temporary_path(Path(f"{path}.old"))
+    if path.exists():
+        os.rename(path, old)
+    os.rename(source, path)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def export_partitioned(parquet_path, path, date_col, compression="zstd", replace=True):
+    # Partitioned copy of a Parquet file, streamed row group by row group
+    parquet_file = pq.ParquetFile(parquet_path)
+    batches = (batch for i in range(parquet_file.num_row_groups) for batch in parquet_file.read_row_group(i).to_batches())
+    write_partitioned(batches, parquet_file.schema_arrow, path, date_col, compression, replace)
+
+
+def partition_filter(date_col, date_type, hospitals=None, start=None, end=None):
+    # Conditions on the directory keys prune whole partitions; the same bounds on date_col are then checked
+    # against the row group statistics of the files left
+    conditions = []
+    if hospitals is not None:
+        conditions.append(ds.field("hospital_id").isin([str(hospital) for hospital in hospitals]))
+    year, month = ds.field("year"), ds.field("month")
+    if start is not None:
+        start = pd.Timestamp(start)
+        conditions += [(year > start.year) | ((year == start.year) & (month >= start.month)),
+                       ds.field(date_col) >= pa.scalar(start, type=date_type)]
+    if end is not None:
+        end = pd.Timestamp(end)
+        conditions += [(year < end.year) | ((year == end.year) & (month <= end.month)),
+                       ds.field(date_col) <= pa.scalar(end, type=date_type)]
+    return reduce(lambda left, right: left & right, conditions) if conditions else None
+
+
+def read_partitioned(path, date_col, hospitals=None, start=None, end=None, columns=None):
+    # Rows of a partitioned dataset for some hospitals and a date range (inclusive), reading only the files
+    # of the matching partitions. Columns come in file order after hospital_id, without the year/month keys
+    dataset = ds.dataset(path, format="parquet", partitioning=PARTITIONING)
+    expression = partition_filter(date_col, dataset.schema.field(date_col).type, hospitals, start, end)
+    if columns is None:
+        columns = ["hospital_id"] + [name for name in dataset.schema.names if name not in PARTITION_KEYS]
+    with step("read") as record:
+        fragments = list(dataset.get_fragments(filter=expression))
+        table = dataset.to_table(columns=columns, filter=expression)
+        record["rows"] += table.num_rows
+    add_file_bytes("read", *(fragment.path for fragment in fragments))
+    frame = table.to_pandas()
+    if "hospital_id" in frame.columns:
+        frame["hospital_id"] = frame["hospital_id"].astype("category")
+    return frame
+
+
+class DatasetWriter:
+    # Writes chunks of one dataset as typed Parquet, with an optional CSV export alongside. Both go to
+    # temporary files that replace the outputs on a clean close, and are dropped if writing fails
+
+    def __init__(self, path, schema, compression="zstd", csv_path=None, sep=",", date_format=None):
+        self.path = path
+        self.schema = schema
+        self.compression = compression
+        self.csv_path = csv_path
+        self.sep = sep
+        self.date_format = date_format
+        self.writer = None
+        self.rows = 0
+        self.tmp_paths = {path: temporary_path(path)} | ({csv_path: temporary_path(csv_path)} if csv_path is not None else {})
+
+    def write(self, frame):
+        # Empty chunks (e.g. nothing quarantined) would only add empty row groups once the file exists
+        if frame.empty and self.writer is not None:
+            return
+        with step("write") as record:
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.tmp_paths[self.path], self.schema, compression=self.compression)
+            self.writer.write_table(to_table(frame, self.schema))
+            if self.csv_path is not None:
+                first = self.rows == 0
+                frame.to_csv(self.tmp_paths[self.csv_path], sep=self.sep, index=False, mode="w" if first else "a", header=first,
+                             date_format=self.date_format)
+            self.rows += len(frame)
+            record["rows"] += len(frame)
+
+    def close(self, commit=True):
+        # An input without any chunk still produces an empty, typed file
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.tmp_paths[self.path], self.schema, compression=self.compression)
+        self.writer.close()
+        for path, tmp_path in self.tmp_paths.items():
+            if commit and tmp_path.exists():
+                os.replace(tmp_path, path)
+            else:
+                tmp_path.unlink(missing_ok=True)
+        add_file_bytes("write", *self.tmp_paths)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(commit=exc_type is None)
+
+
+def count_rows(path):
+    # Row count from the file metadata; a dataset that was never written has none
+    if not Path(path).exists():
+        return 0
+    if Path(path).suffix == IPC_SUFFIX:
+        reader = open_ipc(path)
+        return sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+    return pq.ParquetFile(path).metadata.num_rows
+
+
+def dataset_columns(path):
+    # Column names from the file schema, without reading any data
+    if Path(path).suffix == IPC_SUFFIX:
+        return open_ipc(path).schema.names
+    return pq.read_schema(path).names
+
+
+def count_nulls(path):
+    # Null counts come from the column chunk statistics, so no data pages need decoding;
+    # an IPC file keeps them in its batch metadata
+    if Path(path).suffix == IPC_SUFFIX:
+        table = open_ipc(path).read_all()
+        return sum(column.null_count for name, column in zip(table.column_names, table.columns)
+                   if not name.startswith("__index_level_"))
+    parquet_file = pq.ParquetFile(path)
+    metadata = parquet_file.metadata
+    total = 0
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        for j in range(row_group.num_columns):
+            column = row_group.column(j)
+            if column.path_in_schema.startswith("__index_level_"):
+                continue
+            statistics = column.statistics
+            if statistics is not None and statistics.has_null_count:
+                total += statistics.null_count
+            else:
+                total += parquet_file.read_row_group(i, columns=[column.path_in_schema]).column(0).null_count
+    return total
@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+
+def parse_unique_dates(values, date_format, fallback_formats=()):
+    # Vectorized fast path per format; only values no format matches are parsed one by one
+    parsed = pd.to_datetime(values, format=date_format, errors="coerce")
+    for fmt in fallback_formats:
+        missing = parsed.isna() & values.notna()
+        if not missing.any():
+            break
+        parsed = parsed.where(~missing, pd.to_datetime(values.where(missing), format=fmt, errors="coerce"))
+    missing = parsed.isna() & values.notna()
+    if missing.any():
+        parsed[missing] = pd.to_datetime(values[missing], format="mixed", errors="coerce")
+    return parsed
+
+
+def parse_dates(series, date_format, fallback_formats=()):
+    # Datetime columns pass through; anything else is parsed once per distinct value
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    codes, uniques = pd.factorize(series.astype("string"), use_na_sentinel=True)
+    parsed = parse_unique_dates(pd.Series(uniques, dtype="object"), date_format, fallback_formats)
+    # One trailing NaT row takes the missing values (code -1)
+    lookup = np.append(parsed.to_numpy(dtype="datetime64[ns]"), np.datetime64("NaT", "ns"))
+    return pd.Series(lookup[codes], index=series.index, name=series.name)
+
+
+def age_in_years(birth, at):
+    # Completed years from birth to `at`, from the calendar fields of whole columns; missing if either date is
+    years = at.dt.year - birth.dt.year
+    before_birthday = at.dt.month * 100 + at.dt.day < birth.dt.month * 100 + birth.dt.day
+    return (years - before_birthday).astype("Int16")
@@ -0,0 +1,199 @@
+import json
+import numpy as np
+import pandas as pd
+import logging
+from functools import partial
+from pathlib import Path
+from dataset_io import DatasetWriter, read_dataset, dataset_path, read_partitioned
+from schemas import VITALS_FEATURES_SCHEMA, LABS_FEATURES_SCHEMA
+from parallel import worker_pool, split_shards, map_shards, run_concurrently
+from instrumentation import step, add_file_bytes, record_memory
+from stage_cache import run_stage_task
+from partition_manifest import PENDING_FILE, partition_keys
+
+logger = logging.getLogger(__name__)
+
+# Per dataset: hospital, patient, type, date and value columns of the transformed data
+FEATURE_COLUMNS = {
+    "vitals": ["hospital_id", "patient_id", "vital_type", "measurement_date", "value"],
+    "labs": ["hospital_id", "patient_id", "test_type", "test_date", "result_value"],
+}
+SCHEMAS = {"vitals": VITALS_FEATURES_SCHEMA, "labs": LABS_FEATURES_SCHEMA}
+SECONDS_PER_DAY = 86400
+
+
+def sort_codes(column):
+    # Integer keys that sort like the column's values as strings, missing values last
+    column = column if isinstance(column.dtype, pd.CategoricalDtype) else column.astype("category")
+    categories = column.cat.categories.astype(str)
+    ranks = np.empty(len(categories) + 1, dtype=np.int64)
+    ranks[np.argsort(categories, kind="stable")] = np.arange(len(categories))
+    # Code -1 (missing) takes the trailing rank
+    ranks[-1] = len(categories)
+    return ranks[column.cat.codes.to_numpy()]
+
+
+def series_order(frame, type_col, date_col):
+    # Stable (hospital, patient, type, date) order of the rows, with the key codes and dates it sorts by
+    codes = [sort_codes(frame[key]) for key in ("hospital_id", "patient_id", type_col)]
+    dates = frame[date_col].to_numpy(dtype="datetime64[ns]")
+    return np.lexsort([dates.view(np.int64)] + codes[::-1]), codes, dates
+
+
+def window_means(sums, counts, window_start, series_start):
+    # Mean over positions window_start..i of each row's series, from prefix sums restarted per series and
+    # running counts of the values present
+    before = window_start - 1
+    total = sums - np.where(window_start > series_start, sums[before], 0.0)
+    count = counts - np.where(window_start > 0, counts[before], 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count > 0, total / count, np.nan)
+
+
+def time_series_features(frame, type_col, date_col, value_col, window_readings=3, window_days=30):
+    # Longitudinal features of each (hospital, patient, type) series, as of each reading: the previous reading's
+    # value, the change since it and the days in between, and the means of the last window_readings readings and
+    # of the readings in the last window_days days, the current one included. One stable sort by (hospital,
+    # patient, type, date); every feature is then a shifted array or a difference of prefix sums, O(n)
+    keys = ["hospital_id", "patient_id", type_col]
+    order, codes, dates = series_order(frame, type_col, date_col)
+    frame = frame.iloc[order].reset_index(drop=True)
+    codes = [code[order] for code in codes]
+    dates = dates[order]
+    n = len(frame)
+
+    # Series boundaries, and each row's series start and series number
+    positions = np.arange(n)
+    new_series = positions == 0
+    for code in codes:
+        new_series[1:] |= code[1:] != code[:-1]
+    series_start = np.maximum.accumulate(np.where(new_series, positions, 0)) if n else positions
+    series_id = np.cumsum(new_series) - 1
+
+    # Previous reading; the first reading of a series has none (rows without a date sort first and have none either)
+    values = frame[value_col].to_numpy(dtype=np.float64, na_value=np.nan)
+    previous = positions - 1
+    last_value = np.where(new_series, np.nan, values[previous]) if n else values
+    days_since_last = np.where(new_series, np.nan, (dates - dates[previous]) / np.timedelta64(1, "D")) if n else values
+
+    # Rolling means from per-series prefix sums, which keeps the rounding error to the series' own magnitude
+    present = ~np.isnan(values) & ~np.isnat(dates)
+    sums = pd.Series(np.where(present, values, 0.0)).groupby(series_id, sort=False).cumsum().to_numpy()
+    counts = np.cumsum(present)
+    readings_start = np.maximum(positions - window_readings + 1, series_start)
+
+    # A day window starts at the first reading of the series after date - window_days: one binary search over
+    # series * span + seconds, a key that increases through the sorted rows and never reaches into the previous series
+    seconds = dates.astype("datetime64[s]").view(np.int64)
+    dated = ~np.isnat(dates)
+    window = window_days * SECONDS_PER_DAY
+    if dated.any():
+        base = seconds[dated].min()
+        span = seconds[dated].max() - base + window + 1
+        key = series_id * span + np.where(dated, seconds - base, 0)
+        days_start = np.maximum(np.searchsorted(key, key - window, side="right"), series_start)
+    else:
+        days_start = positions
+
+    return frame[keys[:2] + [type_col, date_col, value_col]].assign(
+        last_value=last_value,
+        delta=values - last_value,
+        days_since_last=days_since_last,
+        rolling_mean_readings=window_means(sums, counts, readings_start, series_start),
+        rolling_mean_days=window_means(sums, counts, days_start, series_start),
+    )
+
+
+def hospital_order(shard):
+    # Shards in the serial sort order: hospital ids as strings, rows without one last
+    hospital = shard["hospital_id"].iloc[0]
+    return pd.isna(hospital), str(hospital)
+
+
+def compute_features(frame, dataset, config, pool=None):
+    # Serial, or one shard per hospital across the process pool; series never span hospitals, so the shards'
+    # results in hospital order are the serial result
+    type_col, date_col, value_col = FEATURE_COLUMNS[dataset][2:]
+    args = (type_col, date_col, value_col, config["feature_window_readings"], config["feature_window_days"])
+    with step("features") as record:
+        record["rows"] += len(frame)
+        if pool is None or frame.empty:
+            return time_series_features(frame, *args)
+        shards = sorted(split_shards(frame), key=hospital_order)
+        return pd.concat(map_shards(pool, time_series_features, shards, *args), ignore_index=True)
+
+
+def write_features(features, dataset, config):
+    output_path = Path(config["output_dir"]) / config["features_subdir"]
+    output_path.mkdir(parents=True, exist_ok=True)
+    with DatasetWriter(output_path / f"{dataset}_features.parquet", SCHEMAS[dataset], config["parquet_compression"]) as writer:
+        writer.write(features)
+    return len(features)
+
+
+def features_file(dataset, config, pool=None):
+    # Features of one transformed dataset, read with only the columns they need
+    input_path = Path(config["output_dir"]) / config["transformed_subdir"]
+    path = dataset_path(input_path, f"clean_{dataset}", config["transformed_ipc"])
+    frame = read_dataset(path, columns=FEATURE_COLUMNS[dataset])
+    add_file_bytes("read", path)
+    record_memory(dataset, frame)
+    return write_features(compute_features(frame, dataset, config, pool), dataset, config)
+
+
+def series_keys(frame, type_col):
+    # One string per (hospital, patient, type) series
+    return frame["hospital_id"].astype(str) + "|" + frame["patient_id"].astype(str) + "|" + frame[type_col].astype(str)
+
+
+def incremental_features(dataset, config, pool=None):
+    # An incremental run's transformed files hold the reprocessed partitions only, while a reading's features
+    # depend on the earlier readings of its series. Every series with a reading in those partitions, now or in
+    # the earlier features, is recomputed from the full history in the partitioned transformed dataset and
+    # replaces that series' rows; the other series keep their features
+    type_col, date_col = FEATURE_COLUMNS[dataset][2:4]
+    output_dir = Path(config["output_dir"])
+    with open(output_dir / config["validated_subdir"] / PENDING_FILE, "r") as f:
+        pending = list(json.load(f)[dataset])
+    history = read_partitioned(output_dir / config["transformed_subdir"] / f"clean_{dataset}", date_col,
+                               columns=FEATURE_COLUMNS[dataset])
+    record_memory(dataset, history)
+    features_path = output_dir / config["features_subdir"] / f"{dataset}_features.parquet"
+    if not features_path.exists():
+        return write_features(compute_features(history, dataset, config, pool), dataset, config)
+    earlier = read_dataset(features_path)
+    add_file_bytes("read", features_path)
+
+    with step("select_series"):
+        keys = [series_keys(frame, type_col) for frame in (history, earlier)]
+        affected = pd.concat([
+            key[partition_keys(frame, date_col, config["date_format"], config["date_fallback_formats"]).isin(pending)]
+            for key, frame in zip(keys, (history, earlier))
+        ]).unique()
+        history = history[keys[0].isin(affected).to_numpy()]
+        earlier = earlier[~keys[1].isin(affected).to_numpy()]
+    features = compute_features(history, dataset, config, pool)
+    with step("merge"):
+        # Series are disjoint and each one is already in date order, so a stable sort keeps the serial order
+        features = pd.concat([earlier, features], ignore_index=True)
+        features = features.iloc[series_order(features, type_col, date_col)[0]]
+    logger.info(f"Recomputed the {dataset} features of {len(affected)} series")
+    return write_features(features, dataset, config)
+
+
+def run_features(config, shard):
+    if config["incremental"] and not config["partitioned_datasets"]:
+        # The full history of a series is only kept in the partitioned transformed dataset
+        logger.warning("Incremental features need partitioned_datasets; the earlier features are kept")
+    else:
+        # Vitals and labs side by side, sharing the process pool
+        calculate = incremental_features if config["incremental"] else features_file
+        with worker_pool(config["workers"]) as pool:
+            run_concurrently([partial(calculate, dataset, config, pool) for dataset in ("vitals", "labs")],
+                             config["concurrent_io"])
+
+        logger.info("Features calculated")
+
+
+def calculate_features(config_file="pipeline_config.json", partition=None):
+    return run_stage_task("calculate_features", config_file, partition, run_features, "Features failed")
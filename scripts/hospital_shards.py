@@ -0,0 +1,149 @@
+import json
+import logging
+import shutil
+from functools import partial
+from pathlib import Path
+from urllib.parse import quote
+import numpy as np
+import pandas as pd
+from config_model import load_config
+from dataset_io import input_paths, detect_separator, atomic_write, temporary_path, replace_dir
+from instrumentation import StageMetrics, step, add_file_bytes
+from parallel import run_concurrently
+
+logger = logging.getLogger(__name__)
+
+# Shards discovered in the inputs, with the files and global row ids each one reads
+SHARDS_FILE = "shards.json"
+# Shard of the rows without a hospital id, named as Hive names the null partition
+MISSING_HOSPITAL = "__HIVE_DEFAULT_PARTITION__"
+# A shard's splits of the input files, in its directory, each with the input file row of every split row
+SHARD_INPUT_SUBDIR = "input"
+ROWS_SUFFIX = ".rows.npy"
+
+
+def partition_dir(config, partition):
+    # Output directory of one hospital shard
+    return Path(config["output_dir"]) / config["shards_subdir"] / f"hospital_id={quote(partition, safe='')}"
+
+
+def partition_config(config, partition):
+    # The config a mapped task runs with: the same settings, with its shard's own output directory
+    if partition is None:
+        return config
+    return config.model_copy(update={"output_dir": str(partition_dir(config, partition))})
+
+
+def load_shards(config):
+    with open(Path(config["output_dir"]) / config["shards_subdir"] / SHARDS_FILE, "r") as f:
+        return json.load(f)["partitions"]
+
+
+def load_sources(config):
+    # Every input file with its first row id and row count, as a single run's issue collector lists them
+    with open(Path(config["output_dir"]) / config["shards_subdir"] / SHARDS_FILE, "r") as f:
+        return json.load(f)["sources"]
+
+
+def shard_input_dir(config, partition):
+    # The shard's splits of the input files, under their names relative to input_dir
+    return partition_dir(config, partition) / SHARD_INPUT_SUBDIR
+
+
+def load_shard(config, partition):
+    # One shard's input files, the row id each starts at and where its splits of them are; None for an
+    # unsharded run
+    if partition is None:
+        return None
+    return {"name": partition, "input_dir": str(shard_input_dir(config, partition))} | load_shards(config)[partition]
+
+
+def shard_inputs(config, dataset, shard=None):
+    # Input files to read and the directory their names are relative to, with the global row id of each input
+    # file's first row and the input file row of each row read (None: whole files, which follow each other)
+    if shard is None:
+        return input_paths(config["input_dir"], config[f"{dataset}_file"]), config["input_dir"], None, None
+    root = Path(shard["input_dir"])
+    names = [name for name, _ in shard[dataset]]
+    return ([root / name for name in names], root, [first_row for _, first_row in shard[dataset]],
+            [np.load(root / f"{name}{ROWS_SUFFIX}") for name in names])
+
+
+def split_file(path, name, sep, columns, split_dirs, chunk_size=None):
+    # One input file's rows by hospital, each hospital's into a file of the same name and header under its
+    # split_dirs entry, next to the row each of them has in the input file. The values are kept as the text
+    # they were read as, so the shard parses them as a single run would. Returns the row count and hospitals
+    sep = detect_separator(path, sep, columns)
+    frames = pd.read_csv(path, sep=sep, dtype=str, chunksize=chunk_size) if chunk_size \
+        else [pd.read_csv(path, sep=sep, dtype=str)]
+    rows, source_rows = 0, {}
+    with step("discover") as record:
+        for frame in frames:
+            rows += len(frame)
+            ids = frame["hospital_id"] if "hospital_id" in frame.columns else pd.Series(None, index=frame.index, dtype=object)
+            for hospital, part in frame.groupby(ids.fillna(MISSING_HOSPITAL), sort=False):
+                target = split_dirs(hospital) / name
+                first = hospital not in source_rows
+                target.parent.mkdir(parents=True, exist_ok=True)
+                part.to_csv(target, sep=sep, index=False, mode="w" if first else "a", header=first)
+                source_rows.setdefault(hospital, []).append(part.index.to_numpy())
+        record["rows"] += rows
+    for hospital, parts in source_rows.items():
+        np.save(split_dirs(hospital) / f"{name}{ROWS_SUFFIX}", np.concatenate(parts).astype(np.uint32))
+    add_file_bytes("discover", path)
+    return rows, set(source_rows)
+
+
+def split_dataset(dataset, config, split_dirs):
+    # Hospital -> [[file under input_dir, first row id], ...] over a dataset's input files, row ids counted across
+    # files, plus each file as an issue source; every file is read once and split by hospital
+    chunk_size = config["chunk_size"] if config["streaming_enabled"] else None
+    files, sources, first_row = {}, [], 0
+    for path in input_paths(config["input_dir"], config[f"{dataset}_file"]):
+        name = str(path.relative_to(config["input_dir"]))
+        rows, hospitals = split_file(path, name, config[f"{dataset}_sep"], config[f"{dataset}_columns"], split_dirs,
+                                     chunk_size)
+        for hospital in hospitals:
+            files.setdefault(hospital, []).append([name, first_row])
+        sources.append({"dataset": dataset, "file": name, "first_row_id": first_row if rows else None, "rows": rows})
+        first_row += rows
+    return files, sources
+
+
+def discover_partitions(config_file="pipeline_config.json"):
+    # Fan-out task of the DAG: one shard per hospital in the inputs. Returns the shard names, which Airflow
+    # pushes to XCom for the mapped tasks
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        config = load_config(config_file)
+        shards_path = Path(config["output_dir"]) / config["shards_subdir"]
+        shards_path.mkdir(parents=True, exist_ok=True)
+
+        with StageMetrics("discover_partitions") as stage_metrics:
+            # Each shard's splits are written next to its final input directory and swapped in once complete
+            for path in shards_path.glob(f"hospital_id=*/{SHARD_INPUT_SUBDIR}.*.tmp"):
+                shutil.rmtree(path, ignore_errors=True)
+            def split_dirs(hospital):
+                return temporary_path(shard_input_dir(config, hospital))
+
+            (vitals, vitals_sources), (labs, labs_sources) = run_concurrently([
+                partial(split_dataset, dataset, config, split_dirs) for dataset in ("vitals", "labs")
+            ], config["concurrent_io"])
+            partitions = {
+                hospital: {"vitals": vitals.get(hospital, []), "labs": labs.get(hospital, [])}
+                for hospital in sorted(vitals.keys() | labs.keys())
+            }
+            for hospital in partitions:
+                replace_dir(split_dirs(hospital), shard_input_dir(config, hospital))
+            with atomic_write(shards_path / SHARDS_FILE) as tmp_path, open(tmp_path, "w") as f:
+                json.dump({"partitions": partitions, "sources": vitals_sources + labs_sources}, f, indent=2)
+
+            logger.info(f"Discovered {len(partitions)} hospital shards")
+
+        stage_metrics.write(Path(config["output_dir"]) / config["reports_subdir"])
+        return list(partitions)
+
+    except Exception as e:
+        logger.error(f"Shard discovery failed: {e}")
+        raise
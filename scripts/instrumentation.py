@@ -0,0 +1,212 @@
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; peak RSS is then left out
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Metrics of the stage running in this process, if any; steps outside a stage are not recorded
+_active = ContextVar("active_stage_metrics", default=None)
+
+STEP_FIELDS = ("calls", "wall_seconds", "cpu_seconds", "rows", "bytes")
+
+
+def cpu_seconds():
+    # User + system time of this process and of its finished children (process pool workers)
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def own_peak_kb():
+    # VmHWM covers this process image only, whereas Linux carries the parent's ru_maxrss over through exec
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def peak_rss_mb():
+    # Highest resident set size so far of this process or any finished child
+    peak = own_peak_kb()
+    if resource is not None:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        peak = max(peak or 0, children // 1024 if sys.platform == "darwin" else children)
+    return round(peak / 1024, 1) if peak is not None else None
+
+
+class StageMetrics:
+    # Wall time, CPU time, peak RSS and row/byte counts of one stage and its steps,
+    # with step totals summed over chunks and shards
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.steps = {}
+        self.started_at = None
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_rss_mb = None
+        self.memory = {}
+        self._start = None
+        self._token = None
+
+    def __enter__(self):
+        self.started_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        self._start = (time.perf_counter(), cpu_seconds())
+        self._token = _active.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _active.reset(self._token)
+        self.wall_seconds = time.perf_counter() - self._start[0]
+        self.cpu_seconds = cpu_seconds() - self._start[1]
+        self.peak_rss_mb = peak_rss_mb()
+
+    def record(self, name):
+        return self.steps.setdefault(name, dict.fromkeys(STEP_FIELDS, 0) | {"peak_rss_mb": None})
+
+    def merge(self, steps, memory=None):
+        # Fold in step totals recorded elsewhere, e.g. by a process pool worker or an I/O thread
+        for name, other in steps.items():
+            record = self.record(name)
+            for field in STEP_FIELDS:
+                record[field] += other[field]
+            if other["peak_rss_mb"] is not None:
+                record["peak_rss_mb"] = max(record["peak_rss_mb"] or 0, other["peak_rss_mb"])
+        for name, table in (memory or {}).items():
+            self.add_memory(name, table)
+
+    def add_memory(self, name, table):
+        # With chunks, the largest chunk is kept
+        if name not in self.memory or table["bytes"] > self.memory[name]["bytes"]:
+            self.memory[name] = table
+
+    def to_dict(self):
+        read = self.steps.get("read", {})
+        write = self.steps.get("write", {})
+        return {
+            "stage": self.stage,
+            "started_at": self.started_at,
+            "wall_seconds": round(self.wall_seconds, 4),
+            "cpu_seconds": round(self.cpu_seconds, 4),
+            "peak_rss_mb": self.peak_rss_mb,
+            "rows_in": read.get("rows", 0),
+            "rows_out": write.get("rows", 0),
+            "bytes_in": read.get("bytes", 0),
+            "bytes_out": write.get("bytes", 0),
+            "memory": self.memory,
+            "steps": [
+                {"step": name, **{key: round(value, 4) if isinstance(value, float) else value for key, value in record.items()}}
+                for name, record in self.steps.items()
+            ],
+        }
+
+    def write(self, output_path):
+        # One file per stage, so stages running side by side never write the same file
+        output_path.mkdir(parents=True, exist_ok=True)
+        path = output_path / f"{self.stage}_metrics.json"
+        tmp_path = f"{path}.tmp"
+        metrics = self.to_dict()
+        with open(tmp_path, "w") as f:
+            json.dump(metrics, f, indent=2)
+        os.replace(tmp_path, path)
+        # One line per stage in the task log; the stage also returns the dict, which Airflow pushes to XCom
+        logger.info(f"Stage metrics: {json.dumps(metrics)}")
+        return metrics
+
+
+@contextmanager
+def step(name):
+    # Time one step of the active stage; callers add the rows/bytes it handled to the yielded record
+    metrics = _active.get()
+    if metrics is None:
+        yield dict.fromkeys(STEP_FIELDS, 0)
+        return
+    record = metrics.record(name)
+    wall, cpu = time.perf_counter(), cpu_seconds()
+    try:
+        yield record
+    finally:
+        record["calls"] += 1
+        record["wall_seconds"] += time.perf_counter() - wall
+        record["cpu_seconds"] += cpu_seconds() - cpu
+        record["peak_rss_mb"] = peak_rss_mb()
+
+
+def timed_frames(frames, name="read"):
+    # Time each chunk a reader yields and count its rows
+    frames = iter(frames)
+    while True:
+        with step(name) as record:
+            frame = next(frames, None)
+            if frame is not None:
+                record["rows"] += len(frame)
+        if frame is None:
+            return
+        yield frame
+
+
+def record_memory(name, frame):
+    # In-memory size of a table as the stage holds it, per column; with chunks, the largest chunk is kept
+    metrics = _active.get()
+    if metrics is None:
+        return
+    usage = frame.memory_usage(index=False, deep=True)
+    metrics.add_memory(name, {
+        "rows": len(frame),
+        "bytes": int(usage.sum()),
+        "columns": {col: {"dtype": str(frame[col].dtype), "bytes": int(size)} for col, size in usage.items()},
+    })
+
+
+def add_file_bytes(name, *paths):
+    # Size on disk of the files a read or write step handled
+    metrics = _active.get()
+    if metrics is not None:
+        metrics.record(name)["bytes"] += sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+@contextmanager
+def worker_steps():
+    # Collect step totals inside a process pool worker, to be merged into the parent's stage metrics
+    metrics = StageMetrics("worker")
+    with metrics:
+        yield metrics.steps
+
+
+def merge_worker_steps(steps):
+    # Parent side of worker_steps
+    metrics = _active.get()
+    if metrics is not None:
+        metrics.merge(steps)
+
+
+def collect_metrics(task):
+    # Run task with metrics of its own, e.g. in a thread (which starts without the stage's context);
+    # merge_metrics folds them into the stage afterwards. Step CPU time covers the whole process
+    with StageMetrics("thread") as metrics:
+        result = task()
+    return result, metrics
+
+
+def merge_metrics(other):
+    # Parent side of collect_metrics
+    metrics = _active.get()
+    if metrics is not None:
+        metrics.merge(other.steps, other.memory)
@@ -0,0 +1,167 @@
+import json
+import logging
+import numpy as np
+import pandas as pd
+from dataset_io import atomic_write
+
+logger = logging.getLogger(__name__)
+
+EMPTY_IDS = np.empty(0, dtype=np.int64)
+
+# One bit per row-level rule in the issue_mask column of the validated and quarantined data
+RULE_BITS = {
+    "non_numeric": 1,
+    "invalid_numeric": 2,
+    "invalid_date": 4,
+    "unparseable_reference_range": 8,
+    "out_of_range": 16,
+    "missing_value": 32,
+}
+
+
+def rule_mask(rules):
+    return sum(RULE_BITS[rule] for rule in set(rules))
+
+
+def mask_rules(masks):
+    # Rule names of each mask, e.g. "invalid_numeric|missing_value", built once per distinct mask
+    codes, uniques = pd.factorize(masks)
+    names = ["|".join(rule for rule, bit in RULE_BITS.items() if mask & bit) for mask in uniques]
+    return pd.Categorical.from_codes(codes, categories=names)
+
+
+def bottom_k(row_ids, k):
+    # The k row ids with the smallest hashes: a uniform sample that merges to the same result in any order
+    if len(row_ids) <= k:
+        return row_ids
+    hashes = pd.util.hash_array(row_ids)
+    keep = np.argpartition(hashes, k - 1)[:k] if k else EMPTY_IDS
+    return row_ids[keep]
+
+
+class IssueCollector:
+    # Validation issues as (rule, dataset, column, count, sample row ids) records, keyed by a rank that
+    # orders the summary. Row ids are global: 0-based data rows counted across a dataset's input files in
+    # order, mapped back to a file and row by the sources. Samples are capped per rule and independent of
+    # chunking and sharding; warnings are limited per rule.
+
+    def __init__(self, sample_size=20, rule_sample_sizes=None, log_limit=10, deferred=False):
+        self.sample_size = sample_size
+        self.rule_sample_sizes = dict(rule_sample_sizes or {})
+        self.log_limit = log_limit
+        self.issues = {}
+        # Input files per dataset with the row ids they span, so sampled row ids map back to a file and row
+        self.sources = []
+        self.logged = {}
+        self.suppressed = {}
+        # Deferred collectors (process pool shards) keep their warnings for the parent, which applies the
+        # limit once, in shard order
+        self.deferred = deferred
+        self.pending = []
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config["issue_sample_size"], config["issue_sample_sizes"], config["issue_log_limit"])
+
+    @classmethod
+    def read(cls, records_path):
+        # The issues and sources another collector wrote (a hospital shard's), to be merged into this run's
+        with open(records_path, "r") as f:
+            data = json.load(f)
+        collector = cls(deferred=True)
+        for record in data["issues"]:
+            collector.issues[tuple(record["rank"])] = {
+                key: value for key, value in record.items() if key not in ("rank", "sample_row_ids")
+            } | {"sample_row_ids": np.asarray(record["sample_row_ids"], dtype=np.int64)}
+        collector.sources = data["sources"]
+        return collector
+
+    def spawn(self):
+        # Empty collector for one shard
+        return IssueCollector(self.sample_size, self.rule_sample_sizes, self.log_limit, deferred=True)
+
+    def sample_cap(self, rule):
+        return self.rule_sample_sizes.get(rule, self.sample_size)
+
+    def add(self, rank, rule, dataset, column, message, rows=None, detail=None):
+        # rows: ids of the offending rows; None for file-level issues, which have no count
+        issue = self.issues.get(rank)
+        if issue is None:
+            issue = self.issues[rank] = {
+                "rule": rule, "dataset": dataset, "column": column, "detail": detail, "message": message,
+                "count": None if rows is None else 0, "sample_row_ids": EMPTY_IDS,
+            }
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+            issue["count"] += len(rows)
+            if len(rows):
+                issue["sample_row_ids"] = bottom_k(np.concatenate([issue["sample_row_ids"], rows]), self.sample_cap(rule))
+
+    def add_source(self, dataset, file_name, row_ids):
+        # Rows read from one input file, chunk by chunk
+        last = self.sources[-1] if self.sources else {}
+        if (last.get("dataset"), last.get("file")) == (dataset, file_name):
+            last["rows"] += len(row_ids)
+        else:
+            self.sources.append({"dataset": dataset, "file": file_name,
+                                 "first_row_id": int(row_ids[0]) if len(row_ids) else None, "rows": len(row_ids)})
+
+    def warn(self, rule, message):
+        # At most log_limit warnings per rule; the rest are only counted
+        if self.deferred:
+            self.pending.append((rule, message))
+            return
+        if self.logged.get(rule, 0) >= self.log_limit:
+            self.suppressed[rule] = self.suppressed.get(rule, 0) + 1
+            return
+        self.logged[rule] = self.logged.get(rule, 0) + 1
+        logger.warning(message)
+
+    def merge(self, other):
+        for rank, issue in other.issues.items():
+            rows = None if issue["count"] is None else issue["sample_row_ids"]
+            self.add(rank, issue["rule"], issue["dataset"], issue["column"], issue["message"], rows, issue["detail"])
+            if issue["count"] is not None:
+                # The other collector's count covers more rows than its sample
+                self.issues[rank]["count"] += issue["count"] - len(rows)
+        self.sources += other.sources
+        for rule, message in other.pending:
+            self.warn(rule, message)
+        for rule, count in other.suppressed.items():
+            self.suppressed[rule] = self.suppressed.get(rule, 0) + count
+
+    def records(self):
+        # Issues with at least one row (or file-level ones), in rank order
+        return [
+            {key: value for key, value in issue.items() if key != "sample_row_ids"}
+            | {"sample_row_ids": sorted(issue["sample_row_ids"].tolist()), "rank": list(rank)}
+            for rank, issue in sorted(self.issues.items())
+            if issue["count"] != 0
+        ]
+
+    def summary(self):
+        # Human-readable lines, one per issue
+        return [
+            record["message"] if record["count"] is None else f"{record['message']}: {record['count']} records"
+            for record in self.records()
+        ]
+
+    def write(self, summary_path, records_path):
+        # Log and write the summary, and write the records as JSON; both files are always created. Shards
+        # warn once per chunk each, so the suppressed warnings depend on the sharding and are only logged
+        records, lines = self.records(), self.summary()
+        with atomic_write(summary_path) as tmp_path, open(tmp_path, "w") as f:
+            if lines:
+                for record, line in zip(records, lines):
+                    # Rules warned about during validation were logged then, with a sample
+                    if record["rule"] not in self.logged and record["rule"] not in self.suppressed:
+                        logger.warning(line)
+                f.write("\n".join(lines))
+            else:
+                logger.info("No validation issues found")
+                f.write("No issues detected")
+        for rule, count in sorted(self.suppressed.items()):
+            logger.warning(f"{count} further {rule} warnings suppressed")
+
+        with atomic_write(records_path) as tmp_path, open(tmp_path, "w") as f:
+            json.dump({"issues": records, "sources": self.sources}, f, indent=2)
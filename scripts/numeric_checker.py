@@ -0,0 +1,13 @@
+import numpy as np
+import pandas as pd
+
+
+def coerce_numeric(series, sample_size=10):
+    # One pass over the column: float values, a mask of present but non-numeric raw values, and a few of them
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        values = series.astype("float64")
+        return values, pd.Series(np.zeros(len(series), dtype=bool), index=series.index), []
+    values = pd.to_numeric(series, errors="coerce").astype("float64")
+    invalid = values.isna() & series.notna()
+    sample = series[invalid].unique()[:sample_size].tolist()
+    return values, invalid, sample
@@ -0,0 +1,110 @@
+import pandas as pd
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import repeat
+from queue import Queue, Full
+from instrumentation import collect_metrics, merge_metrics
+
+
+@contextmanager
+def worker_pool(workers):
+    # No pool for a single worker: callers then run their serial path
+    if workers <= 1:
+        yield None
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield pool
+
+
+def split_shards(frame, shard_by="hospital_id", shards=1):
+    # One shard per hospital, or a fixed number of buckets of hashed patient ids
+    if shard_by == "patient_id":
+        buckets = pd.util.hash_array(frame["patient_id"].astype(str).to_numpy()) % shards
+        groups = pd.Series(buckets, index=frame.index).groupby(buckets).indices
+    else:
+        groups = frame.groupby("hospital_id", observed=True, dropna=False, sort=True).indices
+    return [frame.iloc[positions] for _, positions in sorted(groups.items(), key=lambda item: str(item[0]))]
+
+
+def map_shards(pool, func, shards, *args):
+    # Results come back in shard order, whichever worker finishes first
+    return list(pool.map(func, shards, *[repeat(arg, len(shards)) for arg in args]))
+
+
+def run_concurrently(tasks, enabled=True):
+    # Independent I/O-bound calls, one per dataset, side by side in threads: the CSV tokenizer and the
+    # pyarrow readers and writers release the GIL while they parse and wait on the volume.
+    # Results and step metrics come back in task order; the first failure is raised
+    if not enabled or len(tasks) <= 1:
+        return [task() for task in tasks]
+    with ThreadPoolExecutor(max_workers=len(tasks)) as pool:
+        futures = [pool.submit(collect_metrics, task) for task in tasks]
+        results = [future.result() for future in futures]
+    for _, metrics in results:
+        merge_metrics(metrics)
+    return [result for result, _ in results]
+
+
+def read_ahead(iterables, threads=1, depth=2):
+    # The items of each iterable in turn, while up to `threads` iterables (e.g. one reader per file) are consumed
+    # ahead in threads, each holding at most `depth` items so memory stays bounded. Step metrics of each come back
+    # as it finishes; the first failure is raised
+    iterables = iter(iterables)
+    if threads <= 1:
+        for items in iterables:
+            yield from items
+        return
+
+    stop = threading.Event()
+    active = deque()
+
+    def offer(queue, message):
+        # Give up once the consumer has stopped, rather than block on a queue nobody reads
+        while not stop.is_set():
+            try:
+                queue.put(message, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce(items, queue):
+        def consume():
+            for item in items:
+                if not offer(queue, ("item", item)):
+                    return
+        try:
+            _, metrics = collect_metrics(consume)
+            offer(queue, ("done", metrics))
+        except BaseException as e:
+            offer(queue, ("error", e))
+
+    def start_next():
+        items = next(iterables, None)
+        if items is not None:
+            queue = Queue(maxsize=depth)
+            threading.Thread(target=produce, args=(items, queue), daemon=True).start()
+            active.append(queue)
+
+    try:
+        for _ in range(threads):
+            start_next()
+        while active:
+            kind, value = active[0].get()
+            if kind == "item":
+                yield value
+            elif kind == "done":
+                merge_metrics(value)
+                active.popleft()
+                start_next()
+            else:
+                raise value
+    finally:
+        stop.set()
+
+
+def combine_shards(shards):
+    # Put the rows of row-wise stages back in their original order
+    return pd.concat(shards).sort_index(kind="stable")
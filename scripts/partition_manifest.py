@@ -0,0 +1,78 @@
+import pandas as pd
+import json
+import os
+from pathlib import Path
+from date_parser import parse_dates
+
+# Rows whose partition date cannot be parsed share one partition per hospital
+UNKNOWN_MONTH = "unknown"
+
+# Partitions selected by validate_data, committed to the manifest once their stats are merged
+PENDING_FILE = "partitions.json"
+
+
+def partition_keys(frame, date_col, date_format, fallback_formats=()):
+    # "<hospital_id>|<YYYY-MM>" of the row's measurement/test date, parsed once per distinct value
+    dates = parse_dates(frame[date_col], date_format, fallback_formats)
+    months = dates.dt.strftime("%Y-%m").fillna(UNKNOWN_MONTH)
+    return frame["hospital_id"].astype(str) + "|" + months
+
+
+def fingerprint_frame(frame, date_col, date_format, fallback_formats=()):
+    # Order-independent content hash per partition: the wrapped sum of the row hashes, plus a row count
+    keys = partition_keys(frame, date_col, date_format, fallback_formats)
+    hashes = pd.util.hash_pandas_object(frame, index=False)
+    return hashes.groupby(keys).agg(["sum", "count"])
+
+
+def fingerprint_frames(frames, date_col, date_format, fallback_formats=()):
+    # Sums and counts add up across chunks and files, so large inputs are fingerprinted in bounded memory
+    totals = None
+    for frame in frames:
+        partial = fingerprint_frame(frame, date_col, date_format, fallback_formats)
+        totals = partial if totals is None else pd.concat([totals, partial]).groupby(level=0).sum()
+    if totals is None:
+        return {}
+    return {
+        key: {"hash": f"{int(total):016x}", "rows": int(count)}
+        for key, total, count in zip(totals.index, totals["sum"], totals["count"])
+    }
+
+
+def changed_partitions(fingerprints, processed):
+    # New partitions, or partitions whose content changed since they were processed
+    return {key: value for key, value in fingerprints.items() if processed.get(key, {}).get("hash") != value["hash"]}
+
+
+def select_partitions(frame, date_col, partitions, date_format, fallback_formats=()):
+    # Keep only the rows that belong to the given partitions
+    return frame[partition_keys(frame, date_col, date_format, fallback_formats).isin(list(partitions))].copy()
+
+
+def load_manifest(path):
+    # Missing manifest: nothing has been processed yet
+    if not Path(path).exists():
+        return {"vitals": {}, "labs": {}}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, path):
+    # Write to a temporary file first so a failed task never leaves a truncated manifest
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def commit_partitions(manifest_path, pending):
+    # Mark the partitions of this run as processed
+    manifest = load_manifest(manifest_path)
+    for dataset, partitions in pending.items():
+        manifest.setdefault(dataset, {}).update(partitions)
+    save_manifest(manifest, manifest_path)
+
+
+def month_partition_keys(frame, date_col):
+    # Partition keys of already aggregated rows (hospital_id plus a month-end date)
+    return frame["hospital_id"].astype(str) + "|" + frame[date_col].dt.strftime("%Y-%m")
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+# One row per (hospital, patient), built by the transform stage next to the transformed data
+INDEX_FILE = "patient_index.parquet"
+KEYS = ["hospital_id", "patient_id"]
+COUNT_COLUMNS = ["vitals_rows", "labs_rows", "vitals_missing", "labs_missing", "abnormal_vitals", "abnormal_labs"]
+DATE_COLUMNS = {"vitals": "measurement_date", "labs": "test_date"}
+
+
+def partial_index(frame, dataset):
+    # Counts and date bounds of one chunk, per (hospital, patient)
+    date_col = DATE_COLUMNS[dataset]
+    aggregations = {f"{dataset}_rows": (date_col, "size"), "first_date": (date_col, "min"), "last_date": (date_col, "max")}
+    if "missing_count" in frame.columns:
+        aggregations[f"{dataset}_missing"] = ("missing_count", "sum")
+    if "is_abnormal" in frame.columns:
+        aggregations[f"abnormal_{dataset}"] = ("is_abnormal", "sum")
+    part = frame.groupby(KEYS, observed=True, dropna=False, sort=False).agg(**aggregations).reset_index()
+    # Chunks have dictionaries of their own; the partials are small, so they combine as plain strings
+    return part.astype({key: object for key in KEYS})
+
+
+def combine_index(parts):
+    # Sum the counts and widen the date bounds over chunk and dataset partials, then code the patients
+    # as integers in sorted id order (missing ids get -1)
+    columns = KEYS + COUNT_COLUMNS + ["first_date", "last_date"]
+    parts = [part for part in parts if len(part)]
+    frame = pd.concat(parts, ignore_index=True).reindex(columns=columns) if parts else pd.DataFrame(columns=columns)
+    frame[COUNT_COLUMNS] = frame[COUNT_COLUMNS].fillna(0).astype("int64")
+    frame[["first_date", "last_date"]] = frame[["first_date", "last_date"]].apply(pd.to_datetime)
+    index = frame.groupby(KEYS, observed=True, dropna=False, sort=True).agg(
+        **{col: (col, "sum") for col in COUNT_COLUMNS}, first_date=("first_date", "min"), last_date=("last_date", "max")
+    ).reset_index()
+    codes, patients = pd.factorize(index["patient_id"], sort=True)
+    index.insert(2, "patient_code", codes.astype(np.int32))
+    return index.assign(
+        hospital_id=pd.Categorical(index["hospital_id"]),
+        patient_id=pd.Categorical.from_codes(codes, categories=patients),
+    )
+
+
+def build_index(vitals, labs):
+    # Index of whole in-memory tables
+    return combine_index([partial_index(vitals, "vitals"), partial_index(labs, "labs")])
+
+
+def quality_counts(index):
+    # The row-level quality metrics, in O(patients)
+    return {
+        "total_vitals_records": int(index["vitals_rows"].sum()),
+        "total_labs_records": int(index["labs_rows"].sum()),
+        "vitals_missing_values": int(index["vitals_missing"].sum()),
+        "labs_missing_values": int(index["labs_missing"].sum()),
+        "abnormal_lab_results": int(index["abnormal_labs"].sum()),
+        "unique_patients": len(np.unique(index["patient_code"].to_numpy())),
+    }
+
+
+def hospital_summary(index):
+    # Per-hospital rollup of the index: patients, rows, abnormal results and the dates covered
+    return (
+        index.groupby("hospital_id", observed=True, dropna=False, sort=True)
+        .agg(patients=("patient_code", "nunique"), **{col: (col, "sum") for col in COUNT_COLUMNS},
+             first_date=("first_date", "min"), last_date=("last_date", "max"))
+        .reset_index()
+    )
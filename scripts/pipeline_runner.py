@@ -0,0 +1,167 @@
+import pandas as pd
+import argparse
+import logging
+from functools import partial
+from pathlib import Path
+from config_model import load_config
+from data_validator import validate_data, validate_chunk, split_quarantine, write_issues
+from data_transformer import transform_data, transform_chunk
+from stats_calculator import calculate_statistics, compute_statistics, write_statistics, write_hospital_summary
+from feature_calculator import FEATURE_COLUMNS, calculate_features, compute_features, write_features
+from quality_reporter import generate_quality_report, write_quality_report
+from patient_index import INDEX_FILE, DATE_COLUMNS, build_index, quality_counts
+from dataset_io import DatasetWriter, input_paths, read_inputs, export_name, export_partitioned, drop_partitioned, dataset_path, \
+    export_ipc
+from parallel import worker_pool, run_concurrently
+from issue_collector import IssueCollector
+from instrumentation import StageMetrics, step, record_memory
+from schemas import VITALS_SCHEMA, LABS_SCHEMA, QUARANTINE_VITALS_SCHEMA, QUARANTINE_LABS_SCHEMA, CLEAN_VITALS_SCHEMA, CLEAN_LABS_SCHEMA, \
+    PATIENT_INDEX_SCHEMA, CATEGORICAL_COLUMNS, conform, compact, share_categories
+
+logger = logging.getLogger(__name__)
+
+
+def write_dataset(frame, path, schema, csv_path, sep, config):
+    with DatasetWriter(path, schema, config["parquet_compression"], csv_path, sep, config["date_format"]) as writer:
+        writer.write(frame)
+
+
+def write_datasets(vitals, labs, output_path, vitals_name, labs_name, vitals_schema, labs_schema, config):
+    # Same layout the per-task functions produce, so a later task can pick up from here
+    output_path.mkdir(parents=True, exist_ok=True)
+    vitals_csv = output_path / export_name(config["vitals_file"], "vitals") if config["export_csv"] else None
+    labs_csv = output_path / export_name(config["labs_file"], "labs") if config["export_csv"] else None
+    run_concurrently([
+        partial(write_dataset, vitals, output_path / vitals_name, vitals_schema, vitals_csv, config["vitals_sep"], config),
+        partial(write_dataset, labs, output_path / labs_name, labs_schema, labs_csv, config["labs_sep"], config),
+    ], config["concurrent_io"])
+
+
+def drop_intermediate(output_dir, config):
+    # Without --write-intermediate, validated and transformed datasets an earlier run left behind would be
+    # read as this run's by the per-task functions
+    validated_path = output_dir / config["validated_subdir"]
+    transformed_path = output_dir / config["transformed_subdir"]
+    for dataset in ("vitals", "labs"):
+        csv_name = export_name(config[f"{dataset}_file"], dataset)
+        for path in (dataset_path(validated_path, dataset), validated_path / csv_name,
+                     dataset_path(transformed_path, f"clean_{dataset}"),
+                     dataset_path(transformed_path, f"clean_{dataset}", ipc=True), transformed_path / csv_name):
+            path.unlink(missing_ok=True)
+        drop_partitioned(transformed_path / f"clean_{dataset}")
+    (transformed_path / INDEX_FILE).unlink(missing_ok=True)
+
+
+def validate_input(dataset, config, issues, pool=None):
+    # Each input file is validated on its own, so its columns are checked, then the rows are combined;
+    # repeated labels and ids are read straight into categoricals
+    frames = read_inputs(input_paths(config["input_dir"], config[f"{dataset}_file"]), config[f"{dataset}_sep"],
+                         config[f"{dataset}_columns"], dtype=dict.fromkeys(CATEGORICAL_COLUMNS, "category"),
+                         threads=config["read_threads"], root=config["input_dir"])
+    validated = []
+    for frame in frames:
+        issues.add_source(dataset, frame["source_file"].cat.categories[0], frame.index)
+        frame = compact(frame)
+        record_memory(f"raw_{dataset}", frame)
+        validated.append(validate_chunk(frame, dataset, config, issues, pool=pool))
+    return validated[0] if len(validated) == 1 else compact(pd.concat(validated))
+
+
+def run_pipeline(config_file="pipeline_config.json", write_intermediate=False):
+    # Run all five stages in one process, passing DataFrames from stage to stage
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        config = load_config(config_file)
+
+        # Streaming mode bounds memory by chunk size and incremental mode tracks partitions between
+        # stages through files, neither of which an in-memory run can honour
+        if config["streaming_enabled"] or config["incremental"]:
+            logger.info("Streaming or incremental mode enabled, running the stages through intermediate files")
+            return {
+                stage.__name__: stage(config_file)
+                for stage in (validate_data, transform_data, calculate_statistics, calculate_features,
+                              generate_quality_report)
+            }
+
+        output_dir = Path(config["output_dir"])
+        validated_path = output_dir / config["validated_subdir"]
+
+        with StageMetrics("run_pipeline") as stage_metrics, worker_pool(config["workers"]) as pool:
+            # Validate vitals and labs side by side, each into issues of its own, merged in dataset order
+            dataset_issues = [IssueCollector.from_config(config) for _ in range(2)]
+            vitals, labs = run_concurrently([
+                partial(validate_input, dataset, config, other, pool)
+                for dataset, other in zip(("vitals", "labs"), dataset_issues)
+            ], config["concurrent_io"])
+            issues = IssueCollector.from_config(config)
+            for other in dataset_issues:
+                issues.merge(other)
+            vitals, vitals_quarantined = split_quarantine(vitals, "vitals", config)
+            labs, labs_quarantined = split_quarantine(labs, "labs", config)
+            vitals = conform(vitals, VITALS_SCHEMA)
+            labs = conform(labs, LABS_SCHEMA)
+            validated_path.mkdir(parents=True, exist_ok=True)
+            write_issues(issues, validated_path, config)
+            # Quarantined rows are an output of their own, like the issues
+            write_datasets(vitals_quarantined, labs_quarantined, output_dir / config["quarantine_subdir"], "vitals.parquet",
+                           "labs.parquet", QUARANTINE_VITALS_SCHEMA, QUARANTINE_LABS_SCHEMA, config)
+            if write_intermediate:
+                write_datasets(vitals, labs, validated_path, "vitals.parquet", "labs.parquet",
+                               VITALS_SCHEMA, LABS_SCHEMA, config)
+
+            # Transform
+            vitals = conform(transform_chunk(vitals, "vitals", config, pool), CLEAN_VITALS_SCHEMA)
+            labs = conform(transform_chunk(labs, "labs", config, pool), CLEAN_LABS_SCHEMA)
+            vitals, labs = share_categories(vitals, labs)
+            record_memory("vitals", vitals)
+            record_memory("labs", labs)
+            with step("patient_index"):
+                index = build_index(vitals, labs)
+            if write_intermediate:
+                write_datasets(vitals, labs, output_dir / config["transformed_subdir"], "clean_vitals.parquet",
+                               "clean_labs.parquet", CLEAN_VITALS_SCHEMA, CLEAN_LABS_SCHEMA, config)
+                write_dataset(index, output_dir / config["transformed_subdir"] / INDEX_FILE, PATIENT_INDEX_SCHEMA, None, None, config)
+                if config["transformed_ipc"]:
+                    for dataset in ("vitals", "labs"):
+                        export_ipc(dataset_path(output_dir / config["transformed_subdir"], f"clean_{dataset}"),
+                                   dataset_path(output_dir / config["transformed_subdir"], f"clean_{dataset}", ipc=True))
+                if config["partitioned_datasets"]:
+                    for dataset in ("vitals", "labs"):
+                        export_partitioned(output_dir / config["transformed_subdir"] / f"clean_{dataset}.parquet",
+                                           output_dir / config["transformed_subdir"] / f"clean_{dataset}",
+                                           DATE_COLUMNS[dataset], config["parquet_compression"])
+                else:
+                    for dataset in ("vitals", "labs"):
+                        drop_partitioned(output_dir / config["transformed_subdir"] / f"clean_{dataset}")
+            else:
+                drop_intermediate(output_dir, config)
+
+            # Statistics work on the transformed frames, the hospital rollup and quality report on the patient index
+            with step("aggregate"):
+                vitals_stats, lab_stats = compute_statistics(vitals, labs, config["median_mode"], config["median_error"], pool)
+            write_statistics(vitals_stats, lab_stats, output_dir / config["stats_subdir"], config["concurrent_io"],
+                             config["partitioned_datasets"], config["parquet_compression"])
+            write_hospital_summary(index, output_dir / config["stats_subdir"])
+            for dataset, frame in (("vitals", vitals), ("labs", labs)):
+                write_features(compute_features(frame[FEATURE_COLUMNS[dataset]], dataset, config, pool), dataset, config)
+            with step("metrics"):
+                metrics = quality_counts(index) | {"quarantined_vitals_records": len(vitals_quarantined),
+                                                   "quarantined_labs_records": len(labs_quarantined)}
+            write_quality_report(metrics, output_dir / config["reports_subdir"])
+
+        logger.info("Pipeline completed")
+        return stage_metrics.write(output_dir / config["reports_subdir"])
+
+    except Exception as e:
+        logger.error(f"Pipeline failed: {e}")
+        raise
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the healthcare pipeline in a single process")
+    parser.add_argument("--config", default="pipeline_config.json", help="Config file name in the config directory")
+    parser.add_argument("--write-intermediate", action="store_true",
+                        help="Also write the validated and transformed datasets")
+    args = parser.parse_args()
+    run_pipeline(args.config, write_intermediate=args.write_intermediate)
@@ -1,55 +1,202 @@
+import json
+import numpy as np
 import pandas as pd
 import logging
+from functools import partial
 from pathlib import Path
-import json
-import os  
-from config_model import PipelineConfig
-
-def generate_quality_report(config_file="pipeline_config.json"):
-    # Configure logging
-    logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(__name__)
-
-    try:
-        # Load and validate configuration
-        config_dir = "/opt/airflow/config" if os.environ.get("DOCKER_ENV", "false").lower() == "true" else "./config"
-        config_path = os.path.join(config_dir, config_file if config_file != "test_pipeline_config.json" else config_file)
-        if config_file == "test_pipeline_config.json" and os.environ.get("TEST_MODE", "false").lower() != "true":
-            config_path = os.path.join(config_dir, "pipeline_config.json")
-
-        with open(config_path, "r") as f:
-            config_data = json.load(f)
-        config = PipelineConfig(**config_data).model_dump()
-
-        # Extract config values
-        output_dir = config["output_dir"]
-        transformed_subdir = config["transformed_subdir"]
-        reports_subdir = config["reports_subdir"]
-
-        # Define input and output paths
-        input_path = Path(output_dir) / transformed_subdir
-        output_path = Path(output_dir) / reports_subdir
-
-        # Read transformed files
-        vitals = pd.read_parquet(input_path / "clean_vitals.parquet")
-        labs = pd.read_parquet(input_path / "clean_labs.parquet")
-
-        # Calculate quality metrics
-        metrics = {
-            "total_vitals_records": len(vitals),
-            "total_labs_records": len(labs),
-            "vitals_missing_values": vitals.isnull().sum().sum(),
-            "labs_missing_values": labs.isnull().sum().sum(),
-            "abnormal_lab_results": labs["is_abnormal"].sum(),
-            "unique_patients": len(set(vitals["patient_id"]).union(set(labs["patient_id"]))),
-        }
-
-        # Save quality report
-        output_path.mkdir(parents=True, exist_ok=True)
-        pd.DataFrame([metrics]).to_csv(output_path / "quality_report.csv", index=False)
-
-        logger.info("Quality report generated")
-
-    except Exception as e:
-        logger.error(f"Quality report failed: {e}")
-        raise
\ No newline at end of file
+from dataset_io import count_nulls, count_rows, dataset_columns, read_dataset, dataset_path, atomic_write
+from schemas import share_categories
+from instrumentation import step, add_file_bytes, record_memory
+from stage_cache import run_stage_task
+from parallel import run_concurrently
+from patient_index import INDEX_FILE, DATE_COLUMNS, quality_counts
+from partition_manifest import PENDING_FILE, partition_keys
+
+logger = logging.getLogger(__name__)
+
+# Incremental mode: the report's counts per (dataset, partition, hospital, patient), kept between runs so the
+# partitions a run did not reprocess still count towards the totals
+QUALITY_STATE_FILE = "quality_state.parquet"
+STATE_KEYS = ["dataset", "partition", "hospital_id", "patient_id"]
+STATE_COUNTS = ["rows", "missing", "abnormal", "quarantined"]
+
+
+def unique_patients(vitals_ids, labs_ids):
+    # Categoricals with shared categories are combined on their codes, without decoding the ids
+    if (isinstance(vitals_ids.dtype, pd.CategoricalDtype) and isinstance(labs_ids.dtype, pd.CategoricalDtype)
+            and vitals_ids.cat.categories.equals(labs_ids.cat.categories)):
+        codes = np.union1d(vitals_ids.cat.codes.to_numpy(), labs_ids.cat.codes.to_numpy())
+        return int((codes >= 0).sum() + (vitals_ids.isna().any() or labs_ids.isna().any()))
+    return len(set(vitals_ids).union(set(labs_ids)))
+
+
+def missing_values(frame):
+    # The validator counts each row's missing values; frames without that count are scanned
+    if "missing_count" in frame.columns:
+        return int(frame["missing_count"].sum())
+    return frame.isnull().sum().sum()
+
+
+def compute_quality_metrics(vitals, labs, vitals_missing=None, labs_missing=None, vitals_quarantined=0, labs_quarantined=0):
+    # Missing-value counts can be passed in when they are known without scanning the frames
+    if vitals_missing is None:
+        vitals_missing = missing_values(vitals)
+    if labs_missing is None:
+        labs_missing = missing_values(labs)
+
+    # Calculate quality metrics
+    return {
+        "total_vitals_records": len(vitals),
+        "total_labs_records": len(labs),
+        "vitals_missing_values": vitals_missing,
+        "labs_missing_values": labs_missing,
+        "abnormal_lab_results": labs["is_abnormal"].sum(),
+        "unique_patients": unique_patients(vitals["patient_id"], labs["patient_id"]),
+        "quarantined_vitals_records": vitals_quarantined,
+        "quarantined_labs_records": labs_quarantined,
+    }
+
+
+def read_counted(path, columns):
+    # The projected columns plus the validator's per-row missing counts, or else the null count from the file metadata
+    if "missing_count" in dataset_columns(path):
+        return read_dataset(path, columns=columns + ["missing_count"]), None
+    return read_dataset(path, columns=columns), count_nulls(path)
+
+
+def partition_counts(path, dataset, column, config):
+    # Rows of one clean or quarantined dataset per (partition, hospital, patient), counted into `column`;
+    # clean rows also carry their missing values and abnormal results
+    date_col = DATE_COLUMNS[dataset]
+    available = dataset_columns(path)
+    frame = read_dataset(path, columns=[col for col in ("hospital_id", "patient_id", date_col, "missing_count", "is_abnormal")
+                                        if col in available])
+    add_file_bytes("read", path)
+    clean = column == "rows"
+    counts = pd.DataFrame({
+        "partition": partition_keys(frame, date_col, config["date_format"], config["date_fallback_formats"]),
+        "hospital_id": frame["hospital_id"].astype(object),
+        "patient_id": frame["patient_id"].astype(object),
+        "rows": int(clean),
+        "missing": frame["missing_count"].astype("int64") if clean and "missing_count" in frame.columns else 0,
+        "abnormal": frame["is_abnormal"].fillna(False).astype("int64") if clean and "is_abnormal" in frame.columns else 0,
+        "quarantined": int(not clean),
+        "dataset": dataset,
+    })
+    return counts.groupby(STATE_KEYS, dropna=False, sort=False)[STATE_COUNTS].sum().reset_index()
+
+
+def update_quality_state(state, output_dir, config):
+    # Replace the state's rows of the partitions one incremental run (or shard) reprocessed, from that run's
+    # clean and quarantined data
+    output_dir = Path(output_dir)
+    with open(output_dir / config["validated_subdir"] / PENDING_FILE, "r") as f:
+        pending = json.load(f)
+    parts = [] if state is None else [state]
+    for dataset in ("vitals", "labs"):
+        if state is not None:
+            parts[0] = parts[0][~((parts[0]["dataset"] == dataset) & parts[0]["partition"].isin(list(pending[dataset])))]
+        parts.append(partition_counts(dataset_path(output_dir / config["transformed_subdir"], f"clean_{dataset}",
+                                                   config["transformed_ipc"]), dataset, "rows", config))
+        parts.append(partition_counts(output_dir / config["quarantine_subdir"] / f"{dataset}.parquet", dataset,
+                                      "quarantined", config))
+    state = pd.concat([part for part in parts if len(part)] or parts[:1], ignore_index=True)
+    return state.groupby(STATE_KEYS, dropna=False, sort=True)[STATE_COUNTS].sum().reset_index()
+
+
+def state_metrics(state):
+    # The report's metrics over every partition processed so far
+    vitals = state[state["dataset"] == "vitals"]
+    labs = state[state["dataset"] == "labs"]
+    return {
+        "total_vitals_records": int(vitals["rows"].sum()),
+        "total_labs_records": int(labs["rows"].sum()),
+        "vitals_missing_values": int(vitals["missing"].sum()),
+        "labs_missing_values": int(labs["missing"].sum()),
+        "abnormal_lab_results": int(labs["abnormal"].sum()),
+        "unique_patients": int(state.loc[state["rows"] > 0, "patient_id"].nunique(dropna=False)),
+        "quarantined_vitals_records": int(vitals["quarantined"].sum()),
+        "quarantined_labs_records": int(labs["quarantined"].sum()),
+    }
+
+
+def load_quality_state(output_path):
+    path = output_path / QUALITY_STATE_FILE
+    if not path.exists():
+        return None
+    state = read_dataset(path)
+    add_file_bytes("read", path)
+    return state
+
+
+def write_quality_state(state, output_path):
+    output_path.mkdir(parents=True, exist_ok=True)
+    with step("write") as record, atomic_write(output_path / QUALITY_STATE_FILE) as tmp_path:
+        state.to_parquet(tmp_path, index=False)
+        record["rows"] += len(state)
+    add_file_bytes("write", output_path / QUALITY_STATE_FILE)
+
+
+def write_quality_report(metrics, output_path):
+    # Save quality report
+    output_path.mkdir(parents=True, exist_ok=True)
+    with step("write") as record, atomic_write(output_path / "quality_report.csv") as tmp_path:
+        pd.DataFrame([metrics]).to_csv(tmp_path, index=False)
+        record["rows"] += 1
+    add_file_bytes("write", output_path / "quality_report.csv")
+
+
+def run_quality_report(config, shard):
+    # Extract config values
+    output_dir = config["output_dir"]
+    transformed_subdir = config["transformed_subdir"]
+    reports_subdir = config["reports_subdir"]
+
+    # Define input and output paths
+    input_path = Path(output_dir) / transformed_subdir
+    output_path = Path(output_dir) / reports_subdir
+
+    quarantine_path = Path(output_dir) / config["quarantine_subdir"]
+    quarantined = {
+        "quarantined_vitals_records": count_rows(quarantine_path / "vitals.parquet"),
+        "quarantined_labs_records": count_rows(quarantine_path / "labs.parquet"),
+    }
+
+    if config["incremental"]:
+        # This run's data only holds the changed partitions: merge their counts into the earlier runs'
+        with step("metrics"):
+            state = update_quality_state(load_quality_state(output_path), output_dir, config)
+            metrics = state_metrics(state)
+        write_quality_state(state, output_path)
+    elif (input_path / INDEX_FILE).exists():
+        # The transform stage's patient index holds every count the metrics need, one row per patient
+        index = read_dataset(input_path / INDEX_FILE)
+        add_file_bytes("read", input_path / INDEX_FILE)
+        record_memory("patient_index", index)
+        with step("metrics"):
+            metrics = quality_counts(index) | quarantined
+    else:
+        # Read only the columns the metrics need: missing values come from the per-row counts
+        # the validator wrote, or else from the file metadata
+        vitals_file = dataset_path(input_path, "clean_vitals", config["transformed_ipc"])
+        labs_file = dataset_path(input_path, "clean_labs", config["transformed_ipc"])
+        (vitals, vitals_missing), (labs, labs_missing) = run_concurrently([
+            partial(read_counted, vitals_file, ["patient_id"]),
+            partial(read_counted, labs_file, ["patient_id", "is_abnormal"]),
+        ], config["concurrent_io"])
+        add_file_bytes("read", vitals_file, labs_file)
+        vitals, labs = share_categories(vitals, labs)
+        record_memory("vitals", vitals)
+        record_memory("labs", labs)
+
+        with step("metrics"):
+            metrics = compute_quality_metrics(vitals, labs, vitals_missing, labs_missing,
+                                              quarantined["quarantined_vitals_records"],
+                                              quarantined["quarantined_labs_records"])
+    write_quality_report(metrics, output_path)
+
+    logger.info("Quality report generated")
+
+
+def generate_quality_report(config_file="pipeline_config.json", partition=None):
+    return run_stage_task("generate_quality_report", config_file, partition, run_quality_report, "Quality report failed")
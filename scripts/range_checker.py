@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+# "<min>-<max>", allowing negative bounds and whitespace around the separator
+RANGE_PATTERN = r"^\s*(-?\d+(?:\.\d+)?)\s*-\s*(-?\d+(?:\.\d+)?)\s*$"
+
+
+def parse_reference_range(reference_range):
+    # Parse each distinct range string once, then broadcast the bounds back to the rows
+    codes, uniques = pd.factorize(reference_range)
+    parsed = pd.Series(uniques, dtype="object").astype(str).str.extract(RANGE_PATTERN).astype(float)
+    # Code -1 marks missing ranges; the trailing NaN row absorbs it
+    mins = np.append(parsed[0].to_numpy(), np.nan)
+    maxs = np.append(parsed[1].to_numpy(), np.nan)
+    return pd.DataFrame({"min": mins[codes], "max": maxs[codes]}, index=reference_range.index)
+
+
+def range_table(ranges):
+    # Config ranges ({type: {"min": x, "max": y}}) as a lookup table indexed by type
+    table = pd.DataFrame.from_dict(ranges, orient="index", columns=["min", "max"], dtype=float)
+    return table
+
+
+def resolve_bounds(frame, type_col, ranges, reference_col=None, conversions=None):
+    # Lookup join of the row types against the config range table (or the ranges it is built from)
+    codes, uniques = pd.factorize(frame[type_col])
+    table = ranges if isinstance(ranges, pd.DataFrame) else range_table(ranges)
+    table = table.reindex(uniques)
+    mins = np.append(table["min"].to_numpy(), np.nan)[codes]
+    maxs = np.append(table["max"].to_numpy(), np.nan)[codes]
+    bounds = pd.DataFrame({"min": mins, "max": maxs}, index=frame.index)
+
+    # Types without a config range fall back to the row's own reference range, which is in the row's unit:
+    # with conversions, it is converted like the row's value (config ranges are in the target units)
+    if reference_col is not None:
+        unresolved = bounds["min"].isna()
+        if unresolved.any():
+            parsed = parse_reference_range(frame.loc[unresolved, reference_col])
+            if conversions is not None:
+                selected = conversions.loc[unresolved]
+                parsed = parsed.mul(selected["factor"], axis=0).add(selected["offset"], axis=0)
+            bounds.loc[unresolved] = parsed.to_numpy()
+    return bounds
+
+
+def count_out_of_range(types, values, bounds):
+    # Missing values and unknown bounds never count as out of range
+    mask = (values < bounds["min"]) | (values > bounds["max"])
+    mask = mask & values.notna()
+    counts = types[mask].value_counts(sort=False)
+    return mask, counts[counts > 0]
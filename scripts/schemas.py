@@ -0,0 +1,151 @@
+import pyarrow as pa
+import pandas as pd
+
+# Low-cardinality labels are dictionary encoded, dates are real timestamps, values are floats
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+TIMESTAMP = pa.timestamp("ns")
+
+# Repeated labels and ids: categoricals in memory, dictionary encoded on disk
+CATEGORICAL_COLUMNS = ["hospital_id", "patient_id", "vital_type", "test_type", "unit", "reference_range", "source_file"]
+
+# Columns found in both tables; their categories are aligned so the tables combine without decoding
+SHARED_CATEGORICAL_COLUMNS = ["hospital_id", "patient_id", "unit"]
+
+VITALS_SCHEMA = pa.schema([
+    ("hospital_id", CATEGORY),
+    ("measurement_date", TIMESTAMP),
+    ("patient_id", CATEGORY),
+    ("vital_type", CATEGORY),
+    ("value", pa.float64()),
+    ("unit", CATEGORY),
+    ("date_of_birth", TIMESTAMP),
+    ("issue_mask", pa.uint16()),
+    ("missing_count", pa.uint8()),
+    # Provenance: input file (relative to input_dir) and 0-based data row within it
+    ("source_file", CATEGORY),
+    ("source_row", pa.uint32()),
+])
+
+LABS_SCHEMA = pa.schema([
+    ("hospital_id", CATEGORY),
+    ("test_date", TIMESTAMP),
+    ("patient_id", CATEGORY),
+    ("test_type", CATEGORY),
+    ("result_value", pa.float64()),
+    ("reference_range", CATEGORY),
+    ("unit", CATEGORY),
+    ("date_of_birth", TIMESTAMP),
+    ("issue_mask", pa.uint16()),
+    ("missing_count", pa.uint8()),
+    ("source_file", CATEGORY),
+    ("source_row", pa.uint32()),
+])
+
+# Quarantined rows keep the validated columns, their row id across the input files and the rules they failed
+QUARANTINE_VITALS_SCHEMA = VITALS_SCHEMA.append(pa.field("row_id", pa.int64())).append(pa.field("failed_rules", CATEGORY))
+
+QUARANTINE_LABS_SCHEMA = LABS_SCHEMA.append(pa.field("row_id", pa.int64())).append(pa.field("failed_rules", CATEGORY))
+
+# Transformed rows: values in the converted units, with the age at measurement and the out-of-range flag
+CLEAN_VITALS_SCHEMA = VITALS_SCHEMA.append(pa.field("age", pa.int16())).append(pa.field("is_abnormal", pa.bool_()))
+
+CLEAN_LABS_SCHEMA = LABS_SCHEMA.append(pa.field("age", pa.int16())).append(pa.field("is_abnormal", pa.bool_()))
+
+# Time-series features: one row per transformed reading, in (hospital, patient, type, date) order
+FEATURE_FIELDS = [
+    ("last_value", pa.float64()),
+    ("delta", pa.float64()),
+    ("days_since_last", pa.float64()),
+    ("rolling_mean_readings", pa.float64()),
+    ("rolling_mean_days", pa.float64()),
+]
+
+VITALS_FEATURES_SCHEMA = pa.schema([
+    ("hospital_id", CATEGORY),
+    ("patient_id", CATEGORY),
+    ("vital_type", CATEGORY),
+    ("measurement_date", TIMESTAMP),
+    ("value", pa.float64()),
+    *FEATURE_FIELDS,
+])
+
+LABS_FEATURES_SCHEMA = pa.schema([
+    ("hospital_id", CATEGORY),
+    ("patient_id", CATEGORY),
+    ("test_type", CATEGORY),
+    ("test_date", TIMESTAMP),
+    ("result_value", pa.float64()),
+    *FEATURE_FIELDS,
+])
+
+# Patient index: counts per (hospital, patient), with the patients coded as integers in sorted id order
+PATIENT_INDEX_SCHEMA = pa.schema([
+    ("hospital_id", CATEGORY),
+    ("patient_id", CATEGORY),
+    ("patient_code", pa.int32()),
+    ("vitals_rows", pa.int64()),
+    ("labs_rows", pa.int64()),
+    ("vitals_missing", pa.int64()),
+    ("labs_missing", pa.int64()),
+    ("abnormal_vitals", pa.int64()),
+    ("abnormal_labs", pa.int64()),
+    ("first_date", TIMESTAMP),
+    ("last_date", TIMESTAMP),
+])
+
+
+def to_table(frame, schema):
+    # Cast a DataFrame to the declared schema; columns missing from the frame become nulls
+    arrays = []
+    for field in schema:
+        if field.name not in frame.columns:
+            arrays.append(pa.nulls(len(frame), type=field.type))
+            continue
+        column = frame[field.name]
+        if pa.types.is_dictionary(field.type) and is_string_categorical(column):
+            # Categoricals map straight onto dictionary arrays without materializing the strings
+            arrays.append(pa.array(column.cat.remove_unused_categories(), from_pandas=True).cast(field.type))
+            continue
+        if pa.types.is_timestamp(field.type):
+            column = pd.to_datetime(column, errors="coerce")
+        elif pa.types.is_floating(field.type):
+            column = pd.to_numeric(column, errors="coerce").astype("float64")
+        elif pa.types.is_boolean(field.type):
+            column = column.astype("boolean")
+        elif pa.types.is_integer(field.type):
+            column = pd.to_numeric(column, errors="coerce")
+        else:
+            column = column.astype("string")
+        array = pa.array(column, from_pandas=True)
+        arrays.append(array.cast(field.type) if not pa.types.is_dictionary(field.type) else array.dictionary_encode().cast(field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def is_string_categorical(column):
+    return isinstance(column.dtype, pd.CategoricalDtype) and column.cat.categories.inferred_type in ("string", "empty")
+
+
+def compact(frame):
+    # Repeated labels and ids as categoricals; a column with anything but strings is left as it is
+    categoricals = {
+        col: frame[col].astype("category")
+        for col in CATEGORICAL_COLUMNS
+        if col in frame.columns and not isinstance(frame[col].dtype, pd.CategoricalDtype)
+        and pd.api.types.infer_dtype(frame[col], skipna=True) in ("string", "empty")
+    }
+    return frame.assign(**categoricals) if categoricals else frame
+
+
+def share_categories(*frames):
+    # One sorted dictionary per shared column across all tables, so codes mean the same everywhere
+    shared = {}
+    for col in SHARED_CATEGORICAL_COLUMNS:
+        if not all(col in frame.columns and is_string_categorical(frame[col]) for frame in frames):
+            continue
+        shared[col] = pd.CategoricalDtype(sorted(set().union(*(frame[col].cat.categories for frame in frames))))
+    return [frame.astype(shared) if shared else frame for frame in frames]
+
+
+def conform(frame, schema):
+    # In-memory equivalent of a Parquet round trip through the declared schema
+    return to_table(frame, schema).to_pandas()
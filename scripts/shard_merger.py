@@ -0,0 +1,240 @@
+import logging
+import shutil
+from functools import partial
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from config_model import load_config
+from dataset_io import (DatasetWriter, read_dataset, count_rows, temporary_path, replace_dir, dataset_path, export_ipc,
+                        export_name, drop_partitioned)
+from schemas import (PATIENT_INDEX_SCHEMA, QUARANTINE_VITALS_SCHEMA, QUARANTINE_LABS_SCHEMA, CLEAN_VITALS_SCHEMA,
+                     CLEAN_LABS_SCHEMA)
+from issue_collector import IssueCollector
+from data_validator import write_issues
+from patient_index import INDEX_FILE, combine_index, quality_counts
+from stats_calculator import (HOSPITAL_SUMMARY_FILE, STATS_DATASETS, sort_stats, write_statistics, write_parquet,
+                              write_hospital_summary)
+from stage_cache import link_or_copy
+from quality_reporter import (write_quality_report, load_quality_state, update_quality_state, state_metrics,
+                              write_quality_state)
+from hospital_shards import MISSING_HOSPITAL, load_shards, load_sources, partition_dir
+from feature_calculator import SCHEMAS as FEATURE_SCHEMAS
+from instrumentation import StageMetrics, step, add_file_bytes, record_memory
+from parallel import run_concurrently
+
+logger = logging.getLogger(__name__)
+
+DATASETS = ("vitals", "labs")
+
+def read_shard_files(paths):
+    # The shards' copies of one output; shards that wrote none are skipped
+    frames = []
+    for path in paths:
+        if path.exists():
+            frames.append(read_dataset(path))
+            add_file_bytes("read", path)
+    return frames
+
+
+def merge_stats_files(kind, stats_dirs):
+    # A hospital's groups all live in its own shard, so the shards' stats only need concatenating and sorting
+    name, type_col, date_col = STATS_DATASETS[kind]
+    frames = [frame for frame in read_shard_files([path / f"{name}.parquet" for path in stats_dirs]) if len(frame)]
+    if not frames:
+        return pd.DataFrame(columns=["hospital_id", type_col, date_col, "mean", "median", "min", "max", "count"])
+    return sort_stats(pd.concat(frames, ignore_index=True), type_col, date_col)
+
+
+def merge_state_files(kind, stats_dirs):
+    # Sketch states of the shards, in the (hospital, type, month) order of a single run's states
+    name, type_col, date_col = STATS_DATASETS[kind]
+    frames = [frame for frame in read_shard_files([path / f"{name}_state.parquet" for path in stats_dirs]) if len(frame)]
+    if not frames:
+        return None
+    merged = pd.concat(frames, ignore_index=True)
+    return merged.sort_values(["hospital_id", type_col, date_col], kind="stable").reset_index(drop=True)
+
+
+def merge_issue_files(paths, config):
+    # The shards' validation issues as one run's: counts add up and samples merge as for chunk shards. A shard
+    # only read its splits of the input files, so the input files themselves come from the shard discovery
+    issues = IssueCollector.from_config(config)
+    for path in paths:
+        if path.exists():
+            issues.merge(IssueCollector.read(path))
+    issues.sources = load_sources(config)
+    return issues
+
+
+def merge_dataset_files(dataset, name, subdir, schema, shard_dirs, first_rows, config):
+    # The shards' rows of one output (quarantined or clean) in input order, as a single run writes them: a
+    # row's place is its input file's first row id plus its row within the file
+    output_path = Path(config["output_dir"]) / subdir
+    output_path.mkdir(parents=True, exist_ok=True)
+    csv_path = output_path / export_name(config[f"{dataset}_file"], dataset) if config["export_csv"] else None
+    paths = [path for path in (dataset_path(shard_dir / subdir, name) for shard_dir in shard_dirs) if path.exists()]
+    with DatasetWriter(dataset_path(output_path, name), schema, config["parquet_compression"], csv_path,
+                       config[f"{dataset}_sep"], config["date_format"]) as writer:
+        if paths:
+            # Concatenated as Arrow tables, whose dictionaries are unified once on conversion; the files are read
+            # on their own, as the shard directory names would read as a hospital_id partition key
+            with step("read") as record:
+                table = pa.concat_tables([pq.ParquetFile(path).read() for path in paths])
+                record["rows"] += table.num_rows
+            add_file_bytes("read", *paths)
+            frame = table.to_pandas()
+            row_ids = (frame["source_file"].astype(object).map(first_rows).to_numpy(dtype=np.int64)
+                       + frame["source_row"].to_numpy(dtype=np.int64))
+            writer.write(frame.iloc[np.argsort(row_ids, kind="stable")])
+
+
+def merge_feature_files(dataset, shard_dirs, config):
+    # A patient's series never spans hospitals, so the shards' features, in the serial hospital order, are a
+    # single run's; each shard's file is copied as it is, one after the other
+    output_path = Path(config["output_dir"]) / config["features_subdir"]
+    output_path.mkdir(parents=True, exist_ok=True)
+    paths = [path for path in (shard_dir / config["features_subdir"] / f"{dataset}_features.parquet"
+                               for shard_dir in shard_dirs) if path.exists()]
+    with DatasetWriter(output_path / f"{dataset}_features.parquet", FEATURE_SCHEMAS[dataset],
+                       config["parquet_compression"]) as writer:
+        for path in paths:
+            # Read on its own, as the shard directory name would read as a hospital_id partition key
+            with step("read") as record:
+                frame = pq.ParquetFile(path).read().to_pandas()
+                record["rows"] += len(frame)
+            add_file_bytes("read", path)
+            writer.write(frame)
+
+
+def link_partitions(source, target):
+    # Replace the target's directory of each hospital in source by (hard links to) source's files
+    for hospital_dir in sorted(Path(source).glob("hospital_id=*")):
+        tmp_dir = temporary_path(Path(target) / hospital_dir.name)
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        for path in hospital_dir.rglob("*.parquet"):
+            link_or_copy(path, tmp_dir / path.relative_to(hospital_dir))
+        replace_dir(tmp_dir, Path(target) / hospital_dir.name)
+
+
+def merge_partitions(config_file="pipeline_config.json", partitions=None):
+    # Reduce task of the DAG: the final stats, patient index, hospital summary and quality report from
+    # the hospital shards' outputs (by default every discovered shard)
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        config = load_config(config_file)
+        shards = load_shards(config)
+        partitions = list(shards) if partitions is None else list(partitions)
+        shard_dirs = [partition_dir(config, partition) for partition in partitions]
+        # Row id of the first row of each input file, from the shards reading it
+        first_rows = {dataset: {name: first_row for partition in partitions for name, first_row in shards[partition][dataset]}
+                      for dataset in DATASETS}
+
+        output_dir = Path(config["output_dir"])
+        stats_path = output_dir / config["stats_subdir"]
+        transformed_path = output_dir / config["transformed_subdir"]
+        transformed_path.mkdir(parents=True, exist_ok=True)
+        concurrent_io = config["concurrent_io"]
+
+        with StageMetrics("merge_partitions") as stage_metrics:
+            stats_dirs = [path / config["stats_subdir"] for path in shard_dirs]
+            with step("merge"):
+                vitals_stats, lab_stats = run_concurrently([
+                    partial(merge_stats_files, kind, stats_dirs) for kind in STATS_DATASETS
+                ], concurrent_io)
+            write_statistics(vitals_stats, lab_stats, stats_path, concurrent_io, config["partitioned_datasets"],
+                             config["parquet_compression"])
+            if config["median_mode"] == "sketch":
+                with step("merge"):
+                    states = {kind: merge_state_files(kind, stats_dirs) for kind in STATS_DATASETS}
+                for kind, frame in states.items():
+                    if frame is not None:
+                        write_parquet(frame, stats_path / f"{STATS_DATASETS[kind][0]}_state.parquet", index=False)
+
+            # The shards' validation issues and quarantined rows, as a single run's validated/ and quarantine/
+            validated_path = output_dir / config["validated_subdir"]
+            validated_path.mkdir(parents=True, exist_ok=True)
+            with step("merge"):
+                issues = merge_issue_files([path / config["validated_subdir"] / config["issues_records_file"]
+                                            for path in shard_dirs], config)
+            write_issues(issues, validated_path, config)
+            for dataset, schema in zip(DATASETS, (QUARANTINE_VITALS_SCHEMA, QUARANTINE_LABS_SCHEMA)):
+                merge_dataset_files(dataset, dataset, config["quarantine_subdir"], schema, shard_dirs, first_rows[dataset],
+                                    config)
+
+            # Each shard's partitioned transformed data holds its own hospital's directories; together they
+            # make up the final datasets. A full run swaps in complete new datasets, so hospitals of earlier
+            # runs' shards do not linger; an incremental run replaces its shards' hospitals and keeps the others
+            for dataset in DATASETS:
+                target = transformed_path / f"clean_{dataset}"
+                if not config["partitioned_datasets"]:
+                    drop_partitioned(target)
+                    continue
+                with step("link_partitions"):
+                    merged = target if config["incremental"] else temporary_path(target)
+                    if not config["incremental"]:
+                        shutil.rmtree(merged, ignore_errors=True)
+                    merged.mkdir(parents=True, exist_ok=True)
+                    for path in shard_dirs:
+                        link_partitions(path / config["transformed_subdir"] / f"clean_{dataset}", merged)
+                    if not config["incremental"]:
+                        replace_dir(merged, target)
+
+            # The shards' clean rows make up the final transformed files, next to the partitioned datasets as
+            # in a single run
+            for dataset, schema in zip(DATASETS, (CLEAN_VITALS_SCHEMA, CLEAN_LABS_SCHEMA)):
+                name = f"clean_{dataset}"
+                merge_dataset_files(dataset, name, config["transformed_subdir"], schema, shard_dirs, first_rows[dataset],
+                                    config)
+                if config["transformed_ipc"]:
+                    with step("export_ipc"):
+                        export_ipc(dataset_path(transformed_path, name), dataset_path(transformed_path, name, ipc=True))
+
+            # Shards in the order a single run sorts hospitals: as strings, rows without one last
+            hospital_dirs = [partition_dir(config, partition) for partition in
+                             sorted(partitions, key=lambda partition: (partition == MISSING_HOSPITAL, partition))]
+            for dataset in DATASETS:
+                merge_feature_files(dataset, hospital_dirs, config)
+
+            # Patients are counted per (hospital, patient), so the shards' indexes combine like chunk partials;
+            # only the patient codes are assigned anew
+            parts = read_shard_files([path / config["transformed_subdir"] / INDEX_FILE for path in shard_dirs])
+            with step("patient_index"):
+                index = combine_index(parts)
+            with DatasetWriter(transformed_path / INDEX_FILE, PATIENT_INDEX_SCHEMA, config["parquet_compression"]) as writer:
+                writer.write(index)
+            record_memory("patient_index", index)
+
+            # As in the statistics stage, an incremental run's index covers the changed partitions only
+            if config["incremental"]:
+                (stats_path / HOSPITAL_SUMMARY_FILE).unlink(missing_ok=True)
+            else:
+                write_hospital_summary(index, stats_path)
+
+            reports_path = output_dir / config["reports_subdir"]
+            quarantine_paths = [path / config["quarantine_subdir"] for path in shard_dirs]
+            if config["incremental"]:
+                # Each shard reprocessed its own changed partitions; their counts replace the earlier runs'
+                with step("metrics"):
+                    state = load_quality_state(reports_path)
+                    for path in shard_dirs:
+                        state = update_quality_state(state, path, config)
+                    metrics = state_metrics(state)
+                write_quality_state(state, reports_path)
+            else:
+                with step("metrics"):
+                    metrics = quality_counts(index) | {
+                        "quarantined_vitals_records": sum(count_rows(path / "vitals.parquet") for path in quarantine_paths),
+                        "quarantined_labs_records": sum(count_rows(path / "labs.parquet") for path in quarantine_paths),
+                    }
+            write_quality_report(metrics, reports_path)
+
+            logger.info(f"Merged {len(partitions)} hospital shards")
+
+        return stage_metrics.write(output_dir / config["reports_subdir"])
+
+    except Exception as e:
+        logger.error(f"Shard merge failed: {e}")
+        raise
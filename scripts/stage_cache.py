@@ -0,0 +1,339 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+from config_model import load_config
+from dataset_io import atomic_write, dataset_path, temporary_path, input_paths, replace_dir
+from instrumentation import StageMetrics, step
+from hospital_shards import load_shard, partition_config
+from patient_index import INDEX_FILE
+
+logger = logging.getLogger(__name__)
+
+ENTRY_FILE = "entry.json"
+DIGESTS_FILE = "digests.json"
+
+# Config fields each stage's outputs depend on, besides the content of its inputs. Runtime-only settings
+# (paths, concurrent_io) are left out; workers and chunking stay where they change the issue counts or sketches
+STAGE_FIELDS = {
+    "validate_data": [
+        "vitals_file", "labs_file", "vitals_sep", "labs_sep", "validated_subdir", "quarantine_subdir", "issues_file",
+        "issues_records_file", "issue_sample_size", "issue_sample_sizes", "issue_log_limit", "quarantine_rules",
+        "date_format", "date_fallback_formats", "vitals_columns", "labs_columns", "vital_ranges", "lab_ranges",
+        "unit_conversions", "streaming_enabled", "chunk_size", "workers", "shard_by", "parquet_compression", "export_csv",
+    ],
+    "transform_data": [
+        "vitals_file", "labs_file", "vitals_sep", "labs_sep", "transformed_subdir", "date_format",
+        "date_fallback_formats", "vital_ranges", "lab_ranges", "unit_conversions", "parquet_compression", "export_csv",
+        "transformed_ipc", "partitioned_datasets",
+    ],
+    "calculate_statistics": [
+        "stats_subdir", "median_mode", "median_error", "streaming_enabled", "chunk_size", "workers",
+        "parquet_compression", "partitioned_datasets",
+    ],
+    "calculate_features": [
+        "features_subdir", "feature_window_readings", "feature_window_days", "parquet_compression", "transformed_ipc",
+    ],
+    "generate_quality_report": ["reports_subdir"],
+}
+
+
+def stage_inputs(stage, config):
+    # Files the stage reads
+    output_dir = Path(config["output_dir"])
+    validated = output_dir / config["validated_subdir"]
+    transformed = output_dir / config["transformed_subdir"]
+    quarantine = output_dir / config["quarantine_subdir"]
+    ipc = config["transformed_ipc"]
+    clean = [dataset_path(transformed, "clean_vitals", ipc), dataset_path(transformed, "clean_labs", ipc),
+             transformed / INDEX_FILE]
+    return {
+        "validate_data": input_paths(config["input_dir"], config["vitals_file"]) + input_paths(config["input_dir"], config["labs_file"]),
+        "transform_data": [validated / "vitals.parquet", validated / "labs.parquet"],
+        "calculate_statistics": clean,
+        "calculate_features": clean[:2],
+        "generate_quality_report": clean + [quarantine / "vitals.parquet", quarantine / "labs.parquet"],
+    }[stage]
+
+
+def stage_outputs(stage, config):
+    # Directories (every file in them) or files the stage writes, relative to output_dir
+    return {
+        "validate_data": [Path(config["validated_subdir"]), Path(config["quarantine_subdir"])],
+        "transform_data": [Path(config["transformed_subdir"])],
+        "calculate_statistics": [Path(config["stats_subdir"])],
+        "calculate_features": [Path(config["features_subdir"])],
+        "generate_quality_report": [Path(config["reports_subdir"]) / "quality_report.csv"],
+    }[stage]
+
+
+def input_name(path, config):
+    # An input as the outputs know it: relative to input_dir (the source_file of every row), or to output_dir
+    for root in (config["input_dir"], config["output_dir"]):
+        try:
+            return str(Path(path).relative_to(root))
+        except ValueError:
+            continue
+    return str(path)
+
+
+@lru_cache(maxsize=None)
+def code_version():
+    # Hash of the pipeline's source files, so a code change invalidates every entry
+    digest = hashlib.blake2b(digest_size=16)
+    for path in sorted(Path(__file__).resolve().parent.glob("*.py")):
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def file_digest(path, block_size=1 << 20):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def link_or_copy(source, target):
+    # Outputs are always replaced, never modified in place, so cache entries can share their blocks
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = temporary_path(target)
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copy2(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+class StageCache:
+    # Content-addressed stage outputs on local disk: one entry per (stage, key), the key hashing the input files,
+    # the stage's config fields and the code version. Entries are evicted least recently used first once the
+    # cache grows beyond max_bytes.
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config["cache_dir"], config["cache_max_bytes"])
+
+    def digests(self, paths):
+        # Content hash per input file, memoized by size and mtime so a rerun does not read the inputs again
+        memo_path = self.cache_dir / DIGESTS_FILE
+        try:
+            with open(memo_path, "r") as f:
+                memo = json.load(f)
+        except (OSError, ValueError):
+            memo = {}
+        digests = []
+        for path in map(Path, paths):
+            if not path.exists():
+                digests.append(None)
+                continue
+            stat = path.stat()
+            signature = [stat.st_size, stat.st_mtime_ns]
+            cached = memo.get(str(path.resolve()))
+            if cached is None or cached[:2] != signature:
+                cached = memo[str(path.resolve())] = signature + [file_digest(path)]
+            digests.append(cached[2])
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        with atomic_write(memo_path) as tmp_path, open(tmp_path, "w") as f:
+            json.dump(memo, f)
+        return digests
+
+    def key(self, stage, config, partition=None):
+        # A hospital shard reads the same input files as its siblings, so its name is part of the key
+        inputs = stage_inputs(stage, config)
+        fields = config.model_dump(mode="json", include=set(STAGE_FIELDS[stage]))
+        content = json.dumps({
+            "stage": stage,
+            "partition": partition,
+            "code": code_version(),
+            "config": fields,
+            "inputs": [[input_name(path, config), digest] for path, digest in zip(inputs, self.digests(inputs))],
+        }, sort_keys=True)
+        return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
+    def entry_path(self, stage, key):
+        return self.cache_dir / stage / key
+
+    def entries(self):
+        # Every entry with its size and last use, least recently used first
+        entries = []
+        for entry_file in self.cache_dir.glob(f"*/*/{ENTRY_FILE}"):
+            try:
+                with open(entry_file, "r") as f:
+                    entry = json.load(f)
+                last_used = entry_file.stat().st_mtime
+            except (OSError, ValueError):
+                continue
+            entries.append(entry | {"path": entry_file.parent, "last_used": last_used})
+        return sorted(entries, key=lambda entry: entry["last_used"])
+
+    def restore(self, stage, key, output_dir, outputs):
+        # Put the entry's outputs back under output_dir; False if there is no entry. Each output directory is
+        # rebuilt from the entry and swapped in whole, so no file of a run with other inputs (a hospital
+        # partition, say) outlives the restore
+        entry_dir = self.entry_path(stage, key)
+        try:
+            with open(entry_dir / ENTRY_FILE, "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return False
+        output_dir = Path(output_dir)
+        with step("cache_restore") as record:
+            for output in map(Path, outputs):
+                if str(output) in entry["files"]:
+                    link_or_copy(entry_dir / "files" / output, output_dir / output)
+                    continue
+                tmp_dir = temporary_path(output_dir / output)
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                tmp_dir.mkdir(parents=True)
+                for name in map(Path, entry["files"]):
+                    if output in name.parents:
+                        link_or_copy(entry_dir / "files" / name, tmp_dir / name.relative_to(output))
+                replace_dir(tmp_dir, output_dir / output)
+            record["bytes"] += entry["bytes"]
+        # The entry file's mtime is its last use
+        os.utime(entry_dir / ENTRY_FILE)
+        return True
+
+    def store(self, stage, key, output_dir, outputs):
+        # Copy the stage's outputs into a new entry, then evict down to max_bytes
+        output_dir = Path(output_dir)
+        files = sorted(
+            path for output in outputs for path in ([output_dir / output] if (output_dir / output).is_file()
+                                                    else (output_dir / output).rglob("*"))
+            if path.is_file() and not path.name.endswith(".tmp")
+        )
+        size = sum(path.stat().st_size for path in files)
+        if size > self.max_bytes:
+            logger.info(f"Outputs of {stage} ({size} bytes) exceed the cache size; not cached")
+            return
+        entry_dir = self.entry_path(stage, key)
+        tmp_dir = temporary_path(entry_dir)
+        for path in files:
+            link_or_copy(path, tmp_dir / "files" / path.relative_to(output_dir))
+        with open(tmp_dir / ENTRY_FILE, "w") as f:
+            json.dump({
+                "stage": stage,
+                "key": key,
+                "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "files": [str(path.relative_to(output_dir)) for path in files],
+                "bytes": size,
+            }, f, indent=2)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Stored by a concurrent run in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    def evict(self, max_bytes=None):
+        # Remove least recently used entries until the cache fits; returns the removed entries
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.entries()
+        total = sum(entry["bytes"] for entry in entries)
+        removed = []
+        for entry in entries:
+            if total <= max_bytes:
+                break
+            shutil.rmtree(entry["path"], ignore_errors=True)
+            total -= entry["bytes"]
+            removed.append(entry)
+        return removed
+
+    def purge(self, stage=None):
+        # Remove every entry, or those of one stage
+        if stage is None:
+            return self.evict(0)
+        removed = [entry for entry in self.entries() if entry["stage"] == stage]
+        for entry in removed:
+            shutil.rmtree(entry["path"], ignore_errors=True)
+        return removed
+
+
+class CachedStage:
+    # One stage run against the cache: restore() returns the metrics of a cache hit, store() records a computed
+    # result. Disabled caches and incremental runs, whose outputs depend on earlier runs, always compute.
+
+    def __init__(self, stage, config, partition=None):
+        self.stage = stage
+        self.config = config
+        self.partition = partition
+        self.cache = StageCache.from_config(config) if config["stage_cache"] and not config["incremental"] else None
+        self.key = None
+
+    def restore(self):
+        if self.cache is None:
+            return None
+        reports_path = Path(self.config["output_dir"]) / self.config["reports_subdir"]
+        with StageMetrics(self.stage) as stage_metrics:
+            with step("cache_key"):
+                self.key = self.cache.key(self.stage, self.config, self.partition)
+            hit = self.cache.restore(self.stage, self.key, self.config["output_dir"],
+                                     stage_outputs(self.stage, self.config))
+        if not hit:
+            return None
+        logger.info(f"Restored {self.stage} outputs from the cache ({self.key})")
+        return stage_metrics.write(reports_path)
+
+    def store(self, metrics):
+        if self.cache is not None:
+            self.cache.store(self.stage, self.key, self.config["output_dir"], stage_outputs(self.stage, self.config))
+        return metrics
+
+
+def run_stage_task(stage, config_file, partition, body, failure):
+    # Entry point of a stage task: body(config, shard) computes the outputs, unless the cache holds them.
+    # A mapped DAG task works on one hospital shard, within that shard's output directory
+    logging.basicConfig(level=logging.INFO)
+    stage_logger = logging.getLogger(body.__module__)
+
+    try:
+        config = load_config(config_file)
+        shard = load_shard(config, partition)
+        config = partition_config(config, partition)
+
+        # Retries and reruns with unchanged inputs, config and code reuse the earlier outputs
+        cached = CachedStage(stage, config, partition)
+        restored = cached.restore()
+        if restored is not None:
+            return restored
+
+        with StageMetrics(stage) as stage_metrics:
+            body(config, shard)
+
+        return cached.store(stage_metrics.write(Path(config["output_dir"]) / config["reports_subdir"]))
+
+    except Exception as e:
+        stage_logger.error(f"{failure}: {e}")
+        raise
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Inspect or purge the stage cache")
+    parser.add_argument("--config", default="pipeline_config.json", help="Config file name in the config directory")
+    parser.add_argument("command", choices=["list", "purge"])
+    parser.add_argument("--stage", choices=sorted(STAGE_FIELDS), help="Purge the entries of this stage only")
+    args = parser.parse_args()
+
+    cache = StageCache.from_config(load_config(args.config))
+    if args.command == "list":
+        entries = cache.entries()
+        for entry in entries:
+            last_used = datetime.fromtimestamp(entry["last_used"], timezone.utc).isoformat(timespec="seconds")
+            print(f"{entry['stage']:<24} {entry['key']}  {entry['bytes']:>12} bytes  {len(entry['files']):>3} files  "
+                  f"last used {last_used}")
+        print(f"{len(entries)} entries, {sum(entry['bytes'] for entry in entries)} of {cache.max_bytes} bytes")
+    else:
+        removed = cache.purge(args.stage)
+        print(f"Removed {len(removed)} entries, {sum(entry['bytes'] for entry in removed)} bytes")
@@ -0,0 +1,28 @@
+import importlib
+
+# Pipeline stage -> module defining it; the stage function has the stage's name. This module imports
+# nothing heavy, so the DAG file can be parsed without pandas, pyarrow or pydantic
+STAGES = {
+    "validate_data": "data_validator",
+    "transform_data": "data_transformer",
+    "calculate_statistics": "stats_calculator",
+    "calculate_features": "feature_calculator",
+    "generate_quality_report": "quality_reporter",
+}
+
+# Fan-out and reduce tasks around the stages the DAG maps over hospital shards
+SHARD_TASKS = {
+    "discover_partitions": "hospital_shards",
+    "merge_partitions": "shard_merger",
+}
+
+
+def resolve_stage(stage):
+    # The stage function, importing its module (and so pandas and friends) on first use
+    return getattr(importlib.import_module(STAGES.get(stage) or SHARD_TASKS[stage]), stage)
+
+
+def run_stage(stage, config_file="pipeline_config.json", **kwargs):
+    # Task callable: resolved when the task runs, not when the scheduler parses the DAG. Mapped tasks
+    # pass their partition, the reduce task the list of partitions
+    return resolve_stage(stage)(config_file, **kwargs)
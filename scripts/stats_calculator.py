@@ -1,66 +1,274 @@
 import pandas as pd
+import pyarrow as pa
 import logging
 from pathlib import Path
 import json
-import os 
-from config_model import PipelineConfig
-
-def calculate_statistics(config_file="pipeline_config.json"):
-    # Configure logging
-    logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(__name__)
-
-    try:
-        # Load and validate configuration
-        config_dir = "/opt/airflow/config" if os.environ.get("DOCKER_ENV", "false").lower() == "true" else "./config"
-        config_path = os.path.join(config_dir, config_file if config_file != "test_pipeline_config.json" else config_file)
-        if config_file == "test_pipeline_config.json" and os.environ.get("TEST_MODE", "false").lower() != "true":
-            config_path = os.path.join(config_dir, "pipeline_config.json")
-
-        with open(config_path, "r") as f:
-            config_data = json.load(f)
-        config = PipelineConfig(**config_data).model_dump()
-
-        # Extract config values
-        output_dir = config["output_dir"]
-        transformed_subdir = config["transformed_subdir"]
-        stats_subdir = config["stats_subdir"]
-
-        # Define input and output paths
-        input_path = Path(output_dir) / transformed_subdir
-        output_path = Path(output_dir) / stats_subdir
+from functools import partial
+from config_model import load_config
+from partition_manifest import PENDING_FILE, month_partition_keys, commit_partitions
+from aggregates import GroupedAggregates
+from patient_index import INDEX_FILE, hospital_summary
+from dataset_io import (read_dataset_frames, read_dataset, dataset_path, atomic_write, write_partitioned, read_partitioned,
+                        drop_partitioned)
+from parallel import worker_pool, split_shards, map_shards, run_concurrently
+from instrumentation import step, add_file_bytes, record_memory
+from stage_cache import run_stage_task
 
+logger = logging.getLogger(__name__)
+
+HOSPITAL_SUMMARY_FILE = "hospital_summary.parquet"
+
+VITALS_STATS_COLUMNS = ["hospital_id", "vital_type", "measurement_date", "value"]
+LAB_STATS_COLUMNS = ["hospital_id", "test_type", "test_date", "result_value"]
+
+# Per kind of stats: its file (and partitioned dataset) name, type and date columns
+STATS_DATASETS = {
+    "vitals": ("vitals_stats", "vital_type", "measurement_date"),
+    "labs": ("lab_stats", "test_type", "test_date"),
+}
+
+
+def sorted_categories(frame, columns):
+    # Group categorical keys in lexical order, whatever order their dictionary was built in
+    reordered = {
+        col: frame[col].cat.reorder_categories(sorted(frame[col].cat.categories))
+        for col in columns
+        if isinstance(frame[col].dtype, pd.CategoricalDtype)
+    }
+    return frame.assign(**reordered)
+
+
+def monthly_stats(frame, type_col, date_col, value_col):
+    frame = sorted_categories(frame, ["hospital_id", type_col])
+    return (
+        frame.groupby(["hospital_id", type_col, pd.Grouper(key=date_col, freq="ME")], observed=True)
+        [value_col]
+        .agg(["mean", "median", "min", "max", "count"])
+        .reset_index()
+    )
+
+
+def sort_stats(stats, type_col, date_col):
+    # Same lexical (hospital, type, month) order and categorical keys as a full recompute
+    keys = ["hospital_id", type_col]
+    stats = stats.assign(**{col: stats[col].astype(str) for col in keys})
+    stats = stats.sort_values(keys + [date_col], kind="stable").reset_index(drop=True)
+    return stats.assign(**{col: pd.Categorical(stats[col], categories=sorted(stats[col].unique())) for col in keys})
+
+
+def merge_stats(path, new_stats, type_col, date_col, partitions):
+    # Replace the aggregates of the reprocessed partitions and keep every other month as it was
+    if not path.exists():
+        return sort_stats(new_stats, type_col, date_col)
+    existing = pd.read_parquet(path)
+    existing = existing[~month_partition_keys(existing, date_col).isin(list(partitions))]
+    parts = [part for part in (existing, new_stats) if len(part)]
+    merged = pd.concat(parts, ignore_index=True) if parts else new_stats
+    return sort_stats(merged, type_col, date_col)
+
+
+def aggregate_file(path, columns, median_error, chunk_size=None, hospitals=None):
+    # Sketch mode: fold the file into mergeable per-group states, one chunk at a time
+    states = GroupedAggregates(columns[:3], median_error)
+    for frame in read_dataset_frames(path, columns=columns, chunk_size=chunk_size):
+        if hospitals is not None:
+            frame = frame[frame["hospital_id"].astype(str).isin(hospitals)]
+        states.update(frame, columns[3])
+    return states
+
+
+def aggregate_hospitals(hospitals, path, columns, median_error, chunk_size=None):
+    # Worker side: every worker reads the same chunks, so each group sees the same updates as in a serial run
+    return aggregate_file(path, columns, median_error, chunk_size, hospitals)
+
+
+def aggregate_file_sharded(pool, path, columns, median_error, chunk_size=None, workers=1):
+    # Hospitals are spread over the workers; their groups never overlap, so merging is a plain union
+    if pool is None:
+        return aggregate_file(path, columns, median_error, chunk_size)
+    hospitals = read_dataset(path, columns=["hospital_id"])["hospital_id"].dropna().astype(str)
+    hospitals = sorted(hospitals.unique())
+    shards = [hospitals[i::workers] for i in range(workers) if hospitals[i::workers]]
+    states = GroupedAggregates(columns[:3], median_error)
+    for shard_states in map_shards(pool, aggregate_hospitals, shards, path, columns, median_error, chunk_size):
+        states.merge(shard_states)
+    return states
+
+
+def aggregate_frame(frame, keys, value_col, median_error):
+    return GroupedAggregates(keys, median_error).update(frame, value_col)
+
+
+def sharded_states(frame, keys, value_col, median_error, pool=None):
+    # Per-hospital shards of an in-memory frame, aggregated in the pool and merged
+    if pool is None or frame.empty:
+        return aggregate_frame(frame, keys, value_col, median_error)
+    states = GroupedAggregates(keys, median_error)
+    for shard_states in map_shards(pool, aggregate_frame, split_shards(frame), keys, value_col, median_error):
+        states.merge(shard_states)
+    return states
+
+
+def sharded_stats(frame, type_col, date_col, value_col, pool=None):
+    # Groups never span hospitals, so per-hospital results only need concatenating and sorting
+    if pool is None or frame.empty:
+        return sort_stats(monthly_stats(frame, type_col, date_col, value_col), type_col, date_col)
+    parts = map_shards(pool, monthly_stats, split_shards(frame), type_col, date_col, value_col)
+    return sort_stats(pd.concat(parts, ignore_index=True), type_col, date_col)
+
+
+def merge_states(path, new_states, partitions):
+    # Drop the states of the reprocessed partitions, then fold in the new ones
+    if not path.exists():
+        return new_states
+    existing = GroupedAggregates.from_frame(pd.read_parquet(path), new_states.keys, new_states.error)
+    existing.drop(lambda key: f"{key[0]}|{key[-1]:%Y-%m}" in partitions)
+    return existing.merge(new_states)
+
+
+def compute_statistics(vitals, labs, median_mode="exact", median_error=0.01, pool=None):
+    # Log column types for debugging
+    logger.info(f"vitals['measurement_date'] type: {vitals['measurement_date'].dtype}")
+    logger.info(f"labs['test_date'] type: {labs['test_date'].dtype}")
+
+    # Sketch mode trades an exact median for states that can be merged
+    if median_mode == "sketch":
+        vitals_states = sharded_states(vitals, VITALS_STATS_COLUMNS[:3], "value", median_error, pool)
+        lab_states = sharded_states(labs, LAB_STATS_COLUMNS[:3], "result_value", median_error, pool)
+        return (sort_stats(vitals_states.to_stats(), "vital_type", "measurement_date"),
+                sort_stats(lab_states.to_stats(), "test_type", "test_date"))
+
+    # Calculate vitals and lab statistics
+    vitals_stats = sharded_stats(vitals[VITALS_STATS_COLUMNS], "vital_type", "measurement_date", "value", pool)
+    lab_stats = sharded_stats(labs[LAB_STATS_COLUMNS], "test_type", "test_date", "result_value", pool)
+    return vitals_stats, lab_stats
+
+
+def write_parquet(frame, path, index=None):
+    # Atomic, timed write of one small output table
+    with step("write") as record, atomic_write(path) as tmp_path:
+        frame.to_parquet(tmp_path, index=index)
+        record["rows"] += len(frame)
+    add_file_bytes("write", path)
+
+
+def write_stats_partitioned(stats, path, date_col, compression="zstd"):
+    # The stats are complete after every run, incremental or not, so the partitioned copy is always replaced
+    table = pa.Table.from_pandas(stats, preserve_index=False)
+    write_partitioned(table.to_batches(), table.schema, path, date_col, compression)
+
+
+def write_statistics(vitals_stats, lab_stats, output_path, concurrent=True, partitioned=False, compression="zstd"):
+    # Save statistics, and optionally a copy partitioned by hospital and month for load_stats
+    output_path.mkdir(parents=True, exist_ok=True)
+    tasks = [partial(write_parquet, vitals_stats, output_path / "vitals_stats.parquet"),
+             partial(write_parquet, lab_stats, output_path / "lab_stats.parquet")]
+    if partitioned:
+        tasks += [partial(write_stats_partitioned, stats, output_path / name, date_col, compression)
+                  for stats, (name, _, date_col) in zip((vitals_stats, lab_stats), STATS_DATASETS.values())]
+    else:
+        for name, _, _ in STATS_DATASETS.values():
+            drop_partitioned(output_path / name)
+    run_concurrently(tasks, concurrent)
+
+
+def load_stats(kind, hospitals=None, start=None, end=None, config_file="pipeline_config.json"):
+    # Monthly stats ("vitals" or "labs") of some hospitals for the months overlapping [start, end], from the
+    # partitioned stats: only the files of matching hospital/month partitions are read
+    config = load_config(config_file)
+    name, type_col, date_col = STATS_DATASETS[kind]
+    # Stats are dated by month end, so the bounds are widened to whole months
+    start = pd.Timestamp(start).to_period("M").to_timestamp() if start is not None else None
+    end = (pd.Timestamp(end) + pd.offsets.MonthEnd(0)).normalize() if end is not None else None
+    stats = read_partitioned(Path(config["output_dir"]) / config["stats_subdir"] / name, date_col, hospitals, start, end)
+    return sort_stats(stats, type_col, date_col)
+
+
+def write_hospital_summary(index, output_path):
+    # Per-hospital patients, rows, abnormal labs and dates, rolled up from the patient index in O(patients)
+    with step("hospital_summary"):
+        summary = hospital_summary(index)
+    write_parquet(summary, output_path / HOSPITAL_SUMMARY_FILE, index=False)
+    return summary
+
+
+def run_statistics(config, shard):
+    # Extract config values
+    output_dir = config["output_dir"]
+    transformed_subdir = config["transformed_subdir"]
+    stats_subdir = config["stats_subdir"]
+    median_mode = config["median_mode"]
+    median_error = config["median_error"]
+    chunk_size = config["chunk_size"] if config["streaming_enabled"] else None
+    incremental = config["incremental"]
+    workers = config["workers"]
+    ipc = config["transformed_ipc"]
+    concurrent_io = config["concurrent_io"]
+
+    # Define input and output paths
+    input_path = Path(output_dir) / transformed_subdir
+    output_path = Path(output_dir) / stats_subdir
+
+    # Incremental mode: the transformed data only holds the changed partitions
+    if incremental:
+        with open(Path(output_dir) / config["validated_subdir"] / PENDING_FILE, "r") as f:
+            pending = json.load(f)
+
+    if median_mode == "sketch":
+        # Aggregate chunk by chunk and keep the states next to the stats for later merges
+        # Vitals and labs side by side, sharing the process pool
+        with worker_pool(workers) as pool, step("aggregate"):
+            vitals_states, lab_states = run_concurrently([
+                partial(aggregate_file_sharded, pool, dataset_path(input_path, "clean_vitals", ipc),
+                        VITALS_STATS_COLUMNS, median_error, chunk_size, workers),
+                partial(aggregate_file_sharded, pool, dataset_path(input_path, "clean_labs", ipc),
+                        LAB_STATS_COLUMNS, median_error, chunk_size, workers),
+            ], concurrent_io)
+        if incremental:
+            vitals_states = merge_states(output_path / "vitals_stats_state.parquet", vitals_states, pending["vitals"])
+            lab_states = merge_states(output_path / "lab_stats_state.parquet", lab_states, pending["labs"])
+        vitals_stats = sort_stats(vitals_states.to_stats(), "vital_type", "measurement_date")
+        lab_stats = sort_stats(lab_states.to_stats(), "test_type", "test_date")
+    else:
         # Read transformed files
-        vitals = pd.read_parquet(input_path / "clean_vitals.parquet")
-        labs = pd.read_parquet(input_path / "clean_labs.parquet")
-
-        # Log column types for debugging
-        logger.info(f"vitals['measurement_date'] type: {vitals['measurement_date'].dtype}")
-        logger.info(f"labs['test_date'] type: {labs['test_date'].dtype}")
-
-        # Calculate vitals statistics
-        vitals_stats = (
-            vitals.groupby(["hospital_id", "vital_type", pd.Grouper(key="measurement_date", freq="ME")])
-            ["value"]
-            .agg(["mean", "median", "min", "max", "count"])
-            .reset_index()
-        )
-
-        # Calculate lab statistics
-        lab_stats = (
-            labs.groupby(["hospital_id", "test_type", pd.Grouper(key="test_date", freq="ME")])
-            ["result_value"]
-            .agg(["mean", "median", "min", "max", "count"])
-            .reset_index()
-        )
-
-        # Save statistics
-        output_path.mkdir(parents=True, exist_ok=True)
-        vitals_stats.to_parquet(output_path / "vitals_stats.parquet")
-        lab_stats.to_parquet(output_path / "lab_stats.parquet")
-
-        logger.info("Statistics calculated")
-
-    except Exception as e:
-        logger.error(f"Statistics failed: {e}")
-        raise
\ No newline at end of file
+        vitals_file = dataset_path(input_path, "clean_vitals", ipc)
+        labs_file = dataset_path(input_path, "clean_labs", ipc)
+        vitals, labs = run_concurrently([partial(read_dataset, vitals_file, columns=VITALS_STATS_COLUMNS),
+                                         partial(read_dataset, labs_file, columns=LAB_STATS_COLUMNS)], concurrent_io)
+        add_file_bytes("read", vitals_file, labs_file)
+        record_memory("vitals", vitals)
+        record_memory("labs", labs)
+
+        with worker_pool(workers) as pool, step("aggregate"):
+            vitals_stats, lab_stats = compute_statistics(vitals, labs, pool=pool)
+        if incremental:
+            vitals_stats = merge_stats(output_path / "vitals_stats.parquet", vitals_stats, "vital_type", "measurement_date", pending["vitals"])
+            lab_stats = merge_stats(output_path / "lab_stats.parquet", lab_stats, "test_type", "test_date", pending["labs"])
+
+    write_statistics(vitals_stats, lab_stats, output_path, concurrent_io, config["partitioned_datasets"],
+                     config["parquet_compression"])
+    if median_mode == "sketch":
+        run_concurrently([
+            partial(write_parquet, vitals_states.to_frame(), output_path / "vitals_stats_state.parquet", index=False),
+            partial(write_parquet, lab_states.to_frame(), output_path / "lab_stats_state.parquet", index=False),
+        ], concurrent_io)
+
+    # The patient index of an incremental run covers the changed partitions only, so the rollup
+    # is left out rather than written for part of the data
+    index_path = input_path / INDEX_FILE
+    if incremental or not index_path.exists():
+        (output_path / HOSPITAL_SUMMARY_FILE).unlink(missing_ok=True)
+    else:
+        index = read_dataset(index_path)
+        add_file_bytes("read", index_path)
+        write_hospital_summary(index, output_path)
+
+    # Partitions count as processed once their aggregates are merged
+    if incremental:
+        commit_partitions(Path(output_dir) / config["manifest_file"], pending)
+
+    logger.info("Statistics calculated")
+
+
+def calculate_statistics(config_file="pipeline_config.json", partition=None):
+    return run_stage_task("calculate_statistics", config_file, partition, run_statistics, "Statistics failed")
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+
+def conversion_table(conversions):
+    # Config conversions ({type: {unit: {"unit": target, "factor": f, "offset": o}}}) as a lookup keyed by (type, unit)
+    return {
+        (type_name, unit): (spec["unit"], float(spec.get("factor", 1.0)), float(spec.get("offset", 0.0)))
+        for type_name, units in conversions.items()
+        for unit, spec in units.items()
+    }
+
+
+def resolve_conversions(types, units, table):
+    # Lookup join of the rows' (type, unit) pairs against the conversion table, once per distinct pair;
+    # pairs without an entry keep their unit, with factor 1 and offset 0
+    type_codes, type_uniques = pd.factorize(types)
+    unit_codes, unit_uniques = pd.factorize(units)
+    width = len(unit_uniques) + 1
+    pair_codes, pairs = pd.factorize((type_codes.astype(np.int64) + 1) * width + unit_codes + 1)
+    # Code -1 marks missing types or units; the trailing None absorbs it
+    pair_types = np.append(np.asarray(type_uniques, dtype=object), None)[pairs // width - 1]
+    pair_units = np.append(np.asarray(unit_uniques, dtype=object), None)[pairs % width - 1]
+    specs = [table.get((type_name, unit), (unit, 1.0, 0.0)) for type_name, unit in zip(pair_types, pair_units)]
+    target_units = np.array([spec[0] for spec in specs], dtype=object)
+    factors = np.array([spec[1] for spec in specs], dtype=float)
+    offsets = np.array([spec[2] for spec in specs], dtype=float)
+    # Categories follow the input's dictionary plus the target units, so shards of one frame come out alike
+    categories = units.cat.categories if isinstance(units.dtype, pd.CategoricalDtype) else unit_uniques
+    categories = sorted(set(categories).union(spec[0] for spec in table.values()))
+    return pd.DataFrame({
+        "unit": pd.Categorical(target_units[pair_codes], categories=categories),
+        "factor": factors[pair_codes],
+        "offset": offsets[pair_codes],
+    }, index=types.index)
+
+
+def convert_values(values, conversions):
+    # Values in the target unit; rows without a conversion come out unchanged
+    return values * conversions["factor"] + conversions["offset"]
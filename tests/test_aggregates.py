@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import logging
+
+from aggregates import AggregationState, GroupedAggregates, sketch_capacity
+
+# Configure logging for testing
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def test_aggregation_state_merge():
+    # States updated chunk by chunk and merged match the whole array
+    values = np.random.default_rng(42).normal(100, 15, size=200000)
+    merged = AggregationState(sketch_capacity(0.01))
+    for chunk in np.array_split(values, 7):
+        state = AggregationState(sketch_capacity(0.01))
+        state.update(chunk)
+        merged.merge(state)
+    assert merged.count == len(values), "Count should be exact"
+    assert merged.minimum == values.min() and merged.maximum == values.max(), "Min/max should be exact"
+    assert np.isclose(merged.mean(), values.mean()), "Mean should be exact"
+
+    # The sketch median stays within the configured rank error
+    rank = (values < merged.median()).mean()
+    assert abs(rank - 0.5) <= 0.01, f"Median rank {rank} outside the error bound"
+
+def test_grouped_aggregates_round_trip():
+    # Mock transformed vitals: small groups stay exact, missing values are not counted
+    vitals = pd.DataFrame({
+        "hospital_id": ["H001", "H001", "H001", "H002"],
+        "vital_type": ["heart_rate"] * 4,
+        "measurement_date": pd.to_datetime(["2025-01-01", "2025-01-20", "2025-02-03", "2025-01-05"]),
+        "value": [70.0, 80.0, None, 90.0]
+    })
+    keys = ["hospital_id", "vital_type", "measurement_date"]
+    aggregates = GroupedAggregates(keys, 0.01).update(vitals, "value")
+    stats = aggregates.to_stats().set_index(["hospital_id", "measurement_date"])
+    assert stats.loc[("H001", pd.Timestamp("2025-01-31")), "median"] == 75.0, "Small groups should have an exact median"
+    assert stats.loc[("H001", pd.Timestamp("2025-02-28")), "count"] == 0, "Missing values should not be counted"
+
+    # Persisted states load back to the same statistics
+    restored = GroupedAggregates.from_frame(aggregates.to_frame(), keys, 0.01)
+    pd.testing.assert_frame_equal(restored.to_stats(), aggregates.to_stats())
@@ -0,0 +1,32 @@
+from benchmark import find_regressions, scaling_exponents
+
+def result(commit, stage, rows_per_second, workers=1):
+    return {"commit": commit, "stage": stage, "rows": 10000, "streaming_enabled": False, "chunk_size": 100000,
+            "workers": workers, "median_mode": "exact", "parquet_compression": "zstd",
+            "rows_per_second": rows_per_second}
+
+def test_find_regressions():
+    history = [
+        result("aaa", "validate_data", 1000.0),
+        result("bbb", "validate_data", 2000.0),
+        result("bbb", "transform_data", 2000.0),
+        result("bbb", "calculate_statistics", 100.0, workers=4),
+    ]
+    current = [
+        result("ccc", "validate_data", 1500.0),
+        result("ccc", "transform_data", 1950.0),
+        result("ccc", "calculate_statistics", 50.0),
+    ]
+
+    # Compared with the latest other commit; small drops and runs with other settings are not regressions
+    regressions = find_regressions(current, history, threshold=0.1)
+    assert [regression["stage"] for regression in regressions] == ["validate_data"], "Unexpected regressions"
+    assert regressions[0]["baseline_commit"] == "bbb", "Should compare with the latest other commit"
+    assert regressions[0]["change"] == -0.25, "Unexpected throughput change"
+
+def test_scaling_exponents():
+    # Linear, quadratic, and a stage run at a single size, which has no slope
+    results = [{"stage": "linear", "rows": rows, "wall_seconds": rows / 1000} for rows in (10000, 100000, 1000000)]
+    results += [{"stage": "quadratic", "rows": rows, "wall_seconds": (rows / 1000) ** 2} for rows in (10000, 100000)]
+    results += [{"stage": "single", "rows": 10000, "wall_seconds": 1.0}]
+    assert scaling_exponents(results) == {"linear": 1.0, "quadratic": 2.0}, "Unexpected scaling exponents"
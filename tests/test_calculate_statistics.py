@@ -1,13 +1,14 @@
 import sys
 import os
 import shutil
+import json
 import pandas as pd
 import logging
 
 # Add scripts directory to Python path (optional, since workflow sets it)
 # sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'scripts'))
 
-from stats_calculator import calculate_statistics
+from stats_calculator import calculate_statistics, load_stats
 
 # Configure logging for testing
 logging.basicConfig(level=logging.INFO)
@@ -96,4 +97,60 @@ def test_calculate_statistics():
         os.rmdir("./data/output")
     if os.path.exists("./data") and not os.listdir("./data"):
         os.rmdir("./data")
-    del os.environ["TEST_MODE"]
\ No newline at end of file
+    del os.environ["TEST_MODE"]
+
+def test_load_stats():
+    # Mock transformed data: two hospitals over three months
+    vitals_data = pd.DataFrame({
+        "hospital_id": ["H001", "H001", "H001", "H002", "H002"],
+        "measurement_date": pd.to_datetime(["2025-01-10", "2025-02-10", "2025-03-10", "2025-02-10", "2025-03-10"]),
+        "patient_id": ["P1"] * 3 + ["P2"] * 2,
+        "vital_type": ["heart_rate"] * 5,
+        "value": [60.0, 70.0, 80.0, 90.0, 100.0],
+    })
+    labs_data = pd.DataFrame({
+        "hospital_id": ["H001"],
+        "test_date": pd.to_datetime(["2025-01-10"]),
+        "patient_id": ["P1"],
+        "test_type": ["hemoglobin"],
+        "result_value": [12.0],
+        "is_abnormal": [False],
+    })
+
+    # Derive a config from the test config with partitioned datasets and an output directory of its own
+    test_dir = "./data/load_stats_test"
+    with open("./config/test_pipeline_config.json", "r") as f:
+        config_data = json.load(f)
+    config_data.update(output_dir=test_dir, partitioned_datasets=True)
+    config_path = "./config/test_load_stats_config.json"
+    with open(config_path, "w") as f:
+        json.dump(config_data, f)
+
+    os.makedirs(f"{test_dir}/transformed", exist_ok=True)
+    vitals_data.to_parquet(f"{test_dir}/transformed/clean_vitals.parquet", index=False)
+    labs_data.to_parquet(f"{test_dir}/transformed/clean_labs.parquet", index=False)
+
+    try:
+        calculate_statistics(config_file="test_load_stats_config.json")
+
+        # Without filters, the partitioned stats read back as the monolithic file
+        pd.testing.assert_frame_equal(load_stats("vitals", config_file="test_load_stats_config.json"),
+                                      pd.read_parquet(f"{test_dir}/stats/vitals_stats.parquet"))
+
+        # Months overlapping the bounds, of the requested hospitals only
+        stats = load_stats("vitals", hospitals=["H001"], start="2025-02-15", end="2025-03-01",
+                           config_file="test_load_stats_config.json")
+        assert stats["measurement_date"].dt.strftime("%Y-%m").tolist() == ["2025-02", "2025-03"], "Unexpected months"
+        assert stats["mean"].tolist() == [70.0, 80.0], "Unexpected stats"
+        assert stats["hospital_id"].tolist() == ["H001", "H001"], "Unexpected hospitals"
+        assert load_stats("labs", hospitals=["H002"], config_file="test_load_stats_config.json").empty, \
+            "H002 has no lab stats"
+
+        # A run without partitioned datasets drops the earlier run's copy rather than leave it to be read as current
+        with open(config_path, "w") as f:
+            json.dump(config_data | {"partitioned_datasets": False}, f)
+        calculate_statistics(config_file="test_load_stats_config.json")
+        assert not os.path.exists(f"{test_dir}/stats/vitals_stats"), "Stale partitioned stats kept"
+    finally:
+        os.remove(config_path)
+        shutil.rmtree(test_dir, ignore_errors=True)
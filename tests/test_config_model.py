@@ -0,0 +1,37 @@
+import os
+import json
+import time
+import pytest
+from pydantic import ValidationError
+
+from config_model import load_config
+
+def test_load_config():
+    os.environ["TEST_MODE"] = "true"
+    with open("./config/test_pipeline_config.json", "r") as f:
+        config_data = json.load(f)
+    config_path = "./config/test_cached_config.json"
+    with open(config_path, "w") as f:
+        json.dump(config_data, f)
+
+    try:
+        # Loaded once, then served from the cache while the file is unchanged
+        config = load_config("test_cached_config.json")
+        assert load_config("test_cached_config.json") is config, "Unchanged config should come from the cache"
+        assert config["vitals_sep"] == config.vitals_sep == ";", "Settings should be readable by key and attribute"
+        with pytest.raises(ValidationError):
+            config.workers = 4
+
+        # Derived lookups are built at load time
+        assert config.lab_range_table.loc["hemoglobin", "max"] == 20.0, "Unexpected lab range table"
+        assert config.column_sets["vitals"] == frozenset(config_data["vitals_columns"]), "Unexpected column set"
+        assert config.date_formats[0] == config_data["date_format"], "Configured date format should come first"
+
+        # An edited file is reloaded on the next call
+        time.sleep(0.01)
+        with open(config_path, "w") as f:
+            json.dump(dict(config_data, workers=2), f)
+        reloaded = load_config("test_cached_config.json")
+        assert reloaded is not config and reloaded["workers"] == 2, "Edited config should be reloaded"
+    finally:
+        os.remove(config_path)
@@ -0,0 +1,45 @@
+import os
+import shutil
+import filecmp
+import pandas as pd
+import logging
+
+from config_model import load_config
+from data_generator import generate_data
+
+# Configure logging for testing
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def test_generate_data():
+    os.environ["TEST_MODE"] = "true"
+    config = load_config("test_pipeline_config.json")
+    input_dir = "./data/generator_input"
+
+    try:
+        # Small chunks, so the file is written in several appends
+        generate_data(config, 5000, hospitals=3, patients=200, months=2, dirty_rate=0.1, invalid_date_rate=0.1,
+                      input_dir=input_dir, chunk_rows=1500)
+
+        vitals = pd.read_csv(f"{input_dir}/vitals.csv", sep=config["vitals_sep"])
+        labs = pd.read_csv(f"{input_dir}/lab_results.csv", sep=config["labs_sep"])
+        assert list(vitals.columns) == config["vitals_columns"], "Vitals columns should follow the config"
+        assert list(labs.columns) == config["labs_columns"], "Lab columns should follow the config"
+        assert len(vitals) == 5000 and len(labs) == 5000, "Unexpected row counts"
+        assert vitals["hospital_id"].nunique() == 3, "Unexpected number of hospitals"
+        assert vitals["patient_id"].nunique() <= 200, "Unexpected number of patients"
+        assert pd.to_datetime(vitals["measurement_date"]).dt.to_period("M").nunique() == 2, "Unexpected months"
+
+        # Dirty values and invalid dates at roughly the requested rates
+        invalid_values = pd.to_numeric(labs["result_value"], errors="coerce").isna().mean()
+        invalid_dates = pd.to_datetime(vitals["date_of_birth"], format="%Y-%m-%d", errors="coerce").isna().mean()
+        assert 0.05 < invalid_values < 0.15, "Unexpected dirty-value rate"
+        assert 0.05 < invalid_dates < 0.15, "Unexpected invalid-date rate"
+
+        # The same seed gives the same files
+        shutil.copy(f"{input_dir}/vitals.csv", f"{input_dir}/vitals_first.csv")
+        generate_data(config, 5000, hospitals=3, patients=200, months=2, dirty_rate=0.1, invalid_date_rate=0.1,
+                      input_dir=input_dir, chunk_rows=1500)
+        assert filecmp.cmp(f"{input_dir}/vitals.csv", f"{input_dir}/vitals_first.csv", shallow=False), "Generation should be reproducible"
+    finally:
+        shutil.rmtree(input_dir, ignore_errors=True)
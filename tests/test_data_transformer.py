@@ -19,13 +19,13 @@ def test_transform_data():
 
     # Mock input data (validated data)
     vitals_data = pd.DataFrame({
-        "hospital_id": [1],
-        "measurement_date": ["2025-01-01"],
-        "patient_id": [100],
-        "vital_type": ["blood_pressure_systolic"],
-        "value": [90],
-        "unit": ["mmHg"],
-        "date_of_birth": ["1990-01-01"]
+        "hospital_id": [1, 1],
+        "measurement_date": ["2025-01-01", "2025-01-01"],
+        "patient_id": [100, 100],
+        "vital_type": ["blood_pressure_systolic", "temperature"],
+        "value": [210, 98.6],
+        "unit": ["mmHg", "F"],
+        "date_of_birth": ["1990-01-01", "1990-01-02"]
     })
     labs_data = pd.DataFrame({
         "hospital_id": [1],
@@ -48,8 +48,8 @@ def test_transform_data():
     # Prepare validated input directory as per config
     validated_input_dir = "./data/output/validated"
     os.makedirs(validated_input_dir, exist_ok=True)
-    vitals_data.to_csv(f"{validated_input_dir}/vitals.csv", sep=";", index=False)
-    labs_data.to_csv(f"{validated_input_dir}/lab_results.csv", sep=",", index=False)
+    vitals_data.to_parquet(f"{validated_input_dir}/vitals.parquet", index=False)
+    labs_data.to_parquet(f"{validated_input_dir}/labs.parquet", index=False)
 
     # Run transformation with the test config file
     transform_data(config_file="test_pipeline_config.json")
@@ -57,19 +57,23 @@ def test_transform_data():
     # Check output in transformed directory as per config
     transformed_output_dir = "./data/output/transformed"
     assert os.path.exists(transformed_output_dir), "Transformed directory not created"
-    assert os.path.exists(f"{transformed_output_dir}/vitals.csv"), "Transformed vitals.csv not created"
-    assert os.path.exists(f"{transformed_output_dir}/lab_results.csv"), "Transformed lab_results.csv not created"
+    assert os.path.exists(f"{transformed_output_dir}/clean_vitals.parquet"), "Transformed clean_vitals.parquet not created"
+    assert os.path.exists(f"{transformed_output_dir}/clean_labs.parquet"), "Transformed clean_labs.parquet not created"
 
     # Verify transformation
-    transformed_vitals = pd.read_csv(f"{transformed_output_dir}/vitals.csv", sep=";")
-    transformed_labs = pd.read_csv(f"{transformed_output_dir}/lab_results.csv", sep=",")
-    assert "transformed_value" in transformed_vitals.columns, "Transformed value column missing"
-    assert "transformed_result" in transformed_labs.columns, "Transformed result column missing"
-    assert transformed_vitals["transformed_value"].iloc[0] == 180, "Value transformation incorrect (expected 90 * 2 = 180)"
-    assert transformed_labs["transformed_result"].iloc[0] == 18.0, "Result transformation incorrect (expected 12 * 1.5 = 18.0)"
+    transformed_vitals = pd.read_parquet(f"{transformed_output_dir}/clean_vitals.parquet")
+    transformed_labs = pd.read_parquet(f"{transformed_output_dir}/clean_labs.parquet")
+    assert transformed_vitals["age"].tolist() == [35, 34], "Age should count completed years at the measurement date"
+    assert transformed_vitals["is_abnormal"].tolist() == [True, False], "Systolic 210 should be flagged abnormal"
+    assert round(transformed_vitals["value"].iloc[1], 6) == 37.0, "98.6 F should be converted to 37 C"
+    assert transformed_vitals["unit"].tolist() == ["mmHg", "C"], "Converted rows should carry the target unit"
+    assert transformed_labs["result_value"].iloc[0] == 12, "Values without a conversion should be unchanged"
+    assert not transformed_labs["is_abnormal"].iloc[0], "Hemoglobin 12 should not be flagged abnormal"
+    assert str(transformed_vitals["measurement_date"].dtype) == "datetime64[ns]", "measurement_date should be datetime"
 
     # Clean up
-    for file in [f"{transformed_output_dir}/vitals.csv", f"{transformed_output_dir}/lab_results.csv"]:
+    for file in [f"{transformed_output_dir}/clean_vitals.parquet", f"{transformed_output_dir}/clean_labs.parquet",
+                 f"{validated_input_dir}/vitals.parquet", f"{validated_input_dir}/labs.parquet"]:
         if os.path.exists(file):
             os.remove(file)
     if os.path.exists(transformed_output_dir):
@@ -1,6 +1,7 @@
 import sys
 import os
 import shutil
+import json
 # Add scripts directory to Python path (optional, since workflow sets it)
 # sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'scripts'))
 
@@ -57,14 +58,22 @@ def test_validate_data():
     test_output_dir = "./data/output"
     output_dir = f"{test_output_dir}/validated"
     assert os.path.exists(output_dir), "Validated directory not created"
-    assert os.path.exists(f"{output_dir}/vitals.csv"), "Validated vitals.csv not created"
-    assert os.path.exists(f"{output_dir}/lab_results.csv"), "Validated lab_results.csv not created"
+    assert os.path.exists(f"{output_dir}/vitals.parquet"), "Validated vitals.parquet not created"
+    assert os.path.exists(f"{output_dir}/labs.parquet"), "Validated labs.parquet not created"
+    assert not os.path.exists(f"{output_dir}/vitals.csv"), "CSV export should be off by default"
+
+    # Validated data is typed: categorical labels, datetime dates, float values
+    validated_vitals = pd.read_parquet(f"{output_dir}/vitals.parquet")
+    assert str(validated_vitals["vital_type"].dtype) == "category", "vital_type should be categorical"
+    assert str(validated_vitals["measurement_date"].dtype) == "datetime64[ns]", "measurement_date should be datetime"
+    assert validated_vitals["value"].dtype == "float64", "value should be float"
     with open(f"{output_dir}/validation_issues.txt", "r") as f:
         issues = f.read()
         assert "Out of range" not in issues, "Validation issues detected"
 
     # Clean up
-    for file in [ f"{output_dir}/vitals.csv", f"{output_dir}/lab_results.csv", f"{output_dir}/validation_issues.txt"]:
+    for file in [ f"{output_dir}/vitals.parquet", f"{output_dir}/labs.parquet", f"{output_dir}/validation_issues.txt",
+                  f"{output_dir}/validation_issues.json"]:
         if os.path.exists(file):
             os.remove(file)
     if os.path.exists(output_dir):
@@ -73,4 +82,144 @@ def test_validate_data():
         os.rmdir(test_input_dir)
     if os.path.exists(test_output_dir) and not os.listdir(test_output_dir):  # Only remove if empty
         os.rmdir(test_output_dir)
-    del os.environ["TEST_MODE"]
\ No newline at end of file
+    del os.environ["TEST_MODE"]
+
+def test_validate_data_streaming():
+    # Mock input data spanning several chunks, with one non-numeric and one out-of-range value
+    vitals_data = pd.DataFrame({
+        "hospital_id": [1, 1, 2, 2, 3],
+        "measurement_date": ["2025-01-01", "2025-01-02", "2025-01-03", "2025-01-04", "2025-01-05"],
+        "patient_id": [100, 101, 102, 103, 104],
+        "vital_type": ["blood_pressure_systolic"] * 5,
+        "value": ["90", "abc", "120", "250", "110"],
+        "unit": ["mmHg"] * 5,
+        "date_of_birth": ["1990-01-01"] * 5
+    })
+    labs_data = pd.DataFrame({
+        "hospital_id": [1, 2, 3],
+        "test_date": ["2025-01-01", "2025-01-02", "2025-01-03"],
+        "patient_id": [100, 101, 102],
+        "test_type": ["hemoglobin", "hemoglobin", "glucose"],
+        "result_value": [12, 25, 300],
+        "reference_range": ["10-20", "10-20", "70-100"],
+        "unit": ["g/dL", "g/dL", "mg/dL"],
+        "date_of_birth": ["1990-01-01"] * 3
+    })
+
+    # Derive a streaming config from the test config, with chunks smaller than the data
+    with open("./config/test_pipeline_config.json", "r") as f:
+        config_data = json.load(f)
+    config_data.update({"streaming_enabled": True, "chunk_size": 2})
+    config_path = "./config/test_streaming_config.json"
+    with open(config_path, "w") as f:
+        json.dump(config_data, f)
+
+    test_input_dir = "./data/input"
+    os.makedirs(test_input_dir, exist_ok=True)
+    vitals_data.to_csv(f"{test_input_dir}/vitals.csv", sep=";", index=False)
+    labs_data.to_csv(f"{test_input_dir}/lab_results.csv", sep=",", index=False)
+
+    try:
+        validate_data(config_file="test_streaming_config.json")
+
+        # All chunks are written; the non-numeric and out-of-range vitals are quarantined
+        output_dir = "./data/output/validated"
+        validated_vitals = pd.read_parquet(f"{output_dir}/vitals.parquet")
+        validated_labs = pd.read_parquet(f"{output_dir}/labs.parquet")
+        quarantined_vitals = pd.read_parquet("./data/output/quarantine/vitals.parquet")
+        assert len(validated_vitals) == 3, "Not all vitals chunks were written"
+        assert len(validated_labs) == 3, "Not all labs chunks were written"
+        assert quarantined_vitals["row_id"].tolist() == [1, 3], "Unexpected quarantined rows"
+        assert quarantined_vitals["failed_rules"].tolist() == ["non_numeric|invalid_numeric|missing_value", "out_of_range"], \
+            "Failing rules not recorded"
+        assert validated_labs["issue_mask"].tolist() == [0, 16, 16], "Out-of-range labs should stay, flagged"
+
+        # Counts are accumulated across chunks
+        with open(f"{output_dir}/validation_issues.txt", "r") as f:
+            issues = f.read().split("\n")
+        assert "Non-numeric values in vitals['value']: 1 records" in issues, "Non-numeric count not accumulated"
+        assert "Out of range blood_pressure_systolic: 1 records" in issues, "Vitals range count not accumulated"
+        assert "Out of range hemoglobin: 1 records" in issues, "Lab range count not accumulated"
+        assert "Out of range glucose: 1 records" in issues, "Reference range count not accumulated"
+
+        # Structured records point at the offending source rows
+        with open(f"{output_dir}/validation_issues.json", "r") as f:
+            records = {(record["rule"], record["dataset"], record["detail"]): record for record in json.load(f)["issues"]}
+        assert records[("non_numeric", "vitals", None)]["sample_row_ids"] == [1], "Non-numeric row not sampled"
+        assert records[("out_of_range", "vitals", "blood_pressure_systolic")]["sample_row_ids"] == [3], "Out of range row not sampled"
+        assert records[("out_of_range", "labs", "glucose")]["column"] == "result_value", "Unexpected column"
+    finally:
+        os.remove(config_path)
+        shutil.rmtree("./data/output", ignore_errors=True)
+
+
+def test_validate_data_multiple_files():
+    # Per-hospital drops: one with the configured layout, one comma-separated with its columns in another order,
+    # and one without a unit column
+    vitals_data = pd.DataFrame({
+        "hospital_id": ["H001", "H001"],
+        "measurement_date": ["2025-01-01", "2025-01-02"],
+        "patient_id": ["P1", "P2"],
+        "vital_type": ["blood_pressure_systolic"] * 2,
+        "value": [90, 250],
+        "unit": ["mmHg"] * 2,
+        "date_of_birth": ["1990-01-01"] * 2
+    })
+    labs_data = pd.DataFrame({
+        "hospital_id": ["H001"],
+        "test_date": ["2025-01-01"],
+        "patient_id": ["P1"],
+        "test_type": ["hemoglobin"],
+        "result_value": [12],
+        "reference_range": ["12-17"],
+        "unit": ["g/dL"],
+        "date_of_birth": ["1990-01-01"]
+    })
+
+    # Derive a config that reads every CSV file of a directory, chunk by chunk
+    test_dir = "./data/multi_input"
+    with open("./config/test_pipeline_config.json", "r") as f:
+        config_data = json.load(f)
+    config_data.update({"input_dir": test_dir, "vitals_file": "vitals", "labs_file": "labs_*.csv",
+                        "streaming_enabled": True, "chunk_size": 1})
+    config_path = "./config/test_multi_config.json"
+    with open(config_path, "w") as f:
+        json.dump(config_data, f)
+
+    os.makedirs(f"{test_dir}/vitals", exist_ok=True)
+    vitals_data.to_csv(f"{test_dir}/vitals/H001_2025-01.csv", sep=";", index=False)
+    vitals_data.assign(hospital_id="H002")[vitals_data.columns[::-1]].to_csv(f"{test_dir}/vitals/H002_2025-01.csv",
+                                                                             sep=",", index=False)
+    vitals_data.assign(hospital_id="H003").drop(columns="unit").to_csv(f"{test_dir}/vitals/H003_2025-01.csv", sep=";",
+                                                                      index=False)
+    labs_data.to_csv(f"{test_dir}/labs_H001.csv", sep=",", index=False)
+    labs_data.assign(hospital_id="H002").to_csv(f"{test_dir}/labs_H002.csv", sep=",", index=False)
+
+    try:
+        validate_data(config_file="test_multi_config.json")
+
+        # Every file is read, in file order, with its source file and row; row ids run on across files
+        validated_vitals = pd.read_parquet("./data/output/validated/vitals.parquet")
+        quarantined_vitals = pd.read_parquet("./data/output/quarantine/vitals.parquet")
+        validated_labs = pd.read_parquet("./data/output/validated/labs.parquet")
+        assert validated_vitals["hospital_id"].tolist() == ["H001", "H002", "H003"], "Unexpected validated vitals"
+        assert validated_vitals["value"].tolist() == [90, 90, 90], "Reordered columns not reconciled"
+        assert validated_vitals["source_file"].tolist() == [f"vitals/H00{i}_2025-01.csv" for i in (1, 2, 3)]
+        assert quarantined_vitals["row_id"].tolist() == [1, 3, 5], "Row ids should be unique across files"
+        assert quarantined_vitals["source_row"].tolist() == [1, 1, 1], "Rows should be counted per file"
+        assert validated_labs["hospital_id"].tolist() == ["H001", "H002"], "Glob pattern not expanded"
+
+        # The missing column is reported for its file only, and the file's rows are still validated
+        with open("./data/output/validated/validation_issues.json", "r") as f:
+            report = json.load(f)
+        missing_columns = [record for record in report["issues"] if record["rule"] == "missing_columns"]
+        assert [record["message"] for record in missing_columns] == \
+            ["Missing columns in vitals/H003_2025-01.csv: ['unit']"], "Missing columns not reported per file"
+        assert [(source["file"], source["first_row_id"], source["rows"]) for source in report["sources"]] == [
+            ("vitals/H001_2025-01.csv", 0, 2), ("vitals/H002_2025-01.csv", 2, 2), ("vitals/H003_2025-01.csv", 4, 2),
+            ("labs_H001.csv", 0, 1), ("labs_H002.csv", 1, 1),
+        ], "Unexpected source files"
+    finally:
+        os.remove(config_path)
+        shutil.rmtree(test_dir, ignore_errors=True)
+        shutil.rmtree("./data/output", ignore_errors=True)
@@ -0,0 +1,92 @@
+import os
+import pandas as pd
+import pyarrow.parquet as pq
+
+from schemas import CLEAN_LABS_SCHEMA
+from dataset_io import DatasetWriter, count_rows, export_ipc, read_dataset, read_dataset_frames, count_nulls, dataset_path, \
+    export_partitioned, read_partitioned
+
+def test_ipc_export(tmp_path):
+    # Two chunks with different dictionaries, as streaming mode writes them
+    chunks = [
+        pd.DataFrame({"hospital_id": ["H002", "H001"], "patient_id": ["P2", "P1"], "test_type": ["glucose", None],
+                      "result_value": [90.0, None], "is_abnormal": [False, None]}),
+        pd.DataFrame({"hospital_id": ["H003"], "patient_id": ["P1"], "test_type": ["hemoglobin"],
+                      "result_value": [25.0], "is_abnormal": [True]}),
+    ]
+    parquet_path = dataset_path(tmp_path, "clean_labs")
+    ipc_path = dataset_path(tmp_path, "clean_labs", ipc=True)
+    with DatasetWriter(parquet_path, CLEAN_LABS_SCHEMA) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+
+    export_ipc(parquet_path, ipc_path)
+
+    # Same rows, dtypes and null counts from the memory-mapped copy
+    columns = ["hospital_id", "test_type", "result_value", "is_abnormal"]
+    from_ipc = read_dataset(ipc_path, columns=columns)
+    pd.testing.assert_frame_equal(from_ipc.astype(str), read_dataset(parquet_path, columns=columns).astype(str))
+    assert list(from_ipc.columns) == columns, "Only the projected columns should be read"
+    assert isinstance(from_ipc["hospital_id"].dtype, pd.CategoricalDtype), "Dictionary columns should stay categorical"
+    assert list(from_ipc["hospital_id"].cat.categories) == ["H001", "H002", "H003"], "Dictionaries should be unified"
+    assert count_nulls(ipc_path) == count_nulls(parquet_path), "Null counts should match"
+
+    # Chunked reads follow the written batches
+    frames = list(read_dataset_frames(ipc_path, columns=["patient_id", "result_value"], chunk_size=1))
+    assert [len(frame) for frame in frames] == [2, 1], "Unexpected batches"
+    # Values without nulls are read-only views of the mapped file, values with nulls are copied
+    assert not frames[1]["result_value"].to_numpy().flags.writeable, "Null-free values should stay in the mapped pages"
+    assert frames[0]["result_value"].to_numpy().flags.writeable, "Values with nulls should be converted"
+
+def test_dataset_writer_atomic(tmp_path):
+    path = tmp_path / "clean_labs.parquet"
+    frame = pd.DataFrame({"hospital_id": ["H001"], "result_value": [12.0]})
+
+    # Nothing is visible until the writer closes cleanly
+    with DatasetWriter(path, CLEAN_LABS_SCHEMA) as writer:
+        writer.write(frame)
+        assert not path.exists(), "Output visible before close"
+    assert count_rows(path) == 1, "Output not written"
+
+    # A failed write keeps the previous file and leaves no temporary file behind
+    try:
+        with DatasetWriter(path, CLEAN_LABS_SCHEMA) as writer:
+            writer.write(pd.concat([frame, frame]))
+            raise RuntimeError("failed")
+    except RuntimeError:
+        pass
+    assert count_rows(path) == 1, "Previous output should be kept"
+    assert os.listdir(tmp_path) == ["clean_labs.parquet"], "Temporary file left behind"
+
+def test_partitioned_dataset(tmp_path):
+    frame = pd.DataFrame({"hospital_id": ["H001", "H002", "H001", None],
+                          "test_date": pd.to_datetime(["2025-01-05", "2025-01-20", "2025-02-03", "2025-02-10"]),
+                          "patient_id": ["P1", "P2", "P1", "P3"], "result_value": [12.0, 14.0, 13.0, 11.0]})
+    parquet_path = tmp_path / "clean_labs.parquet"
+    with DatasetWriter(parquet_path, CLEAN_LABS_SCHEMA) as writer:
+        writer.write(frame)
+    path = tmp_path / "clean_labs"
+    export_partitioned(parquet_path, path, "test_date")
+
+    # One directory per hospital and month, the keys left out of the files, which keep row group statistics
+    files = sorted(str(file.relative_to(path)) for file in path.rglob("*.parquet"))
+    assert files == ["hospital_id=H001/year=2025/month=1/part-0.parquet", "hospital_id=H001/year=2025/month=2/part-0.parquet",
+                     "hospital_id=H002/year=2025/month=1/part-0.parquet",
+                     "hospital_id=__HIVE_DEFAULT_PARTITION__/year=2025/month=2/part-0.parquet"], f"Unexpected files: {files}"
+    metadata = pq.ParquetFile(path / files[0]).metadata
+    assert "hospital_id" not in metadata.schema.names, "Partition keys should only be in the path"
+    assert metadata.row_group(0).column(0).statistics.has_min_max, "Row group statistics missing"
+
+    # Hospital and date bounds, inclusive
+    rows = read_partitioned(path, "test_date", hospitals=["H001"], start="2025-01-05", end="2025-02-02")
+    assert rows["result_value"].tolist() == [12.0], "Unexpected rows"
+    assert list(rows.columns[:3]) == ["hospital_id", "test_date", "patient_id"], "Unexpected columns"
+    assert read_partitioned(path, "test_date")["hospital_id"].isna().sum() == 1, "Rows without a hospital lost"
+
+    # An incremental export replaces the partitions it holds and keeps the rest; a full one replaces everything
+    with DatasetWriter(parquet_path, CLEAN_LABS_SCHEMA) as writer:
+        writer.write(frame.iloc[[1]].assign(result_value=15.0))
+    export_partitioned(parquet_path, path, "test_date", replace=False)
+    assert sorted(read_partitioned(path, "test_date")["result_value"].tolist()) == [11.0, 12.0, 13.0, 15.0]
+    export_partitioned(parquet_path, path, "test_date")
+    assert read_partitioned(path, "test_date")["result_value"].tolist() == [15.0], "Old partitions should be gone"
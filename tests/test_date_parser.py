@@ -0,0 +1,25 @@
+import pandas as pd
+
+from date_parser import parse_dates
+
+def test_parse_dates():
+    dates = pd.Series(["2025-01-31", "2025/02/01", "03/04/2025", "13-25-1980", "invalid_date", None, "2025-01-31",
+                       "March 5, 2025"])
+
+    parsed = parse_dates(dates, "%Y-%m-%d", ["%Y/%m/%d", "%m/%d/%Y"])
+
+    # Configured format, then the fallbacks, then per-element parsing for the rest
+    assert parsed.dtype == "datetime64[ns]", "Dates should be parsed to datetimes"
+    assert parsed.iloc[0] == pd.Timestamp("2025-01-31"), "Configured format not parsed"
+    assert parsed.iloc[1] == pd.Timestamp("2025-02-01"), "Fallback format not parsed"
+    assert parsed.iloc[2] == pd.Timestamp("2025-03-04"), "Fallbacks should read month before day"
+    assert parsed.iloc[7] == pd.Timestamp("2025-03-05"), "Unmatched dates should still be parsed per element"
+    assert parsed.iloc[[3, 4, 5]].isna().all(), "Invalid and missing dates should be NaT"
+    assert parsed.iloc[6] == parsed.iloc[0], "Repeated values should parse the same"
+    assert parsed.index.equals(dates.index), "Index should be kept"
+
+    # Same results as parsing every element on its own
+    pd.testing.assert_series_equal(parsed, pd.to_datetime(dates, format="mixed", errors="coerce"))
+
+    # Datetime columns pass through untouched
+    assert parse_dates(parsed, "%Y-%m-%d") is parsed, "Datetime column should not be parsed again"
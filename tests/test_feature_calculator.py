@@ -0,0 +1,160 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+import logging
+
+from data_validator import validate_data
+from data_transformer import transform_data
+from stats_calculator import calculate_statistics
+from feature_calculator import calculate_features, time_series_features
+
+# Configure logging for testing
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def test_time_series_features():
+    # Shuffled readings of one series with a missing value, a second patient and a row without a date,
+    # and the same patient at another hospital
+    frame = pd.DataFrame({
+        "hospital_id": ["H1", "H1", "H1", "H1", "H1", "H2"],
+        "patient_id": ["P1", "P1", "P1", "P1", "P2", "P1"],
+        "vital_type": ["heart_rate"] * 6,
+        "measurement_date": pd.to_datetime(["2024-01-10", "2024-01-01", "2024-02-20", "2024-01-05", None, "2024-01-01"]),
+        "value": [20.0, 10.0, 40.0, None, 5.0, 7.0],
+    })
+    features = time_series_features(frame, "vital_type", "measurement_date", "value", window_readings=2, window_days=30)
+
+    # One sort by (hospital, patient, type, date)
+    assert features["hospital_id"].tolist() == ["H1"] * 5 + ["H2"], "Rows should be sorted by hospital"
+    assert features["patient_id"].tolist() == ["P1"] * 4 + ["P2", "P1"], "Rows should be sorted by patient"
+    pd.testing.assert_series_equal(features["value"], pd.Series([10.0, np.nan, 20.0, 40.0, 5.0, 7.0], name="value"))
+
+    # Features never reach across series; the missing value counts as a reading but not in the means
+    expected = pd.DataFrame({
+        "last_value": [np.nan, 10.0, np.nan, 20.0, np.nan, np.nan],
+        "delta": [np.nan, np.nan, np.nan, 20.0, np.nan, np.nan],
+        "days_since_last": [np.nan, 4.0, 5.0, 41.0, np.nan, np.nan],
+        "rolling_mean_readings": [10.0, 10.0, 20.0, 30.0, np.nan, 7.0],
+        "rolling_mean_days": [10.0, 10.0, 15.0, 40.0, np.nan, 7.0],
+    })
+    pd.testing.assert_frame_equal(features[expected.columns], expected)
+
+def test_calculate_features():
+    # Set test mode
+    os.environ["TEST_MODE"] = "true"
+
+    # Transformed input data: single heart rate readings of two patients
+    vitals_data = pd.DataFrame({
+        "hospital_id": ["H1", "H1"],
+        "patient_id": ["P1", "P2"],
+        "vital_type": ["heart_rate"] * 2,
+        "measurement_date": pd.to_datetime(["2024-01-01", "2024-01-01"]),
+        "value": [60.0, 70.0],
+    })
+    # Three daily hemoglobin readings of one patient, out of order
+    labs_data = pd.DataFrame({
+        "hospital_id": ["H1"] * 3,
+        "patient_id": ["P1"] * 3,
+        "test_type": ["hemoglobin"] * 3,
+        "test_date": pd.to_datetime(["2024-01-03", "2024-01-01", "2024-01-02"]),
+        "result_value": [15.0, 12.0, 13.0],
+    })
+
+    # Derive a config with its own output directory and a two-day window
+    test_dir = "./data/features_test"
+    with open("./config/test_pipeline_config.json", "r") as f:
+        config_data = json.load(f)
+    config_data.update(output_dir=test_dir, feature_window_days=2, transformed_ipc=False)
+    config_path = "./config/test_features_config.json"
+    with open(config_path, "w") as f:
+        json.dump(config_data, f)
+
+    os.makedirs(f"{test_dir}/transformed", exist_ok=True)
+    vitals_data.to_parquet(f"{test_dir}/transformed/clean_vitals.parquet", index=False)
+    labs_data.to_parquet(f"{test_dir}/transformed/clean_labs.parquet", index=False)
+
+    try:
+        calculate_features(config_file="test_features_config.json")
+
+        vitals = pd.read_parquet(f"{test_dir}/features/vitals_features.parquet")
+        labs = pd.read_parquet(f"{test_dir}/features/labs_features.parquet")
+        assert len(vitals) == 2 and vitals["last_value"].isna().all(), "Each patient has a single reading"
+        assert labs["result_value"].tolist() == [12.0, 13.0, 15.0], "Readings should be sorted by date"
+        assert labs["delta"].tolist()[1:] == [1.0, 2.0], "Unexpected deltas"
+        assert labs["rolling_mean_days"].tolist() == [12.0, 12.5, 14.0], "Window should cover the last two days"
+    finally:
+        if os.path.exists(config_path):
+            os.remove(config_path)
+        if os.path.exists(test_dir):
+            shutil.rmtree(test_dir)
+
+def test_calculate_features_incremental():
+    # Set test mode
+    os.environ["TEST_MODE"] = "true"
+
+    # Mock input data: heart rates of two patients at one hospital over two months, and one at another
+    vitals_data = pd.DataFrame({
+        "hospital_id": ["H001", "H001", "H001", "H001", "H002"],
+        "measurement_date": ["2025-01-10", "2025-01-20", "2025-02-05", "2025-01-15", "2025-01-01"],
+        "patient_id": ["P1", "P1", "P1", "P2", "P3"],
+        "vital_type": ["heart_rate"] * 5,
+        "value": [60, 70, 80, 90, 100],
+        "unit": ["bpm"] * 5,
+        "date_of_birth": ["1990-01-01"] * 5
+    })
+    labs_data = pd.DataFrame({
+        "hospital_id": ["H001"],
+        "test_date": ["2025-01-01"],
+        "patient_id": ["P1"],
+        "test_type": ["hemoglobin"],
+        "result_value": [12],
+        "reference_range": ["12-17"],
+        "unit": ["g/dL"],
+        "date_of_birth": ["1990-01-01"]
+    })
+
+    # Derive an incremental config with partitioned datasets, and a full one over the same inputs
+    test_dir = "./data/features_incremental_test"
+    with open("./config/test_pipeline_config.json", "r") as f:
+        config_data = json.load(f)
+    config_data.update(input_dir=f"{test_dir}/input", output_dir=f"{test_dir}/incremental", partitioned_datasets=True,
+                       incremental=True)
+    config_path = "./config/test_features_incremental_config.json"
+    full_config_path = "./config/test_features_full_config.json"
+    with open(config_path, "w") as f:
+        json.dump(config_data, f)
+    with open(full_config_path, "w") as f:
+        json.dump(config_data | {"output_dir": f"{test_dir}/full", "incremental": False}, f)
+
+    os.makedirs(f"{test_dir}/input", exist_ok=True)
+    vitals_data.to_csv(f"{test_dir}/input/vitals.csv", sep=";", index=False)
+    labs_data.to_csv(f"{test_dir}/input/lab_results.csv", sep=",", index=False)
+
+    try:
+        # The statistics stage commits the processed partitions to the manifest
+        for stage in (validate_data, transform_data, calculate_features, calculate_statistics):
+            stage(config_file="test_features_incremental_config.json")
+
+        # A January reading of P1 changes: the features of P1's February reading depend on it, although the
+        # February partition is unchanged
+        vitals_data.assign(value=[60, 75, 80, 90, 100]).to_csv(f"{test_dir}/input/vitals.csv", sep=";", index=False)
+        for stage in (validate_data, transform_data, calculate_features):
+            stage(config_file="test_features_incremental_config.json")
+            stage(config_file="test_features_full_config.json")
+
+        for dataset in ("vitals", "labs"):
+            incremental = pd.read_parquet(f"{test_dir}/incremental/features/{dataset}_features.parquet")
+            full = pd.read_parquet(f"{test_dir}/full/features/{dataset}_features.parquet")
+            pd.testing.assert_frame_equal(incremental.astype(str), full.astype(str))
+        vitals = pd.read_parquet(f"{test_dir}/incremental/features/vitals_features.parquet")
+        assert vitals["last_value"].tolist()[2] == 75.0, "P1's February reading should follow the changed one"
+        with open(f"{test_dir}/incremental/validated/partitions.json", "r") as f:
+            assert list(json.load(f)["vitals"]) == ["H001|2025-01"], "Only the changed partition should be reprocessed"
+    finally:
+        for path in (config_path, full_config_path):
+            if os.path.exists(path):
+                os.remove(path)
+        if os.path.exists(test_dir):
+            shutil.rmtree(test_dir)
@@ -1,6 +1,7 @@
 import sys
 import os
 import shutil
+import json
 import pandas as pd
 import logging
 
@@ -83,4 +84,67 @@ def test_generate_quality_report():
         os.rmdir("./data/output")
     if os.path.exists("./data") and not os.listdir("./data"):
         os.rmdir("./data")
-    del os.environ["TEST_MODE"]
\ No newline at end of file
+    del os.environ["TEST_MODE"]
+
+
+def test_quality_report_incremental():
+    from stages import run_stage
+
+    # Two hospitals over two months; the second run changes one partition and adds another
+    vitals_data = pd.DataFrame({
+        "hospital_id": ["H001", "H001", "H002", "H002"],
+        "measurement_date": ["2025-01-01", "2025-02-01", "2025-01-15", "2025-01-20"],
+        "patient_id": ["P1", "P1", "P2", "P3"],
+        "vital_type": ["blood_pressure_systolic"] * 4,
+        "value": [90, 110, 250, 120],
+        "unit": ["mmHg"] * 4,
+        "date_of_birth": ["1990-01-01"] * 4
+    })
+    labs_data = pd.DataFrame({
+        "hospital_id": ["H001", "H002"],
+        "test_date": ["2025-01-01", "2025-02-01"],
+        "patient_id": ["P1", "P2"],
+        "test_type": ["hemoglobin"] * 2,
+        "result_value": [12, 25],
+        "reference_range": ["12-17"] * 2,
+        "unit": ["g/dL"] * 2,
+        "date_of_birth": ["1990-01-01"] * 2
+    })
+    changed_vitals = pd.concat([vitals_data.assign(value=[90, 110, 130, 120]),
+                                vitals_data.iloc[[0]].assign(hospital_id="H003", patient_id="P4", value="abc")])
+
+    test_dir = "./data/incremental_report_test"
+    with open("./config/test_pipeline_config.json", "r") as f:
+        config_data = json.load(f)
+    config_data.update(input_dir=f"{test_dir}/input")
+    config_path = "./config/test_incremental_report_config.json"
+    full_config_path = "./config/test_full_report_config.json"
+    with open(config_path, "w") as f:
+        json.dump(config_data | {"output_dir": f"{test_dir}/incremental", "incremental": True}, f)
+    with open(full_config_path, "w") as f:
+        json.dump(config_data | {"output_dir": f"{test_dir}/full"}, f)
+    os.makedirs(f"{test_dir}/input", exist_ok=True)
+    labs_data.to_csv(f"{test_dir}/input/lab_results.csv", sep=",", index=False)
+
+    def run(config_name):
+        for stage in ("validate_data", "transform_data", "calculate_statistics", "generate_quality_report"):
+            run_stage(stage, config_name)
+        return pd.read_csv(f"{test_dir}/{'incremental' if 'incremental' in config_name else 'full'}/reports/quality_report.csv")
+
+    try:
+        vitals_data.to_csv(f"{test_dir}/input/vitals.csv", sep=";", index=False)
+        pd.testing.assert_frame_equal(run("test_incremental_report_config.json"), run("test_full_report_config.json"))
+
+        # The second incremental run reprocesses H002's January and H003 only, yet reports the whole data
+        changed_vitals.to_csv(f"{test_dir}/input/vitals.csv", sep=";", index=False)
+        incremental = run("test_incremental_report_config.json")
+        pd.testing.assert_frame_equal(incremental, run("test_full_report_config.json"))
+        assert incremental["total_vitals_records"].iloc[0] == 4, "Totals should cover every partition"
+        assert incremental["quarantined_vitals_records"].iloc[0] == 1, "Quarantined rows should cover every partition"
+        assert incremental["unique_patients"].iloc[0] == 3, "Patients should be counted across partitions"
+    finally:
+        for path in (config_path, full_config_path):
+            if os.path.exists(path):
+                os.remove(path)
+        if os.path.exists(test_dir):
+            shutil.rmtree(test_dir)
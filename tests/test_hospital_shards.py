@@ -0,0 +1,115 @@
+import os
+import shutil
+import json
+import pandas as pd
+import logging
+from pathlib import Path
+
+from stages import run_stage
+from hospital_shards import MISSING_HOSPITAL
+
+# Configure logging for testing
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def test_hospital_shards():
+    # Mock input data: a file with two hospitals and a row without one, and a second file of one hospital
+    vitals_data = pd.DataFrame({
+        "hospital_id": ["H001", "H002", None],
+        "measurement_date": ["2025-01-01", "2025-01-15", "2025-02-01"],
+        "patient_id": ["P1", "P2", "P3"],
+        "vital_type": ["blood_pressure_systolic"] * 3,
+        "value": [90, 110, 100],
+        "unit": ["mmHg"] * 3,
+        "date_of_birth": ["1990-01-01", "1985-06-30", "1970-03-03"]
+    })
+    more_vitals = vitals_data.iloc[:2].assign(hospital_id="H002", patient_id=["P1", "P4"], value=[120, 250])
+    labs_data = pd.DataFrame({
+        "hospital_id": ["H001", "H001"],
+        "test_date": ["2025-01-01", "2025-02-01"],
+        "patient_id": ["P1", "P1"],
+        "test_type": ["hemoglobin"] * 2,
+        "result_value": [12, 25],
+        "reference_range": ["12-17"] * 2,
+        "unit": ["g/dL"] * 2,
+        "date_of_birth": ["1990-01-01"] * 2
+    })
+
+    # Derive a config reading a directory of vitals files; one output directory per run
+    test_dir = "./data/shards_test"
+    with open("./config/test_pipeline_config.json", "r") as f:
+        config_data = json.load(f)
+    config_data.update(input_dir=f"{test_dir}/input", vitals_file="vitals", output_dir=f"{test_dir}/sharded",
+                       partitioned_datasets=True)
+    config_path = "./config/test_shards_config.json"
+    serial_config_path = "./config/test_shards_serial_config.json"
+    with open(config_path, "w") as f:
+        json.dump(config_data, f)
+    with open(serial_config_path, "w") as f:
+        json.dump(config_data | {"output_dir": f"{test_dir}/serial"}, f)
+
+    os.makedirs(f"{test_dir}/input/vitals", exist_ok=True)
+    vitals_data.to_csv(f"{test_dir}/input/vitals/a.csv", sep=";", index=False)
+    more_vitals.to_csv(f"{test_dir}/input/vitals/b.csv", sep=";", index=False)
+    labs_data.to_csv(f"{test_dir}/input/lab_results.csv", sep=",", index=False)
+
+    try:
+        # One shard per hospital, rows without a hospital in a shard of their own
+        partitions = run_stage("discover_partitions", "test_shards_config.json")
+        assert partitions == ["H001", "H002", MISSING_HOSPITAL], f"Unexpected partitions: {partitions}"
+        with open(f"{test_dir}/sharded/shards/shards.json", "r") as f:
+            shards = json.load(f)["partitions"]
+        assert shards["H002"]["vitals"] == [["vitals/a.csv", 0], ["vitals/b.csv", 3]]
+        assert shards["H002"]["labs"] == [], "H002 has no labs"
+
+        # The mapped tasks, then the reduce task, over the output of an earlier run with another hospital
+        os.makedirs(f"{test_dir}/sharded/transformed/clean_vitals/hospital_id=H009", exist_ok=True)
+        validate_metrics = {}
+        for partition in partitions:
+            for stage in ("validate_data", "transform_data", "calculate_statistics", "calculate_features"):
+                metrics = run_stage(stage, "test_shards_config.json", partition=partition)
+                if stage == "validate_data":
+                    validate_metrics[partition] = metrics
+        run_stage("merge_partitions", "test_shards_config.json", partitions=partitions)
+        for stage in ("validate_data", "transform_data", "calculate_statistics", "calculate_features",
+                      "generate_quality_report"):
+            run_stage(stage, "test_shards_serial_config.json")
+
+        # Each shard holds its hospital's rows only, with row ids counted across all input files
+        shard_dir = f"{test_dir}/sharded/shards/hospital_id=H002"
+        validated = pd.read_parquet(f"{shard_dir}/validated/vitals.parquet")
+        quarantined = pd.read_parquet(f"{shard_dir}/quarantine/vitals.parquet")
+        assert validated["patient_id"].tolist() == ["P2", "P1"], "Unexpected rows in the H002 shard"
+        assert quarantined["row_id"].tolist() == [4], "Row ids should be global"
+        assert quarantined["source_row"].tolist() == [1], "Provenance should point into the input file"
+        # Discovery split the inputs by hospital, so the shard parsed its own rows only
+        read = sum(s["rows"] for s in validate_metrics["H002"]["steps"] if s["step"] == "read")
+        assert read == 3, f"The H002 shard read {read} rows"
+
+        # The merged outputs match a single run over all hospitals
+        for name in ("vitals_stats", "lab_stats", "hospital_summary"):
+            pd.testing.assert_frame_equal(pd.read_parquet(f"{test_dir}/sharded/stats/{name}.parquet"),
+                                          pd.read_parquet(f"{test_dir}/serial/stats/{name}.parquet"))
+        # The flat transformed files are merged next to the partitioned datasets, as a single run writes both
+        for name in ("clean_vitals", "clean_labs"):
+            pd.testing.assert_frame_equal(pd.read_parquet(f"{test_dir}/sharded/transformed/{name}.parquet").astype(str),
+                                          pd.read_parquet(f"{test_dir}/serial/transformed/{name}.parquet").astype(str))
+        # The shards' features are concatenated in hospital order into a single run's
+        for name in ("vitals_features", "labs_features"):
+            pd.testing.assert_frame_equal(pd.read_parquet(f"{test_dir}/sharded/features/{name}.parquet").astype(str),
+                                          pd.read_parquet(f"{test_dir}/serial/features/{name}.parquet").astype(str))
+        sharded_report = pd.read_csv(f"{test_dir}/sharded/reports/quality_report.csv")
+        serial_report = pd.read_csv(f"{test_dir}/serial/reports/quality_report.csv")
+        pd.testing.assert_frame_equal(sharded_report, serial_report)
+        # P1 is seen in two shards but counted once; P4's only reading is quarantined
+        assert sharded_report["unique_patients"].iloc[0] == 3, "Patients should be counted across shards"
+
+        # The merged partitioned data holds this run's hospitals only
+        hospitals = sorted(path.name for path in Path(f"{test_dir}/sharded/transformed/clean_vitals").iterdir())
+        assert hospitals == ["hospital_id=H001", "hospital_id=H002", f"hospital_id={MISSING_HOSPITAL}"], hospitals
+    finally:
+        for path in (config_path, serial_config_path):
+            if os.path.exists(path):
+                os.remove(path)
+        if os.path.exists(test_dir):
+            shutil.rmtree(test_dir)
@@ -0,0 +1,32 @@
+import json
+import pandas as pd
+from pathlib import Path
+
+from instrumentation import StageMetrics, step, timed_frames
+
+def test_stage_metrics(tmp_path):
+    frames = [pd.DataFrame({"value": range(3)}), pd.DataFrame({"value": range(2)})]
+
+    with StageMetrics("example_stage") as metrics:
+        for frame in timed_frames(frames):
+            with step("write") as record:
+                record["rows"] += len(frame)
+                record["bytes"] += 10
+
+    # Steps accumulate over chunks; stage totals come from the read and write steps
+    summary = metrics.write(Path(tmp_path))
+    assert summary["rows_in"] == 5, "Unexpected rows read"
+    assert summary["rows_out"] == 5, "Unexpected rows written"
+    assert summary["bytes_out"] == 20, "Unexpected bytes written"
+    steps = {record["step"]: record for record in summary["steps"]}
+    assert steps["write"]["calls"] == 2, "Unexpected write calls"
+    assert summary["wall_seconds"] >= steps["write"]["wall_seconds"], "Stage should take at least as long as a step"
+
+    # The metrics file holds the same summary, ready for XCom
+    with open(tmp_path / "example_stage_metrics.json", "r") as f:
+        assert json.load(f) == summary, "Metrics file should match the returned summary"
+
+    # Outside a stage, steps are not recorded
+    with step("read") as record:
+        record["rows"] += 1
+    assert metrics.steps["read"]["rows"] == 5, "Steps outside the stage should not be recorded"
@@ -0,0 +1,49 @@
+import logging
+import numpy as np
+
+from issue_collector import IssueCollector
+
+def test_issue_collector_merge():
+    rows = np.arange(1000)
+
+    # One collector over all rows, or four shard collectors merged back
+    whole = IssueCollector(sample_size=5, rule_sample_sizes={"missing_value": 2})
+    whole.add((0, 1), "non_numeric", "vitals", "value", "Non-numeric values", rows[::3])
+    whole.add((0, 2), "missing_value", "vitals", "unit", "Missing unit", rows[::7])
+    merged = IssueCollector(sample_size=5, rule_sample_sizes={"missing_value": 2})
+    for shard in np.array_split(rows, 4):
+        shard_issues = merged.spawn()
+        shard_issues.add((0, 2), "missing_value", "vitals", "unit", "Missing unit", shard[shard % 7 == 0])
+        shard_issues.add((0, 1), "non_numeric", "vitals", "value", "Non-numeric values", shard[shard % 3 == 0])
+        merged.merge(shard_issues)
+
+    assert merged.records() == whole.records(), "Sharded records should match"
+    records = whole.records()
+    assert [record["rule"] for record in records] == ["non_numeric", "missing_value"], "Records should follow the ranks"
+    assert records[0]["count"] == 334 and len(records[0]["sample_row_ids"]) == 5, "Sample should be capped"
+    assert len(records[1]["sample_row_ids"]) == 2, "Per-rule cap not applied"
+    assert all(row % 7 == 0 for row in records[1]["sample_row_ids"]), "Sample should hold offending rows only"
+    assert whole.summary()[0] == "Non-numeric values: 334 records", "Unexpected summary line"
+
+def test_issue_collector_warnings():
+    issues = IssueCollector(log_limit=2)
+    shard = issues.spawn()
+    for i in range(5):
+        shard.warn("non_numeric", f"warning {i}")
+    assert len(shard.pending) == 5, "Shards should leave the limit to the parent"
+    issues.merge(shard)
+    issues.warn("non_numeric", "warning 5")
+    assert issues.logged == {"non_numeric": 2}, "Logged warnings over the limit"
+    assert issues.suppressed == {"non_numeric": 4}, "Suppressed warnings not counted"
+
+def test_issue_collector_logs_once(tmp_path, caplog):
+    # The warned rule was logged with its sample during validation, so the summary only logs the other issue
+    issues = IssueCollector(log_limit=1)
+    issues.add((0, 1), "non_numeric", "vitals", "value", "Non-numeric values", [1, 2])
+    issues.warn("non_numeric", "Non-numeric values: 2 records, e.g. abc")
+    issues.add((0, 2), "missing_value", "vitals", "unit", "Missing unit", [3])
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger="issue_collector"):
+        issues.write(tmp_path / "issues.txt", tmp_path / "issues.json")
+    assert caplog.messages == ["Missing unit: 1 records"], "Each issue should be logged once"
+    assert (tmp_path / "issues.txt").read_text().splitlines() == ["Non-numeric values: 2 records", "Missing unit: 1 records"]
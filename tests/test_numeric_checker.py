@@ -0,0 +1,19 @@
+import pandas as pd
+
+from numeric_checker import coerce_numeric
+
+def test_coerce_numeric():
+    raw = pd.Series(["90", "1e3", " 98.6", "-5", "abc", None, "12,5", "abc"], index=range(10, 18))
+
+    values, invalid, sample = coerce_numeric(raw)
+
+    # Scientific notation and surrounding spaces are numeric; missing values are not invalid
+    assert values.dtype == "float64", "Values should be floats"
+    assert values.iloc[:4].tolist() == [90.0, 1000.0, 98.6, -5.0], "Unexpected coerced values"
+    assert invalid.tolist() == [False, False, False, False, True, False, True, True], "Unexpected invalid mask"
+    assert invalid.index.equals(raw.index), "Mask should be aligned with the input"
+    assert sample == ["abc", "12,5"], "Sample should list distinct offending values"
+
+    # Numeric columns need no parsing
+    values, invalid, sample = coerce_numeric(pd.Series([1, 2, None]))
+    assert not invalid.any() and sample == [], "Numeric column should have no invalid values"
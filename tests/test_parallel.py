@@ -0,0 +1,93 @@
+import os
+import shutil
+import json
+import filecmp
+import pandas as pd
+import logging
+
+from data_validator import validate_data
+from data_transformer import transform_data
+from stats_calculator import calculate_statistics
+
+# Configure logging for testing
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def run_stages(config_data, config_path):
+    with open(config_path, "w") as f:
+        json.dump(config_data, f)
+    for stage in (validate_data, transform_data, calculate_statistics):
+        stage(config_file=os.path.basename(config_path))
+
+def test_parallel_matches_serial():
+    # Mock input data spread over several hospitals, with invalid and out-of-range values
+    vitals_data = pd.DataFrame({
+        "hospital_id": ["H001", "H002", "H003", "H001", "H002", "H003"] * 4,
+        "measurement_date": ["2025-01-01", "2025-01-15", "2025-02-01", "bad", "2025-03-01", "2025-02-10"] * 4,
+        "patient_id": [f"P{i % 7}" for i in range(24)],
+        "vital_type": ["blood_pressure_systolic"] * 24,
+        "value": [90, 250, "abc", 120, None, 130] * 4,
+        "unit": ["mmHg"] * 24,
+        "date_of_birth": ["1990-01-01"] * 24
+    })
+    labs_data = pd.DataFrame({
+        "hospital_id": ["H003", "H001", "H002"] * 4,
+        "test_date": ["2025-01-01", "2025-02-01", "2025-02-15"] * 4,
+        "patient_id": [f"P{i % 5}" for i in range(12)],
+        "test_type": ["hemoglobin", "glucose", "hemoglobin"] * 4,
+        "result_value": [12, 250, 25] * 4,
+        "reference_range": ["12-17", "70-100", "12-17"] * 4,
+        "unit": ["g/dL", "mg/dL", "g/dL"] * 4,
+        "date_of_birth": ["1990-01-01"] * 12
+    })
+
+    with open("./config/test_pipeline_config.json", "r") as f:
+        config_data = json.load(f)
+    input_dir = "./data/parallel_input"
+    config_data["input_dir"] = input_dir
+    config_path = "./config/test_parallel_config.json"
+    os.makedirs(input_dir, exist_ok=True)
+    vitals_data.to_csv(f"{input_dir}/vitals.csv", sep=";", index=False)
+    labs_data.to_csv(f"{input_dir}/lab_results.csv", sep=",", index=False)
+
+    try:
+        for median_mode in ("exact", "sketch"):
+            # Serial run first, then the same stages over a process pool, sharded both ways
+            serial_dir = "./data/output/serial"
+            run_stages(dict(config_data, output_dir=serial_dir, median_mode=median_mode), config_path)
+            for shard_by in ("hospital_id", "patient_id"):
+                parallel_dir = f"./data/output/{shard_by}"
+                run_stages(dict(config_data, output_dir=parallel_dir, median_mode=median_mode, workers=2,
+                                shard_by=shard_by), config_path)
+                for subdir in ("validated", "transformed", "stats"):
+                    for name in sorted(os.listdir(f"{serial_dir}/{subdir}")):
+                        assert filecmp.cmp(f"{serial_dir}/{subdir}/{name}", f"{parallel_dir}/{subdir}/{name}",
+                                           shallow=False), f"{subdir}/{name} differs from the serial run"
+
+        # Streaming, with more per-chunk warnings than the log limit: the issue files still match byte for byte
+        streaming = dict(config_data, streaming_enabled=True, chunk_size=12, issue_log_limit=1, shard_by="patient_id")
+        run_stages(dict(streaming, output_dir="./data/output/streaming_serial"), config_path)
+        run_stages(dict(streaming, output_dir="./data/output/streaming_parallel", workers=2), config_path)
+        for name in ("validation_issues.txt", "validation_issues.json"):
+            assert filecmp.cmp(f"./data/output/streaming_serial/validated/{name}",
+                               f"./data/output/streaming_parallel/validated/{name}",
+                               shallow=False), f"{name} differs from the serial streaming run"
+    finally:
+        os.remove(config_path)
+        shutil.rmtree(input_dir, ignore_errors=True)
+        shutil.rmtree("./data/output", ignore_errors=True)
+
+def test_run_concurrently():
+    from parallel import run_concurrently
+    from instrumentation import StageMetrics, step
+
+    def read(rows):
+        with step("read") as record:
+            record["rows"] += rows
+        return rows
+
+    # Results come back in task order, and the threads' steps count towards the stage
+    with StageMetrics("example_stage") as metrics:
+        assert run_concurrently([lambda: read(3), lambda: read(4)]) == [3, 4], "Results out of order"
+    assert metrics.steps["read"]["rows"] == 7, "Thread steps not merged"
+    assert metrics.steps["read"]["calls"] == 2, "Unexpected read calls"
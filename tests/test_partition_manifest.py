@@ -0,0 +1,54 @@
+import os
+import shutil
+import pandas as pd
+import logging
+
+from dataset_io import read_frames
+from partition_manifest import fingerprint_frames, changed_partitions, select_partitions, commit_partitions, load_manifest
+
+# Configure logging for testing
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def fingerprint_file(path, chunk_size=None):
+    return fingerprint_frames(read_frames(path, ";", chunk_size, dtype=str), "measurement_date", "%Y-%m-%d")
+
+def test_partition_manifest():
+    # Mock input data: two hospitals, January and February
+    vitals_data = pd.DataFrame({
+        "hospital_id": ["H001", "H001", "H001", "H002"],
+        "measurement_date": ["2025-01-01", "2025-01-20", "2025-02-03", "2025-01-05"],
+        "patient_id": ["P1", "P2", "P1", "P3"],
+        "vital_type": ["heart_rate"] * 4,
+        "value": [70, 80, 75, 90],
+        "unit": ["bpm"] * 4,
+        "date_of_birth": ["1990-01-01"] * 4
+    })
+    test_dir = "./data/manifest_test"
+    os.makedirs(test_dir, exist_ok=True)
+    vitals_path = f"{test_dir}/vitals.csv"
+    manifest_path = f"{test_dir}/manifest.json"
+
+    try:
+        # Partitions are keyed by hospital and month, chunking does not change the fingerprints
+        vitals_data.to_csv(vitals_path, sep=";", index=False)
+        fingerprints = fingerprint_file(vitals_path)
+        assert sorted(fingerprints) == ["H001|2025-01", "H001|2025-02", "H002|2025-01"], "Unexpected partition keys"
+        assert fingerprints["H001|2025-01"]["rows"] == 2, "Unexpected partition row count"
+        assert fingerprint_file(vitals_path, chunk_size=1) == fingerprints, "Chunked fingerprints differ"
+
+        # Everything is new before the first commit, nothing afterwards
+        manifest = load_manifest(manifest_path)
+        assert changed_partitions(fingerprints, manifest["vitals"]) == fingerprints, "All partitions should be new"
+        commit_partitions(manifest_path, {"vitals": fingerprints})
+        assert changed_partitions(fingerprints, load_manifest(manifest_path)["vitals"]) == {}, "No partition should have changed"
+
+        # Changing one value only touches its own partition
+        vitals_data.loc[3, "value"] = 95
+        vitals_data.to_csv(vitals_path, sep=";", index=False)
+        changed = changed_partitions(fingerprint_file(vitals_path), load_manifest(manifest_path)["vitals"])
+        assert list(changed) == ["H002|2025-01"], "Only the modified partition should be selected"
+        selected = select_partitions(pd.read_csv(vitals_path, sep=";", dtype=str), "measurement_date", changed, "%Y-%m-%d")
+        assert selected["patient_id"].tolist() == ["P3"], "Unexpected rows selected"
+    finally:
+        shutil.rmtree(test_dir, ignore_errors=True)
@@ -0,0 +1,39 @@
+import pandas as pd
+
+from patient_index import partial_index, combine_index, build_index, quality_counts, hospital_summary
+from quality_reporter import compute_quality_metrics
+
+def test_patient_index():
+    vitals = pd.DataFrame({
+        "hospital_id": pd.Categorical(["H001", "H001", "H002", "H002", "H001"]),
+        "patient_id": pd.Categorical(["P2", "P1", "P3", "P2", None]),
+        "measurement_date": pd.to_datetime(["2025-01-05", "2025-01-01", "2025-02-01", "2025-03-01", "2025-01-02"]),
+        "value": [90.0, 110.0, 120.0, 130.0, 100.0],
+        "missing_count": [0, 1, 0, 0, 1],
+    })
+    labs = pd.DataFrame({
+        "hospital_id": pd.Categorical(["H001", "H002"]),
+        "patient_id": pd.Categorical(["P2", "P4"]),
+        "test_date": pd.to_datetime(["2025-01-10", "2025-02-01"]),
+        "is_abnormal": [True, False],
+        "missing_count": [0, 0],
+    })
+
+    # Chunk partials combine to the index of the whole tables
+    index = build_index(vitals, labs)
+    chunked = combine_index([partial_index(vitals.iloc[:2], "vitals"), partial_index(labs, "labs"),
+                             partial_index(vitals.iloc[2:], "vitals")])
+    pd.testing.assert_frame_equal(chunked, index)
+
+    p2 = index[(index["hospital_id"] == "H001") & (index["patient_id"] == "P2")].iloc[0]
+    assert (p2["vitals_rows"], p2["labs_rows"], p2["abnormal_labs"]) == (1, 1, 1), "Unexpected counts for P2 at H001"
+    assert p2["last_date"] == pd.Timestamp("2025-01-10"), "Last date should span both datasets"
+    assert index["patient_code"].tolist() == [0, 1, -1, 1, 2, 3], "Patients should be coded in sorted id order"
+
+    # The same quality metrics as a scan of the rows
+    expected = compute_quality_metrics(vitals, labs)
+    assert quality_counts(index) == {key: expected[key] for key in quality_counts(index)}, "Quality counts differ"
+
+    summary = hospital_summary(index).set_index("hospital_id")
+    assert summary.loc["H002", "patients"] == 3, "Unexpected patients at H002"
+    assert summary.loc["H001", "vitals_rows"] == 3, "Unexpected vitals rows at H001"
@@ -0,0 +1,89 @@
+import os
+import shutil
+import json
+import pandas as pd
+import logging
+
+from pipeline_runner import run_pipeline
+
+# Configure logging for testing
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def test_run_pipeline():
+    # Mock input data
+    vitals_data = pd.DataFrame({
+        "hospital_id": ["H001", "H001", "H002"],
+        "measurement_date": ["2025-01-01", "2025-01-15", "2025-02-01"],
+        "patient_id": ["P1", "P1", "P2"],
+        "vital_type": ["blood_pressure_systolic"] * 3,
+        "value": [90, 110, 250],
+        "unit": ["mmHg"] * 3,
+        "date_of_birth": ["1990-01-01", "1990-01-01", "1985-06-30"]
+    })
+    labs_data = pd.DataFrame({
+        "hospital_id": ["H001", "H002"],
+        "test_date": ["2025-01-01", "2025-02-01"],
+        "patient_id": ["P1", "P3"],
+        "test_type": ["hemoglobin", "hemoglobin"],
+        "result_value": [12, 25],
+        "reference_range": ["12-17", "12-17"],
+        "unit": ["g/dL", "g/dL"],
+        "date_of_birth": ["1990-01-01", "1970-03-03"]
+    })
+
+    # Derive a config from the test config with its own input directory
+    with open("./config/test_pipeline_config.json", "r") as f:
+        config_data = json.load(f)
+    config_data["input_dir"] = "./data/runner_input"
+    config_path = "./config/test_runner_config.json"
+    with open(config_path, "w") as f:
+        json.dump(config_data, f)
+
+    input_dir = "./data/runner_input"
+    os.makedirs(input_dir, exist_ok=True)
+    vitals_data.to_csv(f"{input_dir}/vitals.csv", sep=";", index=False)
+    labs_data.to_csv(f"{input_dir}/lab_results.csv", sep=",", index=False)
+
+    try:
+        # Run the whole pipeline in memory, without intermediate files
+        metrics = run_pipeline(config_file="test_runner_config.json")
+
+        output_dir = "./data/output"
+        assert os.path.exists(f"{output_dir}/validated/validation_issues.txt"), "Issues file not created"
+        assert not os.path.exists(f"{output_dir}/validated/vitals.parquet"), "Intermediate files should be optional"
+        assert not os.path.exists(f"{output_dir}/transformed/clean_vitals.parquet"), "Intermediate files should be optional"
+
+        # Final outputs come from the in-memory frames
+        # The out-of-range vital is quarantined; the out-of-range lab is an abnormal result
+        vitals_stats = pd.read_parquet(f"{output_dir}/stats/vitals_stats.parquet")
+        assert len(vitals_stats) == 1, "Expected one vitals group per hospital and month"
+        assert vitals_stats["mean"].iloc[0] == 100.0, "Unexpected mean for H001 January"
+        quality_report = pd.read_csv(f"{output_dir}/reports/quality_report.csv")
+        assert quality_report["total_vitals_records"].iloc[0] == 2, "Unexpected total vitals records"
+        assert quality_report["quarantined_vitals_records"].iloc[0] == 1, "Unexpected quarantined vitals records"
+        assert quality_report["abnormal_lab_results"].iloc[0] == 1, "Unexpected abnormal lab results"
+        assert quality_report["unique_patients"].iloc[0] == 2, "Unexpected unique patients"
+        hospital_summary = pd.read_parquet(f"{output_dir}/stats/hospital_summary.parquet")
+        assert hospital_summary["labs_rows"].tolist() == [1, 1], "Unexpected labs rows per hospital"
+        quarantined = pd.read_parquet(f"{output_dir}/quarantine/vitals.parquet")
+        assert quarantined["row_id"].tolist() == [2], "Unexpected quarantined row"
+        assert quarantined["failed_rules"].tolist() == ["out_of_range"], "Unexpected failed rules"
+
+        # Stage metrics are returned and written next to the quality report
+        assert metrics["rows_in"] == 5, "Unexpected rows read"
+        assert os.path.exists(f"{output_dir}/reports/run_pipeline_metrics.json"), "Metrics file not created"
+
+        # Intermediate files match the per-task layout when requested
+        run_pipeline(config_file="test_runner_config.json", write_intermediate=True)
+        assert os.path.exists(f"{output_dir}/validated/vitals.parquet"), "Validated vitals not written"
+        assert os.path.exists(f"{output_dir}/transformed/clean_labs.parquet"), "Transformed labs not written"
+
+        # A later run without them removes the ones left behind instead of leaving them stale
+        run_pipeline(config_file="test_runner_config.json")
+        for name in ("validated/vitals.parquet", "transformed/clean_labs.parquet", "transformed/patient_index.parquet"):
+            assert not os.path.exists(f"{output_dir}/{name}"), f"Stale {name} left behind"
+    finally:
+        os.remove(config_path)
+        shutil.rmtree(input_dir, ignore_errors=True)
+        shutil.rmtree("./data/output", ignore_errors=True)
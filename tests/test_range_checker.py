@@ -0,0 +1,33 @@
+import pandas as pd
+import logging
+
+from range_checker import parse_reference_range, resolve_bounds, count_out_of_range
+
+# Configure logging for testing
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def test_range_checker():
+    # Mock lab data: config range for hemoglobin, reference ranges for the rest
+    labs = pd.DataFrame({
+        "patient_id": ["P1", "P2", "P3", "P4", "P5", "P6"],
+        "test_type": ["hemoglobin", "hemoglobin", "glucose", "glucose", "cholesterol", "cholesterol"],
+        "result_value": [25.0, 12.0, 40.0, None, 300.0, 150.0],
+        "reference_range": ["12-17", "12-17", "70-100", "70-100", "100-200", "bad"]
+    })
+    lab_ranges = {"hemoglobin": {"min": 10, "max": 20}}
+
+    # Reference ranges are parsed into float bounds, unparseable ones become NaN
+    parsed = parse_reference_range(labs["reference_range"])
+    assert parsed["min"].tolist()[:5] == [12.0, 12.0, 70.0, 70.0, 100.0], "Unexpected parsed minimums"
+    assert pd.isna(parsed["min"].iloc[5]), "Unparseable range should give NaN"
+
+    # Config ranges take precedence over reference_range
+    bounds = resolve_bounds(labs, "test_type", lab_ranges, reference_col="reference_range")
+    assert bounds["max"].iloc[0] == 20.0, "Config range should override reference_range"
+    assert bounds["max"].iloc[2] == 100.0, "Reference range should be used without a config range"
+
+    # Missing values and unknown bounds never count as out of range
+    mask, counts = count_out_of_range(labs["test_type"], labs["result_value"], bounds)
+    assert mask.tolist() == [True, False, True, False, True, False], "Unexpected out-of-range mask"
+    assert counts.to_dict() == {"hemoglobin": 1, "glucose": 1, "cholesterol": 1}, "Unexpected counts per test type"
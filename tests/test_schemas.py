@@ -0,0 +1,35 @@
+import pandas as pd
+
+from schemas import VITALS_SCHEMA, compact, share_categories, to_table
+from quality_reporter import unique_patients
+
+def test_categorical_tables():
+    vitals = pd.DataFrame({
+        "hospital_id": ["H002", "H001", None],
+        "patient_id": ["P2", "P1", "P2"],
+        "vital_type": ["heart_rate"] * 3,
+        "value": [70.0, 80.0, None],
+        "unit": ["bpm"] * 3,
+    })
+    labs = pd.DataFrame({
+        "hospital_id": ["H003", "H001"],
+        "patient_id": ["P3", "P1"],
+        "unit": ["g/dL", "g/dL"],
+    })
+
+    # Labels and ids become categoricals; values keep their dtype
+    vitals, labs = compact(vitals), compact(labs)
+    assert all(isinstance(vitals[col].dtype, pd.CategoricalDtype) for col in ["hospital_id", "patient_id", "vital_type", "unit"])
+    assert vitals["value"].dtype == "float64", "Values should stay floats"
+
+    # Shared columns get one sorted dictionary across both tables
+    vitals, labs = share_categories(vitals, labs)
+    assert list(vitals["hospital_id"].cat.categories) == ["H001", "H002", "H003"], "Unexpected shared categories"
+    assert vitals["patient_id"].cat.categories.equals(labs["patient_id"].cat.categories), "Categories should be shared"
+    assert unique_patients(vitals["patient_id"], labs["patient_id"]) == 3, "Unexpected unique patients"
+
+    # Categoricals are written as dictionary arrays, without their unused categories
+    table = to_table(vitals, VITALS_SCHEMA)
+    assert table.column("hospital_id").to_pylist() == ["H002", "H001", None], "Unexpected hospital ids"
+    assert table.column("hospital_id").chunk(0).dictionary.to_pylist() == ["H001", "H002"], "Unused categories should be dropped"
+    assert table.column("measurement_date").null_count == 3, "Missing columns should be null"
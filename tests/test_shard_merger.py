@@ -0,0 +1,84 @@
+import os
+import shutil
+import json
+import pandas as pd
+import logging
+
+from hospital_shards import discover_partitions
+from data_validator import validate_data
+from data_transformer import transform_data
+from shard_merger import merge_partitions
+
+# Configure logging for testing
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def test_merge_partitions():
+    # Mock input data: two vitals files of interleaved hospitals with an out-of-range value and a non-numeric
+    # one per hospital, and labs with a missing unit
+    vitals_data = pd.DataFrame({
+        "hospital_id": ["H002", "H001", "H002", "H001"],
+        "measurement_date": ["2025-01-01", "2025-01-15", "2025-02-01", "2025-02-15"],
+        "patient_id": ["P1", "P2", "P3", "P4"],
+        "vital_type": ["heart_rate"] * 4,
+        "value": ["400", "abc", "xyz", "80"],
+        "unit": ["bpm"] * 4,
+        "date_of_birth": ["1990-01-01"] * 4
+    })
+    labs_data = pd.DataFrame({
+        "hospital_id": ["H001", "H002"],
+        "test_date": ["2025-01-01", "2025-02-01"],
+        "patient_id": ["P2", "P1"],
+        "test_type": ["hemoglobin"] * 2,
+        "result_value": [12, 14],
+        "reference_range": ["12-17"] * 2,
+        "unit": ["g/dL", None],
+        "date_of_birth": ["1990-01-01"] * 2
+    })
+
+    # Derive a config reading a directory of vitals files; one output directory per run
+    test_dir = "./data/merge_test"
+    with open("./config/test_pipeline_config.json", "r") as f:
+        config_data = json.load(f)
+    config_data.update(input_dir=f"{test_dir}/input", vitals_file="vitals", output_dir=f"{test_dir}/sharded",
+                       partitioned_datasets=False)
+    config_path = "./config/test_merge_config.json"
+    serial_config_path = "./config/test_merge_serial_config.json"
+    with open(config_path, "w") as f:
+        json.dump(config_data, f)
+    with open(serial_config_path, "w") as f:
+        json.dump(config_data | {"output_dir": f"{test_dir}/serial"}, f)
+
+    os.makedirs(f"{test_dir}/input/vitals", exist_ok=True)
+    vitals_data.iloc[:2].to_csv(f"{test_dir}/input/vitals/a.csv", sep=";", index=False)
+    vitals_data.iloc[2:].to_csv(f"{test_dir}/input/vitals/b.csv", sep=";", index=False)
+    labs_data.to_csv(f"{test_dir}/input/lab_results.csv", sep=",", index=False)
+
+    try:
+        # Per-shard outputs merged, against a single run over all hospitals
+        partitions = discover_partitions("test_merge_config.json")
+        for partition in partitions:
+            validate_data("test_merge_config.json", partition=partition)
+            transform_data("test_merge_config.json", partition=partition)
+        merge_partitions("test_merge_config.json")
+        validate_data("test_merge_serial_config.json")
+        transform_data("test_merge_serial_config.json")
+
+        # Issue counts, samples and sources add up to the single run's
+        for name in ("validation_issues.txt", "validation_issues.json"):
+            with open(f"{test_dir}/sharded/validated/{name}", "r") as f, open(f"{test_dir}/serial/validated/{name}", "r") as g:
+                assert f.read() == g.read(), f"Merged {name} differs"
+
+        # Quarantined and clean rows come back in input order
+        for name in ("quarantine/vitals", "quarantine/labs", "transformed/clean_vitals", "transformed/clean_labs"):
+            merged = pd.read_parquet(f"{test_dir}/sharded/{name}.parquet")
+            serial = pd.read_parquet(f"{test_dir}/serial/{name}.parquet")
+            pd.testing.assert_frame_equal(merged.astype(str), serial.astype(str))
+        quarantined = pd.read_parquet(f"{test_dir}/sharded/quarantine/vitals.parquet")
+        assert quarantined["row_id"].tolist() == [1, 2], "Rows of both hospitals should be quarantined"
+    finally:
+        for path in (config_path, serial_config_path):
+            if os.path.exists(path):
+                os.remove(path)
+        if os.path.exists(test_dir):
+            shutil.rmtree(test_dir)
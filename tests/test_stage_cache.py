@@ -0,0 +1,167 @@
+import os
+import shutil
+import json
+import pandas as pd
+import logging
+
+from data_validator import validate_data
+from data_transformer import transform_data, load_transformed
+from stats_calculator import calculate_statistics, load_stats
+from config_model import load_config
+from stage_cache import StageCache
+
+# Configure logging for testing
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def test_stage_cache():
+    # Mock input data
+    vitals_data = pd.DataFrame({
+        "hospital_id": ["H001", "H002"],
+        "measurement_date": ["2025-01-01", "2025-02-01"],
+        "patient_id": ["P1", "P2"],
+        "vital_type": ["blood_pressure_systolic"] * 2,
+        "value": [90, 110],
+        "unit": ["mmHg"] * 2,
+        "date_of_birth": ["1990-01-01", "1985-06-30"]
+    })
+    labs_data = pd.DataFrame({
+        "hospital_id": ["H001"],
+        "test_date": ["2025-01-01"],
+        "patient_id": ["P1"],
+        "test_type": ["hemoglobin"],
+        "result_value": [12],
+        "reference_range": ["12-17"],
+        "unit": ["g/dL"],
+        "date_of_birth": ["1990-01-01"]
+    })
+
+    # Derive a config from the test config with the cache enabled and directories of its own
+    test_dir = "./data/cache_test"
+    with open("./config/test_pipeline_config.json", "r") as f:
+        config_data = json.load(f)
+    config_data.update(input_dir=f"{test_dir}/input", output_dir=f"{test_dir}/output", stage_cache=True,
+                       cache_dir=f"{test_dir}/cache")
+    config_path = "./config/test_cache_config.json"
+    with open(config_path, "w") as f:
+        json.dump(config_data, f)
+
+    os.makedirs(f"{test_dir}/input", exist_ok=True)
+    vitals_data.to_csv(f"{test_dir}/input/vitals.csv", sep=";", index=False)
+    labs_data.to_csv(f"{test_dir}/input/lab_results.csv", sep=",", index=False)
+
+    try:
+        # The first run computes and stores, a rerun restores the same outputs without reading the inputs
+        first = validate_data(config_file="test_cache_config.json")
+        transform_data(config_file="test_cache_config.json")
+        expected = pd.read_parquet(f"{test_dir}/output/validated/vitals.parquet")
+        shutil.rmtree(f"{test_dir}/output/validated")
+        rerun = validate_data(config_file="test_cache_config.json")
+        assert "read" in [s["step"] for s in first["steps"]], "The first run should read the inputs"
+        assert [s["step"] for s in rerun["steps"]] == ["cache_key", "cache_restore"], "The rerun should be restored"
+        pd.testing.assert_frame_equal(pd.read_parquet(f"{test_dir}/output/validated/vitals.parquet"), expected)
+        assert os.path.exists(f"{test_dir}/output/validated/validation_issues.json"), "Issues file not restored"
+
+        # Changed input content is a miss
+        vitals_data.assign(value=[95, 110]).to_csv(f"{test_dir}/input/vitals.csv", sep=";", index=False)
+        changed = validate_data(config_file="test_cache_config.json")
+        assert "read" in [s["step"] for s in changed["steps"]], "Changed inputs should be recomputed"
+        assert pd.read_parquet(f"{test_dir}/output/validated/vitals.parquet")["value"].tolist() == [95, 110]
+
+        # Least recently used entries go first: the restore counts as a use of the first validate_data entry
+        cache = StageCache(f"{test_dir}/cache", 1)
+        entries = cache.entries()
+        assert [entry["stage"] for entry in entries] == ["transform_data", "validate_data", "validate_data"]
+        cache.max_bytes = sum(entry["bytes"] for entry in entries[1:])
+        assert [entry["key"] for entry in cache.evict()] == [entries[0]["key"]], "The oldest entry should be evicted"
+        assert len(cache.purge("validate_data")) == 2, "Both validate_data entries should be purged"
+        assert cache.entries() == [], "The cache should be empty"
+    finally:
+        if os.path.exists(config_path):
+            os.remove(config_path)
+        if os.path.exists(test_dir):
+            shutil.rmtree(test_dir)
+
+def test_stage_cache_restore_replaces():
+    # Inputs of two hospitals, then of four, then the first ones again
+    def vitals_data(hospitals):
+        return pd.DataFrame({
+            "hospital_id": hospitals,
+            "measurement_date": ["2025-01-01"] * len(hospitals),
+            "patient_id": [f"P{i}" for i in range(len(hospitals))],
+            "vital_type": ["heart_rate"] * len(hospitals),
+            "value": [70] * len(hospitals),
+            "unit": ["bpm"] * len(hospitals),
+            "date_of_birth": ["1990-01-01"] * len(hospitals)
+        })
+    labs_data = pd.DataFrame({
+        "hospital_id": ["H001"],
+        "test_date": ["2025-01-01"],
+        "patient_id": ["P0"],
+        "test_type": ["hemoglobin"],
+        "result_value": [12],
+        "reference_range": ["12-17"],
+        "unit": ["g/dL"],
+        "date_of_birth": ["1990-01-01"]
+    })
+
+    test_dir = "./data/cache_restore_test"
+    with open("./config/test_pipeline_config.json", "r") as f:
+        config_data = json.load(f)
+    config_data.update(input_dir=f"{test_dir}/input", output_dir=f"{test_dir}/output", stage_cache=True,
+                       cache_dir=f"{test_dir}/cache", partitioned_datasets=True)
+    config_path = "./config/test_cache_restore_config.json"
+    with open(config_path, "w") as f:
+        json.dump(config_data, f)
+
+    os.makedirs(f"{test_dir}/input", exist_ok=True)
+    labs_data.to_csv(f"{test_dir}/input/lab_results.csv", sep=",", index=False)
+
+    try:
+        runs = []
+        for hospitals in (["H001", "H002"], ["H001", "H002", "H003", "H004"], ["H001", "H002"]):
+            vitals_data(hospitals).to_csv(f"{test_dir}/input/vitals.csv", sep=";", index=False)
+            runs.append([validate_data(config_file="test_cache_restore_config.json"),
+                         transform_data(config_file="test_cache_restore_config.json"),
+                         calculate_statistics(config_file="test_cache_restore_config.json")])
+
+        # The third run is restored, without the partitions only the second run's inputs had
+        assert all(s["step"] != "read" for metrics in runs[2] for s in metrics["steps"]), "The third run should be restored"
+        stats = load_stats("vitals", config_file="test_cache_restore_config.json")
+        assert sorted(stats["hospital_id"].unique()) == ["H001", "H002"], "Stale stats partitions restored"
+        vitals = load_transformed("vitals", config_file="test_cache_restore_config.json")
+        assert sorted(vitals["hospital_id"].unique()) == ["H001", "H002"], "Stale transformed partitions restored"
+    finally:
+        if os.path.exists(config_path):
+            os.remove(config_path)
+        if os.path.exists(test_dir):
+            shutil.rmtree(test_dir)
+
+def test_stage_cache_key_paths():
+    # The same file content under another directory is another input: its rows carry another source_file
+    test_dir = "./data/cache_key_test"
+    with open("./config/test_pipeline_config.json", "r") as f:
+        config_data = json.load(f)
+    config_data.update(input_dir=f"{test_dir}/input", output_dir=f"{test_dir}/output", vitals_file="*/2025-01.csv",
+                       stage_cache=True, cache_dir=f"{test_dir}/cache")
+    config_path = "./config/test_cache_key_config.json"
+    with open(config_path, "w") as f:
+        json.dump(config_data, f)
+
+    os.makedirs(f"{test_dir}/input/h1", exist_ok=True)
+    with open(f"{test_dir}/input/h1/2025-01.csv", "w") as f:
+        f.write("hospital_id;measurement_date;patient_id;vital_type;value;unit;date_of_birth\n")
+    with open(f"{test_dir}/input/lab_results.csv", "w") as f:
+        f.write("hospital_id,test_date,patient_id,test_type,result_value,reference_range,unit,date_of_birth\n")
+
+    try:
+        config = load_config("test_cache_key_config.json")
+        cache = StageCache.from_config(config)
+        first = cache.key("validate_data", config)
+        os.rename(f"{test_dir}/input/h1", f"{test_dir}/input/h2")
+        assert cache.key("validate_data", config) != first, "Inputs at other paths should change the key"
+    finally:
+        if os.path.exists(config_path):
+            os.remove(config_path)
+        if os.path.exists(test_dir):
+            shutil.rmtree(test_dir)
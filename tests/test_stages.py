@@ -0,0 +1,49 @@
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import pytest
+
+from stages import STAGES, SHARD_TASKS, resolve_stage
+
+# Parsing the DAG file may not pull these in, and must stay within the time budget on top of Airflow's own imports
+HEAVY_MODULES = ["numpy", "pandas", "pyarrow", "pydantic"]
+IMPORT_BUDGET_SECONDS = 0.2
+
+PROFILE = """
+import json, sys, time
+{preload}
+before = set(sys.modules)
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+loaded = sorted({{name.split(".")[0] for name in set(sys.modules) - before}} & set({heavy!r}))
+print(json.dumps({{"seconds": elapsed, "heavy": loaded}}))
+"""
+
+def import_profile(module, preload=""):
+    # Import time of a module and the heavy modules it loads, in a fresh interpreter
+    paths = [os.path.abspath("scripts"), os.path.abspath("dags"), os.environ.get("PYTHONPATH")]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, paths)))
+    code = PROFILE.format(preload=preload, module=module, heavy=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+def test_stage_registry():
+    # The registry is light; the stage functions resolve on first use
+    profile = import_profile("stages")
+    assert profile["heavy"] == [], f"stages imported {profile['heavy']}"
+    assert profile["seconds"] < IMPORT_BUDGET_SECONDS, f"Importing stages took {profile['seconds']:.3f} s"
+    for stage, module in (STAGES | SHARD_TASKS).items():
+        function = resolve_stage(stage)
+        assert (function.__module__, function.__name__) == (module, stage), f"Unexpected function for {stage}"
+
+def test_dag_import_budget():
+    if importlib.util.find_spec("airflow") is None:
+        pytest.skip("Airflow is not installed")
+    # Airflow's own imports are the baseline; the DAG file must add no heavy modules on top
+    profile = import_profile("healthcare_pipeline",
+                             preload="from airflow import DAG\nfrom airflow.decorators import task, task_group")
+    assert profile["heavy"] == [], f"The DAG file imported {profile['heavy']}"
+    assert profile["seconds"] < IMPORT_BUDGET_SECONDS, f"Parsing the DAG took {profile['seconds']:.3f} s"